@@ -0,0 +1,28 @@
+"""Recompute the daily attendance rollups behind /attendance/trends from raw records.
+
+Usage:
+    python backfill_rollups.py                                   # every closed session
+    python backfill_rollups.py --from 2025-01-01 --to 2025-07-01 # sessions starting in [from, to)
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime
+
+from server import client, backfill_daily_rollups
+
+
+async def main(date_from, date_to):
+    try:
+        report = await backfill_daily_rollups(date_from, date_to)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat, help="first day, inclusive (UTC)")
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat, help="day after the last (UTC)")
+    args = parser.parse_args()
+    asyncio.run(main(args.date_from, args.date_to))
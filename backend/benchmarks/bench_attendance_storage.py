@@ -0,0 +1,142 @@
+"""Storage size and read latency of per-mark records vs. per-session attendance sheets.
+
+Seeds --sessions sessions of --marks-per-session marks each (drawn from a
+roster of --students) into attendance_records in a scratch
+`<DB_NAME>_storage_bench` database, copies them into attendance_sheets with
+migrate_attendance_storage, then reports for each layout the document and
+index bytes and the latency of the reads the app makes:
+
+    session_marks     students marked in one session (live feed snapshot)
+    student_history   first page of one student's records (/attendance/records)
+    department_marks  marks per student over a department's sessions (ranged analytics)
+    session_counts    marks per session for EXPORT_SESSION_CHUNK sessions (rollups)
+
+Usage:
+    python benchmarks/bench_attendance_storage.py [--sessions 5000] [--marks-per-session 60]
+    python benchmarks/bench_attendance_storage.py --sessions 500 --db memory
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import bson
+
+from common import latency_summary
+
+import server
+
+SEED_BATCH = 10000
+DEPARTMENTS = 10
+TERM_START = datetime(2025, 1, 6, 9, tzinfo=timezone.utc)
+
+
+async def seed(db, sessions: list, students: list, marks_per_session: int):
+    batch = []
+    for i, session_id in enumerate(sessions):
+        start = TERM_START + timedelta(hours=i)
+        for j, student_id in enumerate(random.sample(students, marks_per_session)):
+            batch.append({
+                "id": str(uuid.uuid4()), "session_id": session_id, "student_id": student_id,
+                "marked_at": start + timedelta(seconds=j), "method": "face" if j % 4 == 0 else "qr",
+                "ip_address": None, "location": None, "is_proxy": False
+            })
+            if len(batch) == SEED_BATCH:
+                await db.attendance_records.insert_many(batch, ordered=False)
+                batch = []
+    if batch:
+        await db.attendance_records.insert_many(batch, ordered=False)
+
+
+async def collection_size(db, name: str) -> dict:
+    """BSON bytes of the documents, plus the server's own figures when it reports them"""
+    documents = 0
+    size = 0
+    async for doc in db[name].find({}):
+        documents += 1
+        size += len(bson.encode(doc))
+    result = {"documents": documents, "bson_bytes": size, "bytes_per_mark": None}
+    try:
+        stats = await db.command("collStats", name)
+    except Exception:  # mongomock has no collStats
+        return result
+    result.update({
+        "storage_bytes": stats.get("storageSize"),
+        "index_bytes": stats.get("totalIndexSize"),
+        "indexes": stats.get("indexSizes")
+    })
+    return result
+
+
+async def timed(repeat: int, make_call) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        call = make_call()
+        started = time.perf_counter()
+        await call
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latency_summary(latencies)
+
+
+async def measure(storage: str, sessions: list, students: list, repeat: int) -> dict:
+    server.ATTENDANCE_STORAGE = storage
+    admin = {"id": "bench", "role": server.UserRole.COLLEGE_ADMIN}
+    department = sessions[::DEPARTMENTS]
+    return {
+        "session_marks": await timed(repeat, lambda: server.marked_student_ids(random.choice(sessions))),
+        "student_history": await timed(repeat, lambda: server.get_attendance_records(
+            session_id=None, student_id=random.choice(students), department_id=None, year=None, section=None,
+            date_from=None, date_to=None, limit=server.DEFAULT_PAGE_SIZE, cursor=None, response_format="json",
+            current_user=admin
+        )),
+        "department_marks": await timed(repeat, lambda: server.marks_per_student(department)),
+        "session_counts": await timed(repeat, lambda: server.marks_per_session(random.sample(sessions, min(len(sessions), server.EXPORT_SESSION_CHUNK))))
+    }
+
+
+async def main(args):
+    if args.db == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--db memory needs mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient(tz_aware=True)
+    server.db = server.client[os.environ["DB_NAME"] + "_storage_bench"]
+    sessions = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    students = [str(uuid.uuid4()) for _ in range(args.students)]
+    marks = args.sessions * args.marks_per_session
+    report = {"sessions": args.sessions, "marks": marks, "students": args.students}
+    try:
+        await server.client.drop_database(server.db.name)
+        for collection in ("attendance_records", "attendance_sheets"):
+            await server.db[collection].create_indexes(server.INDEXES[collection])
+        started = time.perf_counter()
+        await seed(server.db, sessions, students, args.marks_per_session)
+        report["seed_seconds"] = round(time.perf_counter() - started, 2)
+        started = time.perf_counter()
+        report["migration"] = await server.migrate_attendance_storage("sheets")
+        report["migration_seconds"] = round(time.perf_counter() - started, 2)
+
+        for storage, collection in (("records", "attendance_records"), ("sheets", "attendance_sheets")):
+            size = await collection_size(server.db, collection)
+            size["bytes_per_mark"] = round((size.get("storage_bytes") or size["bson_bytes"]) / marks, 1)
+            report[storage] = {"size": size, "latency_ms": await measure(storage, sessions, students, args.repeat)}
+    finally:
+        await server.client.drop_database(server.db.name)
+        server.client.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--marks-per-session", type=int, default=60)
+    parser.add_argument("--students", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
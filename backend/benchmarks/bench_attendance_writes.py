@@ -0,0 +1,87 @@
+"""Marks per second and latency for attendance inserts: one insert_one per mark vs. the InsertBatcher.
+
+Runs against the MongoDB in MONGO_URL, in a scratch database (<DB_NAME>_bench)
+that is dropped afterwards. Each mark is a coroutine awaiting its own write,
+as a mark_attendance request would.
+
+Usage:
+    python benchmarks/bench_attendance_writes.py [--marks 5000] [--concurrency 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from common import latency_summary
+
+import server
+
+
+def make_marks(count: int) -> list:
+    sessions = [str(uuid.uuid4()) for _ in range(max(1, count // 60))]
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "session_id": sessions[i % len(sessions)],
+            "student_id": f"student-{i}",
+            "method": "qr",
+            "is_proxy": False
+        }
+        for i in range(count)
+    ]
+
+
+async def run(label: str, write, marks: list, concurrency: int) -> dict:
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+    
+    async def one(doc):
+        async with gate:
+            started = time.perf_counter()
+            await write(doc)
+            latencies.append((time.perf_counter() - started) * 1000)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*[one(doc) for doc in marks])
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": label,
+        "marks": len(marks),
+        "marks_per_second": round(len(marks) / elapsed, 1),
+        "latency_ms": latency_summary(latencies)
+    }
+
+
+async def main(marks: int, concurrency: int, batch_size: int, interval_ms: float):
+    bench_db = server.client[os.environ["DB_NAME"] + "_bench"]
+    collection = bench_db.attendance_records
+    report = []
+    try:
+        await collection.drop()
+        await collection.create_indexes(server.INDEXES["attendance_records"])
+        report.append(await run("direct", collection.insert_one, make_marks(marks), concurrency))
+        
+        await collection.drop()
+        await collection.create_indexes(server.INDEXES["attendance_records"])
+        batcher = server.InsertBatcher(collection, batch_size, interval_ms)
+        batcher.start()
+        result = await run("batched", batcher.submit, make_marks(marks), concurrency)
+        await batcher.stop()
+        result["batches"] = batcher.batches
+        report.append(result)
+    finally:
+        await server.client.drop_database(bench_db.name)
+        server.client.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--marks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=server.ATTENDANCE_BATCH_SIZE)
+    parser.add_argument("--interval-ms", type=float, default=server.ATTENDANCE_BATCH_INTERVAL_MS)
+    args = parser.parse_args()
+    asyncio.run(main(args.marks, args.concurrency, args.batch_size, args.interval_ms))
@@ -0,0 +1,130 @@
+"""Throughput and memory of the attendance export for a large term.
+
+Seeds --records attendance records (60 per session, spread over --students
+students) into a scratch `<DB_NAME>_export_bench` database, then drains the CSV
+and, when pyarrow is installed, the Parquet export generators behind
+/attendance/export, reporting rows per second, bytes produced, time to first
+chunk and the largest chunk. --trace-memory adds the Python heap peak during
+each export (tracemalloc slows the run down noticeably).
+
+Usage:
+    python benchmarks/bench_export.py [--records 1000000] [--students 5000]
+    python benchmarks/bench_export.py --records 5000 --db memory --trace-memory
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import common  # noqa: F401  (puts backend/ on sys.path)
+
+import server
+
+SEED_BATCH = 10000
+MARKS_PER_SESSION = 60
+TERM_START = datetime(2025, 1, 6, 9, tzinfo=timezone.utc)
+
+
+async def seed(db, records: int, students: int):
+    student_ids = [str(uuid.uuid4()) for _ in range(students)]
+    for start in range(0, students, SEED_BATCH):
+        await db.users.insert_many([
+            {"id": student_id, "email": f"student{start + i}@export.bench", "name": f"Student {start + i}", "role": server.UserRole.STUDENT}
+            for i, student_id in enumerate(student_ids[start:start + SEED_BATCH])
+        ])
+
+    session_count = max(1, records // MARKS_PER_SESSION)
+    sessions = [
+        {
+            "id": str(uuid.uuid4()), "college_id": "bench", "department_id": f"dept-{i % 10}", "year": "1st",
+            "section": "A", "session_type": "morning", "subject": "Subject", "is_active": False,
+            "session_date": (TERM_START + timedelta(hours=i)).date().isoformat(), "start_time": TERM_START + timedelta(hours=i)
+        }
+        for i in range(session_count)
+    ]
+    for start in range(0, session_count, SEED_BATCH):
+        await db.sessions.insert_many(sessions[start:start + SEED_BATCH])
+
+    batch = []
+    for i in range(records):
+        session = sessions[i // MARKS_PER_SESSION % session_count]
+        batch.append({
+            "id": str(uuid.uuid4()), "session_id": session["id"],
+            "student_id": student_ids[(i + i // MARKS_PER_SESSION) % students],
+            "method": "qr", "marked_at": session["start_time"] + timedelta(seconds=i % MARKS_PER_SESSION), "is_proxy": False
+        })
+        if len(batch) == SEED_BATCH:
+            await db.attendance_records.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.attendance_records.insert_many(batch, ordered=False)
+
+
+async def drain(label: str, stream, trace_memory: bool) -> dict:
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    first_chunk = None
+    total_bytes = 0
+    largest = 0
+    async for chunk in stream:
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        size = len(chunk.encode() if isinstance(chunk, str) else chunk)
+        total_bytes += size
+        largest = max(largest, size)
+    elapsed = time.perf_counter() - started
+    result = {
+        "format": label,
+        "seconds": round(elapsed, 2),
+        "first_chunk_ms": round((first_chunk or 0) * 1000, 1),
+        "megabytes": round(total_bytes / 1e6, 2),
+        "largest_chunk_kb": round(largest / 1e3, 1)
+    }
+    if trace_memory:
+        result["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        tracemalloc.stop()
+    return result
+
+
+async def main(args):
+    if args.db == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--db memory needs mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"] + "_export_bench"]
+    report = {"records": args.records, "students": args.students, "batch_size": server.EXPORT_BATCH_SIZE, "exports": []}
+    try:
+        await server.client.drop_database(server.db.name)
+        for collection in ("users", "sessions", "attendance_records"):
+            await server.db[collection].create_indexes(server.INDEXES[collection])
+        started = time.perf_counter()
+        await seed(server.db, args.records, args.students)
+        report["seed_seconds"] = round(time.perf_counter() - started, 2)
+
+        query = {"college_id": "bench"}
+        result = await drain("csv", server.export_csv(server.iter_export_batches(query)), args.trace_memory)
+        report["exports"].append({**result, "rows_per_second": round(args.records / result["seconds"])})
+        if server.pq is not None:
+            result = await drain("parquet", server.export_parquet(server.iter_export_batches(query)), args.trace_memory)
+            report["exports"].append({**result, "rows_per_second": round(args.records / result["seconds"])})
+    finally:
+        await server.client.drop_database(server.db.name)
+        server.client.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--trace-memory", action="store_true")
+    asyncio.run(main(parser.parse_args()))
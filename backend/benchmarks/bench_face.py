@@ -0,0 +1,195 @@
+"""Face enrollment/verification latency on CPU, per pipeline stage.
+
+Times decode, detection and embedding for each image, then 1:N cosine matching
+of one probe against N enrolled float32 vectors. Pass --images with a directory
+of face photos for realistic detection numbers; without it a synthetic image is
+used and the embedding runs on a fixed centre crop.
+
+It also reports genuine (same person) and impostor (different people) cosine
+score distributions, the equal error rate, the lowest threshold that keeps the
+false accept rate at or below --target-far, and the error rates at the
+configured FACE_MATCH_THRESHOLD. Pass --pairs with one sub-directory of photos
+per person (the LFW layout) to calibrate on real faces; without it, synthetic
+identities are used: blurred-noise textures, each captured several times with a
+small shift, brightness change, blur and JPEG re-encode.
+
+Usage:
+    python benchmarks/bench_face.py [--images faces/] [--repeat 50] [--enrolled 60,1000,20000]
+    python benchmarks/bench_face.py --pairs people/ --target-far 0.001
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from pathlib import Path
+
+from common import latency_summary
+
+import cv2
+import numpy as np
+
+import faces
+
+
+def synthetic_jpeg(size: int = 640) -> bytes:
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (size, size, 3), dtype=np.uint8), (9, 9), 0)
+    cv2.ellipse(image, (size // 2, size // 2), (size // 5, size // 4), 0, 0, 360, (190, 160, 140), -1)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def synthetic_identities(people: int, captures: int) -> dict:
+    """{person: [embedding, ...]} for textures captured with small changes in pose, light and quality"""
+    rng = np.random.default_rng(2)
+    side = 200
+    identities = {}
+    for person in range(people):
+        texture = cv2.GaussianBlur(rng.integers(0, 255, (side, side), dtype=np.uint8), (9, 9), 0)
+        embeddings = []
+        for _ in range(captures):
+            shift = np.float32([[1, 0, rng.integers(-3, 4)], [0, 1, rng.integers(-3, 4)]])
+            capture = cv2.warpAffine(texture, shift, (side, side), borderMode=cv2.BORDER_REFLECT)
+            capture = np.clip(capture.astype(np.int16) + rng.integers(-25, 26), 0, 255).astype(np.uint8)
+            capture = cv2.GaussianBlur(capture, (3, 3), rng.uniform(0.1, 1.0))
+            capture = cv2.imdecode(cv2.imencode(".jpg", capture, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_GRAYSCALE)
+            embeddings.append(faces.embed_face(capture, (0, 0, side, side)))
+        identities[f"synthetic-{person}"] = embeddings
+    return identities
+
+
+def photo_identities(pairs_dir: str) -> tuple:
+    """({person: [embedding, ...]}, photos without a detectable face) from one directory per person"""
+    identities = {}
+    undetected = 0
+    for person in sorted(p for p in Path(pairs_dir).iterdir() if p.is_dir()):
+        embeddings = []
+        for path in sorted(person.iterdir()):
+            if path.suffix.lower() not in (".jpg", ".jpeg", ".png", ".pgm"):
+                continue
+            results, _ = faces.analyze_image(path.read_bytes(), largest_only=True)
+            if results:
+                embeddings.append(results[0][1])
+            else:
+                undetected += 1
+        if embeddings:
+            identities[person.name] = embeddings
+    return identities, undetected
+
+
+def error_rates(genuine: np.ndarray, impostor: np.ndarray, threshold: float) -> dict:
+    return {
+        "threshold": round(float(threshold), 4),
+        "false_accept_rate": round(float(np.mean(impostor >= threshold)), 5),
+        "false_reject_rate": round(float(np.mean(genuine < threshold)), 5)
+    }
+
+
+def score_distributions(identities: dict, threshold: float, target_far: float, max_impostor: int) -> dict:
+    """Genuine and impostor score percentiles with the thresholds they imply"""
+    genuine = np.array([
+        float(a @ b) for embeddings in identities.values() for a, b in itertools.combinations(embeddings, 2)
+    ])
+    firsts = [embeddings[0] for embeddings in identities.values()]
+    pairs = list(itertools.combinations(range(len(firsts)), 2))
+    if len(pairs) > max_impostor:
+        rng = np.random.default_rng(3)
+        pairs = [pairs[i] for i in rng.choice(len(pairs), max_impostor, replace=False)]
+    impostor = np.array([float(firsts[i] @ firsts[j]) for i, j in pairs])
+    if not len(genuine) or not len(impostor):
+        return {"error": "need at least two people, one of them with two or more photos"}
+
+    percentiles = [0, 1, 5, 50, 95, 99, 100]
+    summary = lambda scores: {f"p{p}": round(float(np.percentile(scores, p)), 4) for p in percentiles}
+    candidates = np.unique(np.concatenate([genuine, impostor]))
+    rates = [(float(np.mean(impostor >= t)), float(np.mean(genuine < t)), t) for t in candidates]
+    equal = min(rates, key=lambda r: abs(r[0] - r[1]))
+    at_target = next((t for far, _, t in rates if far <= target_far), candidates[-1] + 1e-6)
+    return {
+        "people": len(identities),
+        "genuine_pairs": len(genuine),
+        "impostor_pairs": len(impostor),
+        "genuine": summary(genuine),
+        "impostor": summary(impostor),
+        "equal_error_rate": round((equal[0] + equal[1]) / 2, 5),
+        "equal_error_threshold": round(equal[2], 4),
+        "at_target_far": {"target": target_far, **error_rates(genuine, impostor, at_target)},
+        "at_configured": error_rates(genuine, impostor, threshold)
+    }
+
+
+def timed(samples: dict, stage: str, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    samples.setdefault(stage, []).append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def main(images_dir, repeat: int, enrolled_sizes: list, pairs_dir, threshold: float, target_far: float, max_impostor: int):
+    if images_dir:
+        images = [p.read_bytes() for p in sorted(Path(images_dir).iterdir()) if p.suffix.lower() in (".jpg", ".jpeg", ".png")]
+    else:
+        images = [synthetic_jpeg()]
+
+    samples = {}
+    detected = 0
+    embedding = None
+    for _ in range(repeat):
+        for data in images:
+            started = time.perf_counter()
+            gray = timed(samples, "decode", faces.decode_image, data)
+            boxes = timed(samples, "detect", faces.detect_faces, gray)
+            if boxes:
+                detected += 1
+                box = boxes[0]
+            else:
+                side = min(gray.shape) // 2
+                box = ((gray.shape[1] - side) // 2, (gray.shape[0] - side) // 2, side, side)
+            embedding = timed(samples, "embed", faces.embed_face, gray, box)
+            samples.setdefault("enroll_total", []).append((time.perf_counter() - started) * 1000)
+
+    rng = np.random.default_rng(1)
+    matching = {}
+    for n in enrolled_sizes:
+        matrix = rng.random((n, faces.EMBEDDING_SIZE), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            scores = faces.cosine_scores(matrix, embedding)
+            int(np.argmax(scores))
+            runs.append((time.perf_counter() - started) * 1000)
+        matching[str(n)] = latency_summary(runs)
+
+    if pairs_dir:
+        identities, undetected = photo_identities(pairs_dir)
+        scores = {"source": pairs_dir, "photos_without_face": undetected}
+    else:
+        identities = synthetic_identities(people=60, captures=4)
+        scores = {"source": "synthetic"}
+    scores.update(score_distributions(identities, threshold, target_far, max_impostor))
+
+    print(json.dumps({
+        "images": len(images),
+        "repeat": repeat,
+        "faces_detected": detected,
+        "embedding_bytes": faces.EMBEDDING_SIZE * 4,
+        "stages_ms": {stage: latency_summary(values) for stage, values in samples.items()},
+        "match_1_to_n_ms": matching,
+        "scores": scores
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", help="directory of face photos")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--enrolled", default="60,1000,20000", help="comma-separated roster sizes for 1:N matching")
+    parser.add_argument("--pairs", help="directory with one sub-directory of face photos per person")
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.environ.get("FACE_MATCH_THRESHOLD", faces.DEFAULT_MATCH_THRESHOLD)))
+    parser.add_argument("--target-far", type=float, default=0.001, help="false accept rate to pick a threshold for")
+    parser.add_argument("--max-impostor", type=int, default=200000, help="impostor pairs sampled at most")
+    args = parser.parse_args()
+    main(args.images, args.repeat, [int(n) for n in args.enrolled.split(",")], args.pairs, args.threshold,
+         args.target_far, args.max_impostor)
@@ -0,0 +1,73 @@
+"""Event-loop latency during a login storm, with bcrypt inline vs. on the password pool.
+
+Fires N concurrent password verifications (what N simultaneous /auth/login calls
+do after the user lookup) while a probe coroutine measures how late the loop
+wakes it up. That lateness is what every other request in the worker waits.
+
+Usage:
+    python benchmarks/bench_password_pool.py [--logins 500] [--workers 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import latency_summary
+
+import server
+
+PROBE_INTERVAL = 0.005
+
+
+async def probe(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append((time.perf_counter() - started - PROBE_INTERVAL) * 1000)
+
+
+async def storm(logins: int, hashed: str) -> dict:
+    stop = asyncio.Event()
+    samples = []
+    probe_task = asyncio.create_task(probe(stop, samples))
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *[server.verify_password_async("benchmark-password", hashed) for _ in range(logins)],
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    rejected = sum(1 for r in results if isinstance(r, Exception))
+    return {
+        "logins": logins,
+        "rejected_503": rejected,
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round((logins - rejected) / elapsed, 1),
+        "loop_lag_ms": {**latency_summary(samples), "samples": len(samples)}
+    }
+
+
+async def main(logins: int, workers: int):
+    hashed = server.hash_password("benchmark-password")
+    report = {}
+    
+    server.password_executor = None
+    report["inline"] = await storm(logins, hashed)
+    
+    server.password_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+    server.PASSWORD_HASH_MAX_PENDING = logins
+    report[f"pool_{workers}"] = await storm(logins, hashed)
+    server.password_executor.shutdown()
+    
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.workers))
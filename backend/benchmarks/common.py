@@ -0,0 +1,25 @@
+"""Helpers shared by the benchmark scripts."""
+import statistics
+import sys
+from pathlib import Path
+
+# Benchmarks are run as scripts from backend/; make `import server` work from anywhere
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_summary(samples_ms: list) -> dict:
+    if not samples_ms:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "p50": round(statistics.median(samples_ms), 2),
+        "p95": round(percentile(samples_ms, 95), 2),
+        "p99": round(percentile(samples_ms, 99), 2),
+        "max": round(max(samples_ms), 2)
+    }
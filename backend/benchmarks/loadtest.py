@@ -0,0 +1,277 @@
+"""Campus-wide attendance burst against the FastAPI app, reported per route as JSON.
+
+Seeds a university -> colleges -> departments (years/sections) -> faculty ->
+students hierarchy through the public endpoints, has every faculty member open
+a session for their sections, then replays the 08:55 burst: each student logs
+in, lists their sessions and marks attendance, with bounded concurrency.
+
+Requests go through httpx's ASGI transport straight into `server.app`, so the
+numbers cover the handlers and the database but not the network or uvicorn.
+The database is a scratch `<DB_NAME>_loadtest` on MONGO_URL (dropped afterwards
+unless --keep), or mongomock-motor with --db memory.
+
+Usage:
+    python benchmarks/loadtest.py --students 20000 --output run.json
+    python benchmarks/loadtest.py --students 2000 --db memory --bcrypt-rounds 4
+    python benchmarks/loadtest.py --output new.json --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+from common import latency_summary
+
+import httpx
+from passlib.context import CryptContext
+
+import server
+
+YEARS = ["1st", "2nd", "3rd", "4th"]
+SECTIONS = ["A", "B", "C"]
+PASSWORD = "loadtest-password"
+
+
+class Recorder:
+    """Collects latencies and failures per route template"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.windows = {}
+
+    async def call(self, http: httpx.AsyncClient, method: str, route: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        finished = time.perf_counter()
+        key = f"{method} {route}"
+        self.latencies[key].append((finished - started) * 1000)
+        self.statuses[key][response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[key] += 1
+        first, last = self.windows.get(key, (started, finished))
+        self.windows[key] = (min(first, started), max(last, finished))
+        return response
+
+    def report(self) -> dict:
+        routes = {}
+        for key, samples in sorted(self.latencies.items()):
+            first, last = self.windows[key]
+            routes[key] = {
+                "count": len(samples),
+                "errors": self.errors[key],
+                "statuses": dict(self.statuses[key]),
+                "throughput_rps": round(len(samples) / max(last - first, 1e-9), 1),
+                "latency_ms": latency_summary(samples)
+            }
+        return routes
+
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def bounded(concurrency: int, coroutines):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def run(coroutine):
+        async with gate:
+            return await coroutine
+
+    return await asyncio.gather(*[run(c) for c in coroutines])
+
+
+async def register(http, recorder, **fields) -> dict:
+    response = await recorder.call(http, "POST", "/api/auth/register", "/api/auth/register", json={"password": PASSWORD, **fields})
+    response.raise_for_status()
+    return response.json()
+
+
+async def seed(http, recorder, args) -> dict:
+    """Build the hierarchy through the API; returns students and sessions to drive the burst"""
+    admin = await register(http, recorder, email="admin@loadtest.edu", name="Admin", role=server.UserRole.UNIVERSITY_ADMIN)
+    headers = auth(admin["access_token"])
+    university = (await recorder.call(
+        http, "POST", "/api/universities", "/api/universities",
+        json={"name": "Load Test University", "address": "Campus"}, headers=headers
+    )).json()
+
+    departments = []
+    for c in range(args.colleges):
+        college = (await recorder.call(
+            http, "POST", "/api/colleges", "/api/colleges",
+            json={"name": f"College {c}", "university_id": university["id"]}, headers=headers
+        )).json()
+        college_admin = await register(
+            http, recorder, email=f"college{c}@loadtest.edu", name=f"College Admin {c}",
+            role=server.UserRole.COLLEGE_ADMIN, university_id=university["id"], college_id=college["id"]
+        )
+        for d in range(args.departments):
+            department = (await recorder.call(
+                http, "POST", "/api/departments", "/api/departments",
+                json={"name": f"Department {c}.{d}", "college_id": college["id"], "years": YEARS, "sections": SECTIONS},
+                headers=auth(college_admin["access_token"])
+            )).json()
+            departments.append(department)
+
+    scopes = [(dept, year, section) for dept in departments for year in YEARS for section in SECTIONS]
+
+    faculty = await bounded(args.concurrency, [
+        register(
+            http, recorder, email=f"faculty{i}@loadtest.edu", name=f"Faculty {i}", role=server.UserRole.FACULTY,
+            college_id=dept["college_id"], department_id=dept["id"], subject="Subject"
+        )
+        for i, (dept, _, _) in enumerate(scopes)
+    ])
+
+    students = await bounded(args.concurrency, [
+        register(
+            http, recorder, email=f"student{i}@loadtest.edu", name=f"Student {i}", role=server.UserRole.STUDENT,
+            college_id=scopes[i % len(scopes)][0]["college_id"], department_id=scopes[i % len(scopes)][0]["id"],
+            year=scopes[i % len(scopes)][1], section=scopes[i % len(scopes)][2]
+        )
+        for i in range(args.students)
+    ])
+
+    # One session per section, opened by that section's faculty member
+    async def open_session(member, scope):
+        dept, year, section = scope
+        response = await recorder.call(
+            http, "POST", "/api/sessions", "/api/sessions",
+            json={"department_id": dept["id"], "session_type": "morning", "session_date": "2025-01-06", "year": year, "section": section},
+            headers=auth(member["access_token"])
+        )
+        response.raise_for_status()
+        return response.json()
+
+    sessions = await bounded(args.concurrency, [open_session(member, scope) for member, scope in zip(faculty, scopes)])
+    session_by_scope = {(s["department_id"], s["year"], s["section"]): s for s in sessions}
+    return {"faculty": faculty, "students": students, "session_by_scope": session_by_scope}
+
+
+async def student_flow(http, recorder, student: dict, session: dict):
+    user = student["user"]
+    login = await recorder.call(
+        http, "POST", "/api/auth/login", "/api/auth/login", json={"email": user["email"], "password": PASSWORD}
+    )
+    if login.status_code != 200:
+        return
+    headers = auth(login.json()["access_token"])
+    await recorder.call(http, "GET", "/api/sessions", "/api/sessions", headers=headers)
+    await recorder.call(
+        http, "POST", "/api/attendance/mark", "/api/attendance/mark",
+        json={"session_id": session["id"], "method": "qr", "qr_token": server.session_qr_payload(session)},
+        headers=headers
+    )
+
+
+def use_database(args):
+    if args.db == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--db memory needs mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"] + "_loadtest"]
+    if server.attendance_batcher is not None:
+        server.attendance_batcher.collection = server.marks_collection()
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose p99 regressed by more than tolerance (a fraction) against the baseline"""
+    regressions = []
+    for route, stats in current["burst"].items():
+        before = baseline.get("burst", {}).get(route)
+        if not before or not before["latency_ms"]["p99"] or stats["latency_ms"]["p99"] is None:
+            continue
+        change = stats["latency_ms"]["p99"] / before["latency_ms"]["p99"] - 1
+        if change > tolerance:
+            regressions.append({
+                "route": route,
+                "baseline_p99_ms": before["latency_ms"]["p99"],
+                "current_p99_ms": stats["latency_ms"]["p99"],
+                "change": round(change, 3)
+            })
+    return regressions
+
+
+async def main(args) -> int:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=args.bcrypt_rounds)
+    use_database(args)
+    await server.db.client.drop_database(server.db.name)
+    await server.app.router.startup()
+
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as http:
+            seed_recorder = Recorder()
+            started = time.perf_counter()
+            seeded = await seed(http, seed_recorder, args)
+            seed_seconds = time.perf_counter() - started
+
+            burst_recorder = Recorder()
+            started = time.perf_counter()
+            await bounded(args.concurrency, [
+                student_flow(
+                    http, burst_recorder, student,
+                    seeded["session_by_scope"][(student["user"]["department_id"], student["user"]["year"], student["user"]["section"])]
+                )
+                for student in seeded["students"]
+            ])
+            burst_seconds = time.perf_counter() - started
+    finally:
+        await server.app.router.shutdown()
+        if not args.keep:
+            await server.db.client.drop_database(server.db.name)
+
+    report = {
+        "config": {
+            "db": args.db,
+            "colleges": args.colleges,
+            "departments_per_college": args.departments,
+            "students": args.students,
+            "concurrency": args.concurrency,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "qr_token_mode": server.QR_TOKEN_MODE,
+            "attendance_write_mode": server.ATTENDANCE_WRITE_MODE,
+            "attendance_storage": server.ATTENDANCE_STORAGE
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "burst_seconds": round(burst_seconds, 2),
+        "seed": seed_recorder.report(),
+        "burst": burst_recorder.report()
+    }
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--colleges", type=int, default=2)
+    parser.add_argument("--departments", type=int, default=5, help="departments per college")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="lower to seed faster; 12 matches production")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    parser.add_argument("--output", help="write the JSON report here as well")
+    parser.add_argument("--compare", help="baseline report; exit 1 if any burst route's p99 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p99 regression as a fraction")
+    sys.exit(asyncio.run(main(parser.parse_args())))
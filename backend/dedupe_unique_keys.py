@@ -0,0 +1,33 @@
+"""Remove or report the duplicates that stop the startup unique indexes from being built.
+
+Duplicate marks are deleted, keeping the earliest; duplicate user emails are
+only listed, for cleaning up by hand. Run rebuild_summaries.py after deleting.
+
+Usage:
+    python dedupe_unique_keys.py            # delete duplicate marks and print the report
+    python dedupe_unique_keys.py --check    # report only, exit 1 if anything is duplicated
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import client, dedupe_unique_keys
+
+
+async def main(check: bool) -> int:
+    try:
+        report = await dedupe_unique_keys(apply=not check)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+    if check and report:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only report duplicates, do not delete")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.check)))
@@ -0,0 +1,172 @@
+"""CPU-only face detection and embedding.
+
+Faces are found with OpenCV's bundled Haar cascade and described with
+uniform local binary pattern (LBP) histograms over a grid of cells, which are
+Hellinger-normalised into unit float32 vectors so cosine similarity is a dot
+product. Kept free of server imports so it can run in worker processes
+(see analyze_image).
+"""
+import time
+
+import cv2
+import numpy as np
+
+EMBEDDING_VERSION = "lbp-u2-4x4-v1"
+# Hellinger-normalised LBP histograms share most of their mass, so cosine scores
+# crowd into roughly 0.96-0.99 and even unrelated textures score about 0.97. This
+# default sits between the genuine and impostor distributions that
+# benchmarks/bench_face.py measures on its synthetic identities (genuine p5 0.976,
+# impostor max 0.974). That 0.002 gap is no real margin, so the server keeps marking
+# by face alone off (FACE_MARKING_ENABLED) by default. It is a starting point, not a
+# calibration: run the benchmark with --pairs on real enrolment photos and set
+# FACE_MATCH_THRESHOLD from its report before turning face marking on.
+DEFAULT_MATCH_THRESHOLD = 0.975
+FACE_SIZE = 96
+GRID = 4
+MAX_IMAGE_SIDE = 1024
+MIN_FACE_SIZE = 40
+
+_cascade = None
+
+
+class FaceError(ValueError):
+    """Raised when an image cannot be decoded or contains no usable face"""
+
+
+def _uniform_lbp_table() -> np.ndarray:
+    """Map 8-bit LBP codes to 59 bins: one per uniform pattern, one shared for the rest"""
+    table = np.full(256, 58, dtype=np.int64)
+    next_bin = 0
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        transitions = sum(bits[i] != bits[(i + 1) % 8] for i in range(8))
+        if transitions <= 2:
+            table[code] = next_bin
+            next_bin += 1
+    return table
+
+
+LBP_BINS = 59
+LBP_TABLE = _uniform_lbp_table()
+EMBEDDING_SIZE = GRID * GRID * LBP_BINS
+
+
+def _cell_index() -> np.ndarray:
+    side = FACE_SIZE - 2
+    rows = np.minimum(np.arange(side) * GRID // side, GRID - 1)
+    return (rows[:, None] * GRID + rows[None, :]) * LBP_BINS
+
+
+CELL_INDEX = _cell_index()
+
+
+def get_cascade():
+    global _cascade
+    if _cascade is None:
+        _cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return _cascade
+
+
+def decode_image(data: bytes, max_side: int = MAX_IMAGE_SIDE) -> np.ndarray:
+    """Decode image bytes into a grayscale array no larger than max_side"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise FaceError("Unsupported or corrupt image")
+    scale = max_side / max(image.shape)
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def detect_faces(gray: np.ndarray) -> list:
+    """Face boxes (x, y, w, h), largest first"""
+    boxes = get_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(MIN_FACE_SIZE, MIN_FACE_SIZE))
+    return sorted((tuple(int(v) for v in box) for box in boxes), key=lambda b: b[2] * b[3], reverse=True)
+
+
+def embed_face(gray: np.ndarray, box: tuple) -> np.ndarray:
+    """Unit-length float32 LBP descriptor of one face"""
+    x, y, w, h = box
+    face = cv2.resize(gray[y:y + h, x:x + w], (FACE_SIZE, FACE_SIZE), interpolation=cv2.INTER_AREA)
+    face = cv2.equalizeHist(face).astype(np.int16)
+
+    center = face[1:-1, 1:-1]
+    codes = np.zeros(center.shape, dtype=np.int64)
+    neighbours = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+    for bit, (dy, dx) in enumerate(neighbours):
+        neighbour = face[1 + dy:FACE_SIZE - 1 + dy, 1 + dx:FACE_SIZE - 1 + dx]
+        codes |= (neighbour >= center).astype(np.int64) << bit
+
+    histogram = np.bincount((CELL_INDEX + LBP_TABLE[codes]).ravel(), minlength=EMBEDDING_SIZE).astype(np.float32)
+    vector = np.sqrt(histogram / histogram.sum())
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def analyze_image(data: bytes, largest_only: bool = False) -> tuple:
+    """Decode, detect and embed in one call, suitable for a worker process.
+
+    Returns ([(box, embedding), ...], {stage: milliseconds}); with largest_only
+    just the largest face, if any, is embedded.
+    """
+    timings = {}
+    started = time.perf_counter()
+    gray = decode_image(data)
+    timings["decode"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    boxes = detect_faces(gray)
+    timings["detect"] = (time.perf_counter() - started) * 1000
+    if largest_only:
+        boxes = boxes[:1]
+
+    started = time.perf_counter()
+    results = [(box, embed_face(gray, box)) for box in boxes]
+    timings["embed"] = (time.perf_counter() - started) * 1000
+    return results, timings
+
+
+def assign_faces(scores: np.ndarray, threshold: float, margin: float = 0.0) -> dict:
+    """One-to-one assignment of faces (columns) to roster rows.
+
+    Returns {face_index: row_index}. A face is only ever assigned to its best
+    row, and only when that score is at least threshold and beats the face's
+    second-best row by at least margin; when two faces share a best row the
+    higher-scoring one keeps it. Ambiguous faces are left unassigned rather than
+    given to a runner-up.
+    """
+    if not scores.size:
+        return {}
+    best_rows = np.argmax(scores, axis=0)
+    best = scores[best_rows, np.arange(scores.shape[1])]
+    second = np.sort(scores, axis=0)[-2] if scores.shape[0] > 1 else np.full_like(best, -np.inf)
+    eligible = np.nonzero((best >= threshold) & (best - second >= margin))[0]
+
+    assignment = {}
+    used_rows = set()
+    for col in eligible[np.argsort(-best[eligible], kind="stable")]:
+        row = int(best_rows[col])
+        if row not in used_rows:
+            assignment[int(col)] = row
+            used_rows.add(row)
+    return assignment
+
+
+def best_margins(scores: np.ndarray) -> np.ndarray:
+    """Per face (column), how far its best row's score is ahead of the second-best"""
+    if scores.shape[0] < 2:
+        return np.full(scores.shape[1], np.inf)
+    ordered = np.sort(scores, axis=0)
+    return ordered[-1] - ordered[-2]
+
+
+def pack_embedding(vector: np.ndarray) -> bytes:
+    return vector.astype("<f4").tobytes()
+
+
+def unpack_embedding(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<f4")
+
+
+def cosine_scores(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """Cosine similarity of vector against each row; rows and vector are unit length"""
+    return matrix @ vector
@@ -0,0 +1,36 @@
+"""Copy attendance marks between per-mark records and per-session sheets.
+
+Usage:
+    python migrate_attendance_storage.py --to sheets           # copy records into sheets
+    python migrate_attendance_storage.py --to records          # copy sheets back into records
+    python migrate_attendance_storage.py --to sheets --check   # count only, exit 1 if marks are missing from the target
+
+Switching to sheets: run the copy, set ATTENDANCE_STORAGE=sheets and restart,
+then run the copy again for marks written in between. Drop attendance_records
+once `--check` passes.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import client, migrate_attendance_storage
+
+
+async def main(target: str, check: bool) -> int:
+    try:
+        report = await migrate_attendance_storage(target, apply=not check)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+    if check and report["target_marks_before"] < report["source_marks"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--to", dest="target", choices=["sheets", "records"], required=True)
+    parser.add_argument("--check", action="store_true", help="only count marks, do not write")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.target, args.check)))
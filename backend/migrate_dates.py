@@ -0,0 +1,30 @@
+"""Convert ISO-string timestamps written by older versions into BSON dates.
+
+Usage:
+    python migrate_dates.py            # convert and print counts per field
+    python migrate_dates.py --check    # count only, exit 1 if anything is left to convert
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import client, migrate_string_dates
+
+
+async def main(check: bool) -> int:
+    try:
+        report = await migrate_string_dates(apply=not check)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+    if check and any(counts["converted"] for counts in report.values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only count string timestamps, do not write")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.check)))
@@ -0,0 +1,16 @@
+"""bcrypt hashing for worker processes.
+
+Kept free of server imports so bulk imports can hash in a process pool without
+each worker opening its own MongoDB client.
+"""
+from passlib.context import CryptContext
+
+_contexts = {}
+
+
+def hash_many(passwords: list, rounds: int) -> list:
+    """bcrypt hashes of passwords, in order, at the given cost"""
+    context = _contexts.get(rounds)
+    if context is None:
+        context = _contexts[rounds] = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return [context.hash(password) for password in passwords]
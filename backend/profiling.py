@@ -0,0 +1,149 @@
+"""Opt-in request profiling and slow-request logging.
+
+A profiled request runs with a sampler thread that snapshots the event-loop
+thread's stack every few milliseconds and writes the samples as folded stacks
+(one "frame;frame;frame count" line per unique stack). flamegraph.pl, inferno
+and speedscope all read that format. The sampler sees the whole loop, so requests
+running at the same time show up too; profile on a quiet instance where possible.
+
+Every request also collects its MongoDB commands through metrics.command_trace.
+Requests slower than the threshold are logged with a per-collection breakdown.
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval until stopped"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+def summarize_commands(trace: list) -> list:
+    """Aggregate a command trace by (collection, command), slowest first"""
+    totals = {}
+    for collection, command, elapsed_ms, documents, failed in trace:
+        entry = totals.setdefault((collection, command), {"count": 0, "ms": 0.0, "documents": 0, "failed": 0})
+        entry["count"] += 1
+        entry["ms"] += elapsed_ms
+        entry["documents"] += documents
+        entry["failed"] += failed
+    return sorted(
+        ({"collection": collection, "command": command, **entry, "ms": round(entry["ms"], 2)}
+         for (collection, command), entry in totals.items()),
+        key=lambda entry: entry["ms"], reverse=True
+    )
+
+
+class ProfilingMiddleware:
+    """Profiles requests on demand and logs slow ones.
+
+    A request is profiled when it carries `X-Profile: 1` and authorize(headers)
+    allows it, or at random with probability sample_rate. Only one request is
+    profiled at a time; others asking while it runs are served normally. The
+    response of a profiled request carries X-Profile-Id, naming the file written.
+    """
+
+    def __init__(self, app, authorize, profile_dir: str, sample_rate: float = 0.0,
+                 interval_ms: float = 5.0, slow_ms: float = 1000.0):
+        self.app = app
+        self.authorize = authorize
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.slow_ms = slow_ms
+        self._busy = threading.Lock()
+
+    def wants_profile(self, scope) -> bool:
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        if headers.get(PROFILE_HEADER) == "1":
+            return self.authorize(headers)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile_id = None
+        if self.wants_profile(scope) and self._busy.acquire(blocking=False):
+            profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        async def send_wrapper(message):
+            if profile_id and message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", profile_id.encode()))
+            await send(message)
+
+        trace = []
+        token = metrics.command_trace.set(trace)
+        sampler = None
+        if profile_id:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.command_trace.reset(token)
+            route = getattr(scope.get("route"), "path", scope["path"])
+            if sampler is not None:
+                try:
+                    self.save_profile(profile_id, scope["method"], route, sampler.stop())
+                finally:
+                    self._busy.release()
+            if profile_id or elapsed_ms >= self.slow_ms:
+                self.log_request(scope["method"], route, elapsed_ms, trace, profile_id)
+
+    def save_profile(self, profile_id: str, method: str, route: str, stacks: Counter):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9]+", "_", f"{method}_{route}").strip("_")
+        path = os.path.join(self.profile_dir, f"{profile_id}-{name}.folded")
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Saved profile %s (%d samples)", path, sum(stacks.values()))
+
+    def log_request(self, method: str, route: str, elapsed_ms: float, trace: list, profile_id):
+        commands = summarize_commands(trace)
+        mongo_ms = sum(entry["ms"] for entry in commands)
+        logger.log(
+            logging.WARNING if elapsed_ms >= self.slow_ms else logging.INFO,
+            "%s %s %s took %.1f ms; %d MongoDB commands took %.1f ms: %s",
+            "Slow request" if elapsed_ms >= self.slow_ms else "Profiled request", method, route, elapsed_ms,
+            len(trace), mongo_ms,
+            ", ".join(f"{e['collection']}.{e['command']} x{e['count']} {e['ms']} ms {e['documents']} docs" for e in commands) or "none"
+        )
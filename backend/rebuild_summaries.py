@@ -0,0 +1,30 @@
+"""Recompute attendance_summaries from attendance_records and report drift.
+
+Usage:
+    python rebuild_summaries.py            # rebuild and print the drift report
+    python rebuild_summaries.py --check    # report drift only, exit 1 if any
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import client, rebuild_attendance_summaries
+
+
+async def main(check: bool) -> int:
+    try:
+        report = await rebuild_attendance_summaries(apply=not check)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+    if check and (report["missing"] or report["drifted"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only report drift, do not write")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.check)))
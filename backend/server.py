@@ -1,36 +1,271 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from bson import Binary, json_util
+from bson.binary import UUID_SUBTYPE
+import numpy as np
 import os
 import logging
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import qrcode
-from io import BytesIO
+import qrcode.image.svg
+from functools import lru_cache
+from collections import OrderedDict
+from io import BytesIO, StringIO
 import base64
+import csv
 import json
 import hashlib
+import faces
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+import metrics
+import profiling
+import passwords
+import hmac
+import heapq
+import time
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Timestamps are stored as BSON dates and read back as aware UTC datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[metrics.MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
+# Indexes applied at startup, keyed by collection
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("role", ASCENDING), ("department_id", ASCENDING), ("year", ASCENDING), ("section", ASCENDING)]),
+        IndexModel([("college_id", ASCENDING), ("role", ASCENDING)]),
+        IndexModel([("token_version_updated_at", ASCENDING)], sparse=True),
+    ],
+    "universities": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "colleges": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("university_id", ASCENDING)]),
+    ],
+    "departments": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("college_id", ASCENDING)]),
+    ],
+    "sessions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([
+            ("department_id", ASCENDING),
+            ("session_type", ASCENDING),
+            ("session_date", ASCENDING),
+            ("year", ASCENDING),
+            ("section", ASCENDING),
+            ("is_active", ASCENDING),
+        ]),
+        IndexModel([("faculty_id", ASCENDING), ("start_time", DESCENDING)]),
+        IndexModel([("college_id", ASCENDING), ("start_time", DESCENDING)]),
+        IndexModel([("department_id", ASCENDING), ("start_time", DESCENDING)]),
+        IndexModel([("department_id", ASCENDING), ("year", ASCENDING), ("section", ASCENDING), ("start_time", DESCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("expires_at", ASCENDING)]),
+    ],
+    "attendance_records": [
+        IndexModel([("session_id", ASCENDING), ("student_id", ASCENDING)], unique=True),
+        IndexModel([("student_id", ASCENDING), ("marked_at", DESCENDING)]),
+    ],
+    "attendance_sheets": [
+        IndexModel([("students", ASCENDING)]),
+    ],
+    "attendance_summaries": [
+        IndexModel([("student_id", ASCENDING)], unique=True),
+        IndexModel([("department_id", ASCENDING), ("year", ASCENDING), ("section", ASCENDING)]),
+        IndexModel([("college_id", ASCENDING)]),
+    ],
+    "attendance_daily": [
+        IndexModel([
+            ("day", ASCENDING),
+            ("college_id", ASCENDING),
+            ("department_id", ASCENDING),
+            ("year", ASCENDING),
+            ("section", ASCENDING),
+            ("subject", ASCENDING),
+        ], unique=True),
+        IndexModel([("college_id", ASCENDING), ("day", ASCENDING)]),
+        IndexModel([("department_id", ASCENDING), ("day", ASCENDING)]),
+    ],
+}
+
+# Timestamp fields stored as BSON dates; documents written before that hold ISO strings (see migrate_dates.py)
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "universities": ["created_at"],
+    "colleges": ["created_at"],
+    "departments": ["created_at"],
+    "sessions": ["start_time", "end_time", "created_at"],
+    "attendance_records": ["marked_at"],
+}
+
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# User fields signed into access tokens so most requests skip the user lookup
+TOKEN_CLAIMS = ("email", "name", "role", "university_id", "college_id", "department_id", "year", "section", "subject")
+# How often each worker picks up token_version bumps made by other workers
+TOKEN_VERSION_SYNC_SECONDS = float(os.environ.get("TOKEN_VERSION_SYNC_SECONDS", "10"))
+
+# List endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+USER_SORT = [("_id", ASCENDING)]
+SESSION_SORT = [("start_time", DESCENDING), ("_id", DESCENDING)]
+RECORD_SORT = [("_id", ASCENDING)]
+
+# Attendance export: sessions joined per records query, and rows per CSV chunk / Parquet row group
+EXPORT_SESSION_CHUNK = int(os.environ.get("EXPORT_SESSION_CHUNK", "200"))
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_NAME_CACHE_SIZE = int(os.environ.get("EXPORT_NAME_CACHE_SIZE", "50000"))
+EXPORT_COLUMNS = [
+    "student_id", "student_name", "department_id", "year", "section", "session_id", "session_date",
+    "session_type", "subject", "method", "marked_at", "is_proxy"
+]
+EXPORT_SESSION_PROJECTION = {"_id": 0, "id": 1, "department_id": 1, "year": 1, "section": 1, "session_date": 1, "session_type": 1, "subject": 1}
+EXPORT_RECORD_PROJECTION = {"_id": 0, "session_id": 1, "student_id": 1, "method": 1, "marked_at": 1, "is_proxy": 1}
+SESSION_LIST_PROJECTION = {"qr_code": 0}  # legacy documents still carry the rendered PNG
+
+# Dashboards: one request per page load; lists stop at DASHBOARD_LIST_LIMIT rows and totals are counted separately
+DASHBOARD_LIST_LIMIT = int(os.environ.get("DASHBOARD_LIST_LIMIT", "1000"))
+DASHBOARD_DEPARTMENT_FIELDS = ("id", "name", "years", "sections")
+DASHBOARD_USER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "email": 1, "subject": 1, "year": 1, "section": 1, "is_active": 1}
+DASHBOARD_SESSION_PROJECTION = {
+    "_id": 0, "id": 1, "faculty_id": 1, "session_date": 1, "session_type": 1, "subject": 1,
+    "year": 1, "section": 1, "start_time": 1, "end_time": 1, "is_active": 1, "expires_at": 1
+}
+DASHBOARD_RECORD_FIELDS = ("id", "session_id", "marked_at", "method")
+
+# QR images
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", "256"))
+QR_CACHE_MAX_AGE = int(os.environ.get("QR_CACHE_MAX_AGE", "300"))
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# QR tokens: "static" stores one token per session, "rotating" signs a fresh
+# HMAC token every QR_ROTATION_SECONDS that mark_attendance checks without a DB read
+QR_TOKEN_MODE = os.environ.get("QR_TOKEN_MODE", "static")
+QR_ROTATION_SECONDS = int(os.environ.get("QR_ROTATION_SECONDS", "30"))
+QR_TOKEN_GRACE_WINDOWS = int(os.environ.get("QR_TOKEN_GRACE_WINDOWS", "1"))
+QR_SIGNING_KEY = os.environ.get("QR_SIGNING_KEY", SECRET_KEY).encode()
+
+# bcrypt runs in a thread pool (it releases the GIL); 0 workers hashes inline on the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "256"))
+PASSWORD_HASH_RETRY_AFTER = int(os.environ.get("PASSWORD_HASH_RETRY_AFTER", "2"))
+password_executor = (
+    ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+    if PASSWORD_HASH_WORKERS > 0 else None
+)
+password_pending = 0
+
+# Bulk imports hash in their own process pool so a large file doesn't starve logins
+IMPORT_HASH_WORKERS = int(os.environ.get("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+IMPORT_HASH_CHUNK = int(os.environ.get("IMPORT_HASH_CHUNK", "32"))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+import_executor = None
+
+face_executor = None
+face_pending = 0
+face_stage_stats = {}
+
+# user_id -> newest token_version this worker knows of; tokens signed with an older one are rejected
+token_versions = {}
+
+# Session metadata cache for mark_attendance; the TTL bounds staleness across workers
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "2048"))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "5"))
+SESSION_CACHE_CHANGE_STREAM = os.environ.get("SESSION_CACHE_CHANGE_STREAM", "false").lower() == "true"
+# Live attendance feed; with several workers, feed each from the attendance change stream
+LIVE_FEED_CHANGE_STREAM = os.environ.get("LIVE_FEED_CHANGE_STREAM", "false").lower() == "true"
+LIVE_FEED_QUEUE_SIZE = int(os.environ.get("LIVE_FEED_QUEUE_SIZE", "256"))
+LIVE_FEED_KEEPALIVE = float(os.environ.get("LIVE_FEED_KEEPALIVE", "15"))
+SESSION_META_PROJECTION = {
+    "_id": 0, "id": 1, "is_active": 1, "college_id": 1, "department_id": 1, "faculty_id": 1,
+    "year": 1, "section": 1, "qr_token": 1, "qr_mode": 1, "start_time": 1, "expires_at": 1
+}
+
+# Sessions close SESSION_DURATION_MINUTES after they start unless created with their own
+# duration_minutes; 0 leaves sessions without one open until they are ended by hand
+SESSION_DURATION_MINUTES = int(os.environ.get("SESSION_DURATION_MINUTES", "90"))
+MAX_SESSION_DURATION_MINUTES = 24 * 60
+# Each worker also schedules sessions any worker created that fall due within the next sweep
+SESSION_EXPIRY_SWEEP_SECONDS = float(os.environ.get("SESSION_EXPIRY_SWEEP_SECONDS", "60"))
+
+# Attendance writes: "direct" inserts per request, "batched" queues marks and
+# flushes them with insert_many every ATTENDANCE_BATCH_INTERVAL_MS or ATTENDANCE_BATCH_SIZE records
+ATTENDANCE_WRITE_MODE = os.environ.get("ATTENDANCE_WRITE_MODE", "direct")
+ATTENDANCE_BATCH_SIZE = int(os.environ.get("ATTENDANCE_BATCH_SIZE", "500"))
+ATTENDANCE_BATCH_INTERVAL_MS = float(os.environ.get("ATTENDANCE_BATCH_INTERVAL_MS", "5"))
+# Attendance storage: "records" keeps one attendance_records document per mark, "sheets" one
+# attendance_sheets document per session with packed student ids (see migrate_attendance_storage.py)
+ATTENDANCE_STORAGE = os.environ.get("ATTENDANCE_STORAGE", "records")
+
+# Universities, colleges and departments are cached per worker; the shared
+# version stamp in cache_versions is re-checked at most every REFERENCE_CACHE_TTL seconds
+REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL", "30"))
+
+# Face verification: cosine similarity of LBP embeddings needed to accept a match;
+# see faces.DEFAULT_MATCH_THRESHOLD for how the default was chosen and how to calibrate it
+FACE_MATCH_THRESHOLD = float(os.environ.get("FACE_MATCH_THRESHOLD", str(faces.DEFAULT_MATCH_THRESHOLD)))
+# Marks written on the strength of a face match alone (students' "face" method and classroom
+# auto-marking) stay off until benchmarks/bench_face.py shows a real gap between genuine and
+# impostor scores on enrolment photos; faculty can still confirm classroom suggestions
+FACE_MARKING_ENABLED = os.environ.get("FACE_MARKING_ENABLED", "false").lower() == "true"
+# Classroom photos: a face is only matched when its best student beats the runner-up by
+# FACE_MATCH_MARGIN. Matches are returned as suggestions unless FACE_CLASS_AUTO_MARK is on
+FACE_MATCH_MARGIN = float(os.environ.get("FACE_MATCH_MARGIN", "0.005"))
+FACE_CLASS_AUTO_MARK = FACE_MARKING_ENABLED and os.environ.get("FACE_CLASS_AUTO_MARK", "false").lower() == "true"
+# Image decode/detect/embed runs in a process pool; 0 workers processes inline on the event loop
+FACE_PROCESS_WORKERS = int(os.environ.get("FACE_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+FACE_MAX_PENDING = int(os.environ.get("FACE_MAX_PENDING", "64"))
+FACE_TASK_TIMEOUT = float(os.environ.get("FACE_TASK_TIMEOUT", "30"))
+FACE_UPLOAD_MAX_BYTES = int(os.environ.get("FACE_UPLOAD_MAX_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# Per-section embedding matrices for classroom photos; enroll_face invalidates locally, the TTL elsewhere
+ROSTER_INDEX_SIZE = int(os.environ.get("ROSTER_INDEX_SIZE", "256"))
+ROSTER_INDEX_TTL = float(os.environ.get("ROSTER_INDEX_TTL", "300"))
+
+# /metrics is open unless METRICS_TOKEN is set, in which case scrapers send it as a bearer token
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+# Admins profile a request by sending X-Profile: 1; PROFILE_SAMPLE_RATE profiles a random fraction of all requests
+PROFILE_DIR = os.environ.get("PROFILE_DIR", str(ROOT_DIR / "profiles"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "1000"))
+
+# Time spent in CPU-bound stages (bcrypt, QR rendering, face processing), queueing included
+stage_duration = metrics.registry.histogram("app_stage_duration_seconds", "Time spent in expensive request stages", ("stage",))
 
 security = HTTPBearer()
 
@@ -65,7 +300,9 @@ class User(BaseModel):
     section: Optional[str] = None  # A, B, C, etc.
     subject: Optional[str] = None  # For faculty
     is_active: bool = True
-    face_embedding: Optional[str] = None
+    token_version: int = 0  # bumped to revoke issued tokens
+    face_embedding: Optional[bytes] = None  # packed little-endian float32, see faces.pack_embedding
+    face_embedding_version: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class University(BaseModel):
@@ -106,8 +343,9 @@ class AttendanceSession(BaseModel):
     session_date: str
     start_time: datetime
     end_time: Optional[datetime] = None
-    qr_code: Optional[str] = None
+    expires_at: Optional[datetime] = None  # closed by the expiry scheduler at this time
     qr_token: Optional[str] = None  # Token for verification
+    qr_mode: str = "static"  # static or rotating
     is_active: bool = True
     location: Optional[dict] = None  # Geo-location
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -145,6 +383,10 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str
     user: dict
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class CreateUniversityRequest(BaseModel):
     name: str
@@ -167,6 +409,7 @@ class CreateSessionRequest(BaseModel):
     subject: Optional[str] = None
     year: Optional[str] = None
     section: Optional[str] = None
+    duration_minutes: Optional[int] = Field(None, ge=1, le=MAX_SESSION_DURATION_MINUTES)
 
 class MarkAttendanceRequest(BaseModel):
     session_id: str
@@ -174,6 +417,9 @@ class MarkAttendanceRequest(BaseModel):
     qr_token: Optional[str] = None
     location: Optional[dict] = None
 
+class ConfirmFaceAttendanceRequest(BaseModel):
+    student_ids: List[str] = Field(..., min_length=1, max_length=MAX_PAGE_SIZE)
+
 class AssignFacultyRequest(BaseModel):
     faculty_id: str
     department_id: str
@@ -187,39 +433,1448 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def run_password_task(func, *args):
+    """Run a bcrypt call on the password pool, shedding load with 503 once the queue is full"""
+    global password_pending
+    if password_executor is not None and password_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)}
+        )
+    password_pending += 1
+    started = time.perf_counter()
+    try:
+        if password_executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_pending -= 1
+        stage_duration.observe(time.perf_counter() - started, stage=func.__name__)
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_task(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_refresh_token(user: dict):
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {"sub": user["id"], "ver": user.get("token_version", 0), "exp": expire, "type": "refresh"}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def user_token_claims(user: dict) -> dict:
+    claims = {key: user.get(key) for key in TOKEN_CLAIMS}
+    claims.update({"sub": user["id"], "ver": user.get("token_version", 0)})
+    return claims
+
+def public_user(user: dict) -> dict:
+    return {"id": user["id"], **{key: user.get(key) for key in TOKEN_CLAIMS}}
+
+def token_response(user: dict) -> TokenResponse:
+    return TokenResponse(
+        access_token=create_access_token(data=user_token_claims(user)),
+        refresh_token=create_refresh_token(user),
+        token_type="bearer",
+        user=public_user(user)
+    )
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Caller identity from the token's signed claims, without a database read.
+    
+    Tokens issued before claims were added fall back to loading the user.
+    Handlers that need the stored document depend on get_current_user_document.
+    """
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("type") == "refresh":
             raise HTTPException(status_code=401, detail="Invalid authentication")
         
-        user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user_data is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user_data
+        if "role" not in payload:
+            user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
+            if user_data is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            return user_data
+        
+        if payload.get("ver", 0) < token_versions.get(user_id, 0):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return {"id": user_id, **{key: payload.get(key) for key in TOKEN_CLAIMS}}
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication")
 
-def generate_qr_code(data: str) -> tuple:
-    """Generate QR code and return both image and token"""
+def profiling_allowed(headers: dict) -> bool:
+    """Whether request headers carry a valid, unrevoked admin access token"""
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return (
+        payload.get("type") != "refresh"
+        and payload.get("role") in [UserRole.UNIVERSITY_ADMIN, UserRole.COLLEGE_ADMIN]
+        and payload.get("ver", 0) >= token_versions.get(payload.get("sub"), 0)
+    )
+
+async def get_current_user_document(current_user: dict = Depends(get_current_user)):
+    user_data = await db.users.find_one({"id": current_user["id"]}, {"_id": 0})
+    if user_data is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user_data
+
+async def update_user_and_revoke(query: dict, update: dict) -> Optional[dict]:
+    """Apply update and bump token_version so tokens carrying the old claims stop working"""
+    update.setdefault("$set", {})["token_version_updated_at"] = datetime.now(timezone.utc)
+    update["$inc"] = {"token_version": 1}
+    user = await db.users.find_one_and_update(
+        query, update, {"_id": 0, "id": 1, "token_version": 1}, return_document=ReturnDocument.AFTER
+    )
+    if user is not None:
+        token_versions[user["id"]] = user["token_version"]
+    return user
+
+async def load_token_versions(since: datetime):
+    """Pick up token_version bumps made at or after since"""
+    async for user in db.users.find(
+        {"token_version_updated_at": {"$gte": since - timedelta(seconds=1)}},
+        {"_id": 0, "id": 1, "token_version": 1}
+    ):
+        if user.get("token_version", 0) > token_versions.get(user["id"], 0):
+            token_versions[user["id"]] = user["token_version"]
+
+async def sync_token_versions(since: datetime):
+    """Poll for token_version bumps made by other workers"""
+    while True:
+        await asyncio.sleep(TOKEN_VERSION_SYNC_SECONDS)
+        polled_at = datetime.now(timezone.utc)
+        try:
+            await load_token_versions(since)
+            since = polled_at
+        except PyMongoError as e:
+            logger.warning("Token version sync failed: %s", e)
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_code(data: str, image_format: str = "png") -> bytes:
+    """Render QR code for data as PNG or SVG bytes"""
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
     
     buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}", data
+    if image_format == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffer)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def qr_window(now: Optional[float] = None) -> int:
+    return int((time.time() if now is None else now) // QR_ROTATION_SECONDS)
+
+def sign_qr_token(session_id: str, window: int, department_id: Optional[str], year: Optional[str], section: Optional[str], expires: Optional[int] = None) -> str:
+    message = "|".join([session_id, str(window), department_id or "", year or "", section or "", "" if expires is None else str(expires)])
+    return hmac.new(QR_SIGNING_KEY, message.encode(), hashlib.sha256).hexdigest()
+
+def session_qr_payload(session: dict) -> str:
+    if session.get("qr_mode") != "rotating":
+        return json.dumps({"session_id": session["id"], "token": session.get("qr_token")})
+    
+    window = qr_window()
+    deadline = session_deadline(session)
+    scope = {
+        "department_id": session.get("department_id"),
+        "year": session.get("year"),
+        "section": session.get("section"),
+        "expires": int(deadline.timestamp()) if deadline else None
+    }
+    return json.dumps({
+        "session_id": session["id"],
+        **scope,
+        "window": window,
+        "token": sign_qr_token(session["id"], window, **scope)
+    })
+
+def verify_rotating_qr(qr_data: dict):
+    """Check a rotating token's signature and time window; raises on failure"""
+    window = qr_data.get("window")
+    if not isinstance(window, int) or not isinstance(qr_data.get("token"), str):
+        raise HTTPException(status_code=400, detail="Invalid QR code")
+    if any(not isinstance(qr_data.get(field), (str, type(None))) for field in ("department_id", "year", "section")):
+        raise HTTPException(status_code=400, detail="Invalid QR code")
+    if not isinstance(qr_data.get("expires"), (int, type(None))) or isinstance(qr_data.get("expires"), bool):
+        raise HTTPException(status_code=400, detail="Invalid QR code")
+    
+    current = qr_window()
+    if not current - QR_TOKEN_GRACE_WINDOWS <= window <= current:
+        raise HTTPException(status_code=400, detail="Invalid or expired QR token")
+    
+    expected = sign_qr_token(
+        qr_data["session_id"], window, qr_data.get("department_id"), qr_data.get("year"), qr_data.get("section"),
+        qr_data.get("expires")
+    )
+    if not hmac.compare_digest(expected.encode(), qr_data["token"].encode()):
+        raise HTTPException(status_code=400, detail="Invalid or expired QR token")
+    if qr_data.get("expires") is not None and time.time() >= qr_data["expires"]:
+        raise HTTPException(status_code=400, detail="Session has expired")
+
+def student_summary_seed(user: dict) -> dict:
+    """Scope fields copied onto a student's attendance summary"""
+    return {
+        "name": user.get("name"),
+        "college_id": user.get("college_id"),
+        "department_id": user.get("department_id"),
+        "year": user.get("year"),
+        "section": user.get("section")
+    }
+
+def roster_query(department_id: str, year: Optional[str] = None, section: Optional[str] = None) -> dict:
+    """Summary filter for the students a session is held for"""
+    query = {"department_id": department_id}
+    if year:
+        query["year"] = year
+    if section:
+        query["section"] = section
+    return query
+
+def as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def session_deadline(session: dict) -> Optional[datetime]:
+    """When a session stops taking marks; sessions created before expiry existed get the default duration"""
+    if isinstance(session.get("expires_at"), datetime):
+        return as_utc(session["expires_at"])
+    if SESSION_DURATION_MINUTES and isinstance(session.get("start_time"), datetime):
+        return as_utc(session["start_time"]) + timedelta(minutes=SESSION_DURATION_MINUTES)
+    return None
+
+def session_open(session: dict) -> bool:
+    """Active and not past its deadline, judged from cached metadata alone"""
+    deadline = session_deadline(session)
+    return session.get("is_active", False) and (deadline is None or datetime.now(timezone.utc) < deadline)
+
+def date_range(date_from: Optional[datetime], date_to: Optional[datetime]) -> Optional[dict]:
+    """Query operator for [from, to); dates without a timezone are taken as UTC"""
+    bounds = {}
+    if date_from:
+        bounds["$gte"] = as_utc(date_from)
+    if date_to:
+        bounds["$lt"] = as_utc(date_to)
+    return bounds or None
+
+async def rebuild_attendance_summaries(apply: bool = True, batch_size: int = 1000) -> dict:
+    """Recompute every student's summary from sessions and the stored marks.
+    
+    Returns a drift report comparing the stored counters with the recomputed
+    ones; with apply=False nothing is written. Marks that land while the
+    rebuild runs may be overwritten, so run it outside of class hours.
+    """
+    held_by_scope = {}
+    async for row in db.sessions.aggregate([
+        {"$group": {"_id": {"department_id": "$department_id", "year": "$year", "section": "$section"}, "count": {"$sum": 1}}}
+    ]):
+        scope = row["_id"]
+        held_by_scope[(scope.get("department_id"), scope.get("year"), scope.get("section"))] = row["count"]
+    
+    attended_by_student = await marks_per_student()
+    
+    existing = {
+        row["student_id"]: row
+        async for row in db.attendance_summaries.find({}, {"_id": 0, "student_id": 1, "sessions_held": 1, "sessions_attended": 1})
+    }
+    
+    held_cache = {}
+    report = {"students": 0, "missing": 0, "drifted": 0, "samples": []}
+    ops = []
+    async for student in db.users.find({"role": UserRole.STUDENT}, {"_id": 0, "password_hash": 0, "face_embedding": 0}):
+        key = (student.get("department_id"), student.get("year"), student.get("section"))
+        if key not in held_cache:
+            held_cache[key] = sum(
+                count for (dept, year, section), count in held_by_scope.items()
+                if dept == key[0] and year in (None, key[1]) and section in (None, key[2])
+            )
+        
+        summary = student_summary_seed(student)
+        summary["student_id"] = student["id"]
+        summary["sessions_held"] = held_cache[key]
+        summary["sessions_attended"] = attended_by_student.get(student["id"], 0)
+        
+        report["students"] += 1
+        current = existing.get(student["id"])
+        if current is None:
+            report["missing"] += 1
+        elif (current.get("sessions_held"), current.get("sessions_attended")) != (summary["sessions_held"], summary["sessions_attended"]):
+            report["drifted"] += 1
+            if len(report["samples"]) < 20:
+                report["samples"].append({
+                    "student_id": student["id"],
+                    "stored": [current.get("sessions_held"), current.get("sessions_attended")],
+                    "expected": [summary["sessions_held"], summary["sessions_attended"]]
+                })
+        
+        if apply:
+            ops.append(ReplaceOne({"student_id": student["id"]}, summary, upsert=True))
+            if len(ops) >= batch_size:
+                await db.attendance_summaries.bulk_write(ops, ordered=False)
+                ops = []
+    
+    if ops:
+        await db.attendance_summaries.bulk_write(ops, ordered=False)
+    return report
+
+async def migrate_string_dates(apply: bool = True, batch_size: int = 1000) -> dict:
+    """Convert ISO-string timestamps left by older versions into BSON dates.
+    
+    Only string values are touched, so the migration can be re-run and can run
+    while the app serves traffic. Returns converted and unparseable counts per
+    collection.field; with apply=False nothing is written.
+    """
+    report = {}
+    for collection, fields in DATE_FIELDS.items():
+        for field in fields:
+            converted = unparseable = 0
+            ops = []
+            async for doc in db[collection].find({field: {"$type": "string"}}, {field: 1}):
+                try:
+                    value = as_utc(datetime.fromisoformat(doc[field]))
+                except ValueError:
+                    unparseable += 1
+                    continue
+                converted += 1
+                if apply:
+                    # Matching the old value leaves documents rewritten in the meantime alone
+                    ops.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+                    if len(ops) >= batch_size:
+                        await db[collection].bulk_write(ops, ordered=False)
+                        ops = []
+            if ops:
+                await db[collection].bulk_write(ops, ordered=False)
+            report[f"{collection}.{field}"] = {"converted": converted, "unparseable": unparseable}
+        if apply and collection in ("universities", "colleges", "departments"):
+            await bump_reference_version(collection)
+    return report
+
+# Collections whose duplicate keys can be dropped safely: the document kept is the one with
+# the lowest value of the field. Duplicates elsewhere (user emails) are only reported
+DEDUPE_KEEP_FIRST = {"attendance_records": "marked_at"}
+
+async def dedupe_unique_keys(apply: bool = True) -> dict:
+    """Find documents that stop the unique indexes in INDEXES from being built.
+    
+    Returns, per collection.key, how many keys are duplicated and the _ids
+    involved. With apply=True duplicates in DEDUPE_KEEP_FIRST collections are
+    deleted, keeping the earliest; run rebuild_summaries.py afterwards, since the
+    deleted marks were counted. Everything else needs cleaning up by hand.
+    """
+    report = {}
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            if not index.document.get("unique"):
+                continue
+            fields = list(index.document["key"])
+            keep_by = DEDUPE_KEEP_FIRST.get(collection)
+            pipeline = [{"$sort": {keep_by: 1}}] if keep_by else []
+            pipeline += [
+                {"$group": {"_id": {field: f"${field}" for field in fields}, "ids": {"$push": "$_id"}}},
+                {"$match": {"ids.1": {"$exists": True}}}
+            ]
+            groups = [group async for group in db[collection].aggregate(pipeline, allowDiskUse=True)]
+            if not groups:
+                continue
+            
+            deleted = 0
+            if apply and keep_by:
+                extra = [doc_id for group in groups for doc_id in group["ids"][1:]]
+                deleted = (await db[collection].delete_many({"_id": {"$in": extra}})).deleted_count
+            report[f"{collection}.{'+'.join(fields)}"] = {
+                "duplicated_keys": len(groups),
+                "deleted": deleted,
+                "ids": [[str(doc_id) for doc_id in group["ids"]] for group in groups]
+            }
+    return report
+
+# ==================== ROLLUPS ====================
+
+ROLLUP_SCOPE = ("college_id", "department_id", "year", "section", "subject")
+TREND_GROUPS = ("department_id", "year", "section", "subject")
+
+def rollup_key(session: dict) -> dict:
+    """Bucket a session belongs to: its UTC start day and teaching scope"""
+    start = as_utc(session["start_time"])
+    day = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    return {"day": day, **{field: session.get(field) for field in ROLLUP_SCOPE}}
+
+def rollup_periods(day: datetime) -> dict:
+    """Coarser periods stored on each bucket so trends group by a plain field"""
+    return {"week": day - timedelta(days=day.weekday()), "month": day.replace(day=1)}
+
+def roster_size(rosters: dict, session: dict) -> int:
+    """Students a session was held for, from roster sizes per (department, year, section); see roster_query"""
+    return sum(
+        count for (department_id, year, section), count in rosters.items()
+        if department_id == session.get("department_id")
+        and (not session.get("year") or session["year"] == year)
+        and (not session.get("section") or session["section"] == section)
+    )
+
+ROLLED_UP_BY_SESSION = "session"
+# A session claim that never reached its bucket (the worker died mid-rollup) is recounted by the backfill after this long
+ROLLUP_CLAIM_TIMEOUT = timedelta(minutes=10)
+ROLLUP_SESSION_PROJECTION = {"_id": 0, "id": 1, "start_time": 1, **{field: 1 for field in ROLLUP_SCOPE}}
+
+def rollup_bucket_id(doc: dict) -> tuple:
+    return (doc["day"], *(doc.get(field) for field in ROLLUP_SCOPE))
+
+async def roll_up_session(session_id: str) -> bool:
+    """Add a closed session to its day's bucket; returns False if it was already rolled up.
+    
+    Claiming the session with rolled_up_at first makes this safe to call from
+    end_session, the expiry scheduler and retries alike. expected is the roster
+    size when the session closes; marks that land later are picked up by
+    backfill_daily_rollups. The session id is added to the bucket's session_ids
+    in the same write, which is how a running backfill knows the increment is in.
+    If the rollup fails after the claim, the claim is released so a retry or the
+    backfill counts the session. Sessions whose start_time is still a legacy
+    string are left for the backfill after migrate_dates.py.
+    """
+    claimed_at = datetime.now(timezone.utc)
+    session = await db.sessions.find_one_and_update(
+        {"id": session_id, "is_active": False, "rolled_up_at": None, "start_time": {"$type": "date"}},
+        {"$set": {"rolled_up_at": claimed_at, "rolled_up_by": ROLLED_UP_BY_SESSION}},
+        ROLLUP_SESSION_PROJECTION
+    )
+    if session is None:
+        return False
+    
+    try:
+        present = (await marks_per_session([session_id])).get(session_id, 0)
+        expected = await db.attendance_summaries.count_documents(
+            roster_query(session["department_id"], session.get("year"), session.get("section"))
+        )
+        key = rollup_key(session)
+        await db.attendance_daily.update_one(
+            key,
+            {
+                "$inc": {"sessions_held": 1, "expected": expected, "present": present, "version": 1},
+                "$addToSet": {"session_ids": session_id},
+                "$setOnInsert": rollup_periods(key["day"])
+            },
+            upsert=True
+        )
+    except BaseException:
+        await asyncio.shield(db.sessions.update_one(
+            {"id": session_id, "rolled_up_at": claimed_at, "rolled_up_by": ROLLED_UP_BY_SESSION},
+            {"$unset": {"rolled_up_at": "", "rolled_up_by": ""}}
+        ))
+        raise
+    return True
+
+async def roll_up_closed_session(session_id: str):
+    """roll_up_session for code paths that have already closed the session; failures are logged, not raised"""
+    try:
+        await roll_up_session(session_id)
+    except Exception:
+        logger.exception("Rolling up session %s failed; the next backfill_daily_rollups will count it", session_id)
+
+async def read_rollup_buckets(query: dict) -> dict:
+    """{bucket id: (version, session ids)} for the buckets matching query"""
+    snapshot = {}
+    async for bucket in db.attendance_daily.find(query, {"_id": 0, "day": 1, "version": 1, "session_ids": 1, **{field: 1 for field in ROLLUP_SCOPE}}):
+        snapshot[rollup_bucket_id(bucket)] = (bucket.get("version"), set(bucket.get("session_ids", [])))
+    return snapshot
+
+async def count_rollup_buckets(session_query: dict, snapshot: dict, rosters: dict, claimed_at: datetime, claimed_by: str, batch_size: int) -> dict:
+    """Buckets rebuilt from the closed sessions matching session_query, as of snapshot.
+    
+    Unclaimed sessions are claimed for the backfill. A session roll_up_session
+    claimed is only counted once its increment is in the snapshot; until then
+    its own write adds it, unless the claim is older than ROLLUP_CLAIM_TIMEOUT.
+    """
+    buckets = {}
+    
+    async def add_chunk(chunk: list):
+        ids = [session["id"] for session in chunk]
+        await db.sessions.update_many(
+            {"id": {"$in": ids}, "rolled_up_at": None},
+            {"$set": {"rolled_up_at": claimed_at, "rolled_up_by": claimed_by}}
+        )
+        claims = {
+            session["id"]: session
+            async for session in db.sessions.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "rolled_up_at": 1, "rolled_up_by": 1})
+        }
+        
+        def counts(session: dict) -> bool:
+            claim = claims.get(session["id"], {})
+            if claim.get("rolled_up_by") != ROLLED_UP_BY_SESSION:
+                return True
+            if session["id"] in snapshot.get(rollup_bucket_id(rollup_key(session)), (None, set()))[1]:
+                return True
+            return isinstance(claim.get("rolled_up_at"), datetime) and as_utc(claim["rolled_up_at"]) < claimed_at - ROLLUP_CLAIM_TIMEOUT
+        
+        counted = [session for session in chunk if counts(session)]
+        present = await marks_per_session([session["id"] for session in counted]) if counted else {}
+        for session in counted:
+            key = rollup_key(session)
+            bucket = buckets.setdefault(
+                rollup_bucket_id(key), {**key, "sessions_held": 0, "expected": 0, "present": 0, "session_ids": []}
+            )
+            bucket["sessions_held"] += 1
+            bucket["expected"] += roster_size(rosters, session)
+            bucket["present"] += present.get(session["id"], 0)
+            bucket["session_ids"].append(session["id"])
+    
+    chunk = []
+    async for session in db.sessions.find(session_query, ROLLUP_SESSION_PROJECTION):
+        if not isinstance(session.get("start_time"), datetime):
+            continue
+        chunk.append(session)
+        if len(chunk) == batch_size:
+            await add_chunk(chunk)
+            chunk = []
+    if chunk:
+        await add_chunk(chunk)
+    return buckets
+
+async def replace_rollup_buckets(buckets: dict, stale: list, snapshot: dict, backfilled_at: datetime, batch_size: int) -> set:
+    """Write rebuilt buckets and delete stale ones where the snapshot version still holds; returns the ids that moved on"""
+    conflicts = set()
+    items = list(buckets.items())
+    ops = [
+        ReplaceOne(
+            {**{key: bucket[key] for key in ("day", *ROLLUP_SCOPE)}, "version": snapshot.get(bucket_id, (None,))[0]},
+            {
+                **bucket, **rollup_periods(bucket["day"]),
+                "version": (snapshot.get(bucket_id, (None,))[0] or 0) + 1, "backfilled_at": backfilled_at
+            },
+            upsert=True
+        )
+        for bucket_id, bucket in items
+    ]
+    for i in range(0, len(ops), batch_size):
+        try:
+            await db.attendance_daily.bulk_write(ops[i:i + batch_size], ordered=False)
+        except BulkWriteError as e:
+            for index, error in write_failures(e).items():
+                # The upsert collided with a bucket whose version changed since the snapshot
+                if not isinstance(error, DuplicateKeyError):
+                    raise error
+                conflicts.add(items[i + index][0])
+    
+    for bucket_id in stale:
+        key = dict(zip(("day", *ROLLUP_SCOPE), bucket_id))
+        deleted = await db.attendance_daily.delete_one({**key, "version": snapshot[bucket_id][0]})
+        if not deleted.deleted_count:
+            conflicts.add(bucket_id)
+    return conflicts
+
+async def backfill_daily_rollups(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, batch_size: int = 1000, max_attempts: int = 5) -> dict:
+    """Recompute the daily buckets for closed sessions starting in [from, to) from raw records.
+    
+    Buckets are replaced, not incremented, so the backfill can be re-run; buckets
+    in the range that no longer have sessions are removed. Expected counts use
+    today's rosters, which is the best available for sessions closed before
+    rollups existed.
+    
+    roll_up_session may run at the same time. Buckets are read before sessions
+    are counted and only replaced or removed if their version is unchanged;
+    buckets that moved on are recomputed on their own, up to max_attempts times.
+    """
+    started = datetime.now(timezone.utc)
+    claimed_by = f"backfill:{started.isoformat()}"
+    session_query = {"is_active": False}
+    day_range = date_range(date_from, date_to)
+    if day_range:
+        session_query["start_time"] = day_range
+    
+    # Roster sizes per (department, year, section), in one pass over the summaries
+    rosters = {}
+    async for row in db.attendance_summaries.aggregate([
+        {"$group": {"_id": {"department_id": "$department_id", "year": "$year", "section": "$section"}, "count": {"$sum": 1}}}
+    ]):
+        rosters[(row["_id"].get("department_id"), row["_id"].get("year"), row["_id"].get("section"))] = row["count"]
+    
+    snapshot = await read_rollup_buckets({"day": day_range} if day_range else {})
+    buckets = await count_rollup_buckets(session_query, snapshot, rosters, started, claimed_by, batch_size)
+    stale = [bucket_id for bucket_id in snapshot if bucket_id not in buckets]
+    sessions = sum(bucket["sessions_held"] for bucket in buckets.values())
+    written = len(buckets)
+    removed = len(stale)
+    
+    conflicts = await replace_rollup_buckets(buckets, stale, snapshot, started, batch_size)
+    retried = 0
+    for _ in range(max_attempts - 1):
+        if not conflicts:
+            break
+        retried += len(conflicts)
+        pending, conflicts = conflicts, set()
+        for bucket_id in pending:
+            key = dict(zip(("day", *ROLLUP_SCOPE), bucket_id))
+            day_sessions = {
+                "is_active": False, "start_time": {"$gte": key["day"], "$lt": key["day"] + timedelta(days=1)},
+                **{field: key[field] for field in ROLLUP_SCOPE}
+            }
+            snapshot = await read_rollup_buckets(key)
+            rebuilt = await count_rollup_buckets(day_sessions, snapshot, rosters, started, claimed_by, batch_size)
+            conflicts |= await replace_rollup_buckets(
+                rebuilt, [bucket_id] if bucket_id in snapshot and bucket_id not in rebuilt else [], snapshot, started, batch_size
+            )
+    if conflicts:
+        logger.warning("Daily rollup backfill left %d buckets changing under it; re-run to settle them", len(conflicts))
+    return {"sessions": sessions, "buckets": written, "removed": removed, "retried": retried, "unsettled": len(conflicts)}
+
+# ==================== PAGINATION HELPERS ====================
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(sort: list, values: list) -> dict:
+    """Filter matching documents strictly after `values` in `sort` order"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+async def iter_rows(collection, query: dict, projection: Optional[dict], sort: list):
+    async for doc in collection.find(query, projection).sort(sort).batch_size(DEFAULT_PAGE_SIZE):
+        doc.pop("_id", None)
+        yield doc
+
+async def ndjson_rows(rows):
+    async for row in rows:
+        yield json.dumps(row, default=json_default) + "\n"
+
+async def json_array_rows(rows):
+    yield "["
+    first = True
+    async for row in rows:
+        yield ("" if first else ",") + json.dumps(row, default=json_default)
+        first = False
+    yield "]"
+
+async def aiter_list(items: list):
+    for item in items:
+        yield item
+
+async def list_response(
+    collection,
+    query: dict,
+    projection: dict,
+    sort: list,
+    limit: Optional[int],
+    cursor: Optional[str],
+    response_format: str
+):
+    """Serve a list endpoint as a keyset page, an NDJSON stream or a streamed JSON array.
+    
+    Pages are returned when `limit` or `cursor` is given, as {"items": [...], "next": token};
+    `next` is None on the last page. Without either, the full result is streamed
+    so memory per request stays constant.
+    """
+    # _id is kept for keyset ordering and stripped before the rows go out
+    projection = {k: v for k, v in projection.items() if k != "_id"} or None
+    
+    if limit is None and cursor is None:
+        rows = iter_rows(collection, query, projection, sort)
+        if response_format == "ndjson":
+            return StreamingResponse(ndjson_rows(rows), media_type="application/x-ndjson")
+        return StreamingResponse(json_array_rows(rows), media_type="application/json")
+    
+    limit = limit or DEFAULT_PAGE_SIZE
+    if cursor:
+        query = {"$and": [query, keyset_filter(sort, decode_cursor(cursor, len(sort)))]}
+    
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(limit + 1)
+    next_token = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_token = encode_cursor([docs[-1].get(field) for field, _ in sort])
+    for doc in docs:
+        doc.pop("_id", None)
+    
+    if response_format == "ndjson":
+        return StreamingResponse(
+            ndjson_rows(aiter_list(docs)),
+            media_type="application/x-ndjson",
+            headers={"X-Next-Cursor": next_token} if next_token else None
+        )
+    return {"items": docs, "next": next_token}
+
+# ==================== CACHES ====================
+
+class LoadCancelled(Exception):
+    """A shared cache load whose caller was cancelled before it finished"""
+
+class AsyncTTLCache:
+    """In-process LRU cache with a per-entry TTL.
+    
+    Concurrent misses for the same key share one load. Values are shared
+    between callers and must not be mutated.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        
+        future = self._loading.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except LoadCancelled:
+                # The caller running the load was cancelled; load again rather than fail with it
+                return await self.get(key, loader)
+        
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(LoadCancelled() if isinstance(e, asyncio.CancelledError) else e)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            # Waiters are always released; a key invalidated while loading is just not stored
+            current = self._loading.get(key) is future
+            if current:
+                del self._loading[key]
+        
+        future.set_result(value)
+        if current and value is not None:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+    
+    def invalidate_where(self, predicate):
+        """Drop every key for which predicate(key) is true"""
+        for key in [k for k in list(self._entries) + list(self._loading) if predicate(k)]:
+            self.invalidate(key)
+    
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        self.invalidations += 1
+        if key is None:
+            self._entries.clear()
+            self._loading.clear()
+        else:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+session_cache = AsyncTTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+roster_cache = AsyncTTLCache(ROSTER_INDEX_SIZE, ROSTER_INDEX_TTL)
+
+def cache_metric(field: str):
+    return lambda: {(name,): cache.stats()[field] for name, cache in (("sessions", session_cache), ("roster", roster_cache))}
+
+metrics.registry.callback_gauge("app_cache_entries", "Entries held by in-process caches", ("cache",), cache_metric("size"))
+for field in ("hits", "misses", "coalesced", "evictions"):
+    metrics.registry.callback_gauge(f"app_cache_{field}", f"Cumulative cache {field}", ("cache",), cache_metric(field))
+metrics.registry.callback_gauge(
+    "app_pool_pending", "Calls queued or running on worker pools", ("pool",),
+    lambda: {("password",): password_pending, ("face",): face_pending}
+)
+
+async def get_session_meta(session_id: str) -> Optional[dict]:
+    """Session metadata (no QR data) through the in-process cache"""
+    return await session_cache.get(
+        session_id, lambda: db.sessions.find_one({"id": session_id}, SESSION_META_PROJECTION)
+    )
+
+async def watch_session_changes():
+    """Invalidate cached sessions as other workers update them (needs a replica set)"""
+    try:
+        async with db.sessions.watch(
+            [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}],
+            full_document="updateLookup"
+        ) as stream:
+            async for change in stream:
+                document = change.get("fullDocument")
+                session_cache.invalidate(document["id"] if document and "id" in document else None)
+                if document and "id" in document and not document.get("is_active", True):
+                    live_feed.publish_end(document["id"])
+    except PyMongoError as e:
+        logger.warning("Session change stream stopped, relying on TTL only: %s", e)
+
+reference_cache = {}
+
+async def get_reference_data(collection: str) -> tuple:
+    """(version, documents) for a small hierarchy collection, served from memory while fresh"""
+    entry = reference_cache.get(collection)
+    now = time.monotonic()
+    if entry is not None and now - entry["checked_at"] < REFERENCE_CACHE_TTL:
+        return entry["version"], entry["docs"]
+    
+    stamp = await db.cache_versions.find_one({"_id": collection})
+    version = stamp["version"] if stamp else 0
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, "docs": await db[collection].find({}, {"_id": 0}).to_list(None)}
+    entry["checked_at"] = now
+    reference_cache[collection] = entry
+    return version, entry["docs"]
+
+async def bump_reference_version(collection: str):
+    """Invalidate a hierarchy collection here and, within REFERENCE_CACHE_TTL, on every worker"""
+    await db.cache_versions.update_one({"_id": collection}, {"$inc": {"version": 1}}, upsert=True)
+    reference_cache.pop(collection, None)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    return etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+
+async def reference_response(request: Request, collection: str, query: dict) -> Response:
+    """Filtered hierarchy list with an ETag of the data version and filter; 304 when unchanged"""
+    version, docs = await get_reference_data(collection)
+    etag = '"' + hashlib.sha256(f"{collection}:{version}:{json.dumps(query, sort_keys=True)}".encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    body = [doc for doc in docs if all(doc.get(key) == value for key, value in query.items())]
+    return Response(content=json.dumps(body, default=json_default), media_type="application/json", headers=headers)
+
+# ==================== ATTENDANCE STORAGE ====================
+
+# Per-mark fields a sheet keeps only for the marks that set them
+SHEET_DETAIL_FIELDS = ("ip_address", "location", "is_proxy")
+
+def pack_student_id(student_id: str):
+    """A canonical UUID id as 16-byte BSON binary; anything else is kept as the string"""
+    try:
+        value = uuid.UUID(student_id)
+    except (AttributeError, TypeError, ValueError):
+        return student_id
+    return Binary(value.bytes, UUID_SUBTYPE) if str(value) == student_id else student_id
+
+def unpack_student_id(value) -> str:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, bytes):
+        return str(uuid.UUID(bytes=bytes(value)))
+    return value
+
+def sheet_mark_op(record: dict) -> UpdateOne:
+    """Append a mark to its session's sheet.
+    
+    students, marked_at and methods are parallel arrays in mark order. The $ne
+    guard makes a repeat miss the sheet, and the upsert then fails on _id with
+    the same DuplicateKeyError a repeated attendance_records insert raises.
+    """
+    student = pack_student_id(record["student_id"])
+    push = {"students": student, "marked_at": record["marked_at"], "methods": record["method"]}
+    details = {field: record[field] for field in SHEET_DETAIL_FIELDS if record.get(field)}
+    if details:
+        push["details"] = {"student": student, **details}
+    return UpdateOne({"_id": record["session_id"], "students": {"$ne": student}}, {"$push": push}, upsert=True)
+
+def sheet_records(sheet: dict) -> list:
+    """A sheet expanded into attendance_records-shaped documents, in mark order"""
+    details = {unpack_student_id(detail["student"]): detail for detail in sheet.get("details", [])}
+    records = []
+    for student, marked_at, method in zip(sheet.get("students", []), sheet.get("marked_at", []), sheet.get("methods", [])):
+        student_id = unpack_student_id(student)
+        detail = details.get(student_id, {})
+        records.append({
+            "id": f"{sheet['_id']}:{student_id}",
+            "session_id": sheet["_id"],
+            "student_id": student_id,
+            "marked_at": marked_at,
+            "method": method,
+            "ip_address": detail.get("ip_address"),
+            "location": detail.get("location"),
+            "is_proxy": detail.get("is_proxy", False)
+        })
+    return records
+
+def write_failures(error: BulkWriteError) -> dict:
+    """{index: exception} for the writes a bulk operation rejected"""
+    failures = {}
+    for write_error in error.details.get("writeErrors", []):
+        if write_error.get("code") == 11000:
+            failures[write_error["index"]] = DuplicateKeyError(write_error.get("errmsg", "duplicate key"), 11000)
+        else:
+            failures[write_error["index"]] = PyMongoError(write_error.get("errmsg", "write failed"))
+    return failures
+
+async def insert_records(collection, records: list) -> dict:
+    try:
+        await collection.insert_many(records, ordered=False)
+    except BulkWriteError as e:
+        return write_failures(e)
+    return {}
+
+async def push_sheet_marks(collection, records: list) -> dict:
+    try:
+        await collection.bulk_write([sheet_mark_op(record) for record in records], ordered=False)
+    except BulkWriteError as e:
+        return write_failures(e)
+    return {}
+
+def marks_collection():
+    return db.attendance_sheets if ATTENDANCE_STORAGE == "sheets" else db.attendance_records
+
+async def store_marks(records: list) -> dict:
+    """Write marks in the configured storage; returns {index: exception} for rejected ones"""
+    write = push_sheet_marks if ATTENDANCE_STORAGE == "sheets" else insert_records
+    return await write(marks_collection(), records)
+
+async def marked_student_ids(session_id: str) -> set:
+    if ATTENDANCE_STORAGE == "sheets":
+        sheet = await db.attendance_sheets.find_one({"_id": session_id}, {"students": 1})
+        return {unpack_student_id(student) for student in (sheet or {}).get("students", [])}
+    return set(await db.attendance_records.distinct("student_id", {"session_id": session_id}))
+
+async def marks_per_session(session_ids: list) -> dict:
+    """Marks per session id"""
+    if ATTENDANCE_STORAGE == "sheets":
+        pipeline = [
+            {"$match": {"_id": {"$in": session_ids}}},
+            {"$project": {"count": {"$size": {"$ifNull": ["$students", []]}}}}
+        ]
+        return {row["_id"]: row["count"] async for row in db.attendance_sheets.aggregate(pipeline)}
+    pipeline = [
+        {"$match": {"session_id": {"$in": session_ids}}},
+        {"$group": {"_id": "$session_id", "count": {"$sum": 1}}}
+    ]
+    return {row["_id"]: row["count"] async for row in db.attendance_records.aggregate(pipeline)}
+
+async def marks_per_student(session_ids: Optional[list] = None) -> dict:
+    """Marks per student id, over the given sessions or all of them"""
+    if ATTENDANCE_STORAGE == "sheets":
+        pipeline = [{"$project": {"students": 1}}, {"$unwind": "$students"}, {"$group": {"_id": "$students", "count": {"$sum": 1}}}]
+        if session_ids is not None:
+            pipeline.insert(0, {"$match": {"_id": {"$in": session_ids}}})
+        return {
+            unpack_student_id(row["_id"]): row["count"]
+            async for row in db.attendance_sheets.aggregate(pipeline, allowDiskUse=True)
+        }
+    pipeline = [{"$group": {"_id": "$student_id", "count": {"$sum": 1}}}]
+    if session_ids is not None:
+        pipeline.insert(0, {"$match": {"session_id": {"$in": session_ids}}})
+    return {row["_id"]: row["count"] async for row in db.attendance_records.aggregate(pipeline, allowDiskUse=True)}
+
+async def iter_session_marks(session_ids: list, student_id: Optional[str] = None):
+    """Marks of the given sessions ordered by (session_id, student_id)"""
+    if ATTENDANCE_STORAGE == "sheets":
+        query = {"_id": {"$in": session_ids}}
+        if student_id:
+            query["students"] = pack_student_id(student_id)
+        async for sheet in db.attendance_sheets.find(query).sort("_id", ASCENDING):
+            for record in sorted(sheet_records(sheet), key=lambda record: record["student_id"]):
+                if not student_id or record["student_id"] == student_id:
+                    yield record
+        return
+    query = {"session_id": {"$in": session_ids}}
+    if student_id:
+        query["student_id"] = student_id
+    records = db.attendance_records.find(query, EXPORT_RECORD_PROJECTION, batch_size=EXPORT_BATCH_SIZE).sort(
+        [("session_id", ASCENDING), ("student_id", ASCENDING)]
+    )
+    async for record in records:
+        yield record
+
+def sheet_query(query: dict) -> dict:
+    """An attendance_records filter on session_id/student_id rewritten for attendance_sheets"""
+    translated = {}
+    if "session_id" in query:
+        translated["_id"] = query["session_id"]
+    if "student_id" in query:
+        translated["students"] = pack_student_id(query["student_id"])
+    return translated
+
+def record_matches(record: dict, query: dict) -> bool:
+    """Whether an expanded sheet record passes the student_id and marked_at parts of a records filter"""
+    if "student_id" in query and record["student_id"] != query["student_id"]:
+        return False
+    bounds = query.get("marked_at", {})
+    if "$gte" in bounds and record["marked_at"] < bounds["$gte"]:
+        return False
+    if "$lt" in bounds and record["marked_at"] >= bounds["$lt"]:
+        return False
+    return True
+
+async def iter_sheet_rows(query: dict, after: Optional[list] = None):
+    """(session_id, position, record) for marks matching a records filter, after a (session_id, position) key"""
+    sheets = sheet_query(query)
+    if after:
+        sheets = {"$and": [sheets, {"_id": {"$gte": after[0]}}]}
+    async for sheet in db.attendance_sheets.find(sheets).sort("_id", ASCENDING).batch_size(DEFAULT_PAGE_SIZE):
+        for position, record in enumerate(sheet_records(sheet)):
+            if after and (sheet["_id"], position) <= tuple(after):
+                continue
+            if record_matches(record, query):
+                yield sheet["_id"], position, record
+
+async def sheet_list_response(query: dict, limit: Optional[int], cursor: Optional[str], response_format: str):
+    """list_response over attendance sheets, keyed by (session_id, position on the sheet)"""
+    if limit is None and cursor is None:
+        rows = (record async for _, _, record in iter_sheet_rows(query))
+        if response_format == "ndjson":
+            return StreamingResponse(ndjson_rows(rows), media_type="application/x-ndjson")
+        return StreamingResponse(json_array_rows(rows), media_type="application/json")
+    
+    limit = limit or DEFAULT_PAGE_SIZE
+    docs = []
+    next_token = None
+    async for session_id, position, record in iter_sheet_rows(query, decode_cursor(cursor, 2) if cursor else None):
+        if len(docs) == limit:
+            next_token = encode_cursor(last_key)
+            break
+        docs.append(record)
+        last_key = [session_id, position]
+    
+    if response_format == "ndjson":
+        return StreamingResponse(
+            ndjson_rows(aiter_list(docs)),
+            media_type="application/x-ndjson",
+            headers={"X-Next-Cursor": next_token} if next_token else None
+        )
+    return {"items": docs, "next": next_token}
+
+async def count_marks(storage: str) -> int:
+    if storage == "sheets":
+        rows = await db.attendance_sheets.aggregate([
+            {"$group": {"_id": None, "count": {"$sum": {"$size": {"$ifNull": ["$students", []]}}}}}
+        ]).to_list(1)
+        return rows[0]["count"] if rows else 0
+    return await db.attendance_records.count_documents({})
+
+async def migrate_attendance_storage(target: str, apply: bool = True, batch_size: int = 1000) -> dict:
+    """Copy every mark from the other storage into target ("records" or "sheets").
+    
+    Marks already in the target are skipped, so the copy can be re-run and can
+    run while the app still writes to the source. Run it once before switching
+    ATTENDANCE_STORAGE and again afterwards to pick up marks that landed in
+    between; the source collection is left for you to drop. Sheet marks have no
+    stored id, so records copied back get "<session_id>:<student_id>" ids.
+    """
+    source = "records" if target == "sheets" else "sheets"
+    report = {"source_marks": await count_marks(source), "target_marks_before": await count_marks(target), "copied": 0}
+    if not apply:
+        return report
+    
+    async def flush(batch: list):
+        write = push_sheet_marks if target == "sheets" else insert_records
+        collection = db.attendance_sheets if target == "sheets" else db.attendance_records
+        failures = await write(collection, batch)
+        for error in failures.values():
+            if not isinstance(error, DuplicateKeyError):
+                raise error
+        report["copied"] += len(batch) - len(failures)
+    
+    if source == "records":
+        records = db.attendance_records.find({}, {"_id": 0}).sort([("session_id", ASCENDING), ("student_id", ASCENDING)])
+    else:
+        records = (record async for sheet in db.attendance_sheets.find({}).sort("_id", ASCENDING) for record in sheet_records(sheet))
+    batch = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    report["target_marks_after"] = await count_marks(target)
+    return report
+
+# ==================== WRITE BATCHING ====================
+
+class InsertBatcher:
+    """Write-behind queue that groups inserts into insert_many(ordered=False).
+    
+    submit() resolves once the batch holding the document has committed, or
+    raises DuplicateKeyError if the unique index rejected that document.
+    write(collection, docs) replaces insert_many, e.g. with push_sheet_marks;
+    it returns {index: exception} for the documents it rejected.
+    after_commit, if given, receives the (doc, context) pairs that were inserted
+    before any waiter is released.
+    """
+    
+    def __init__(self, collection, max_batch: int, interval_ms: float, after_commit=None, write=insert_records):
+        self.collection = collection
+        self.write = write
+        self.max_batch = max_batch
+        self.interval = interval_ms / 1000
+        self.after_commit = after_commit
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.batches = 0
+        self.inserted = 0
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop accepting marks and flush whatever is queued"""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+    
+    async def submit(self, doc: dict, context=None):
+        if self._closing:
+            raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": "1"})
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, context, future))
+        if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return await future
+    
+    async def _run(self):
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            if len(self._pending) < self.max_batch and not self._closing:
+                # Give the batch a few milliseconds to fill; submit() wakes us early when it does
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            await self._flush(batch)
+    
+    async def _flush(self, batch: list):
+        try:
+            failures = await self.write(self.collection, [doc for doc, _, _ in batch])
+        except Exception as e:
+            failures = {i: e for i in range(len(batch))}
+        
+        committed = [(doc, context) for i, (doc, context, _) in enumerate(batch) if i not in failures]
+        self.batches += 1
+        self.inserted += len(committed)
+        if committed and self.after_commit is not None:
+            try:
+                await self.after_commit(committed)
+            except Exception:
+                logger.exception("after_commit hook failed for %d inserted documents", len(committed))
+        
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failures:
+                future.set_exception(failures[i])
+            else:
+                future.set_result(None)
+
+async def apply_attendance_counters(committed: list):
+    """Bump sessions_attended for a committed batch of marks in one bulk write"""
+    await db.attendance_summaries.bulk_write([
+        UpdateOne(
+            {"student_id": doc["student_id"]},
+            {"$inc": {"sessions_attended": 1}, "$setOnInsert": {**seed, "sessions_held": 0}},
+            upsert=True
+        )
+        for doc, seed in committed
+    ], ordered=False)
+
+async def record_committed_marks(committed: list):
+    """Everything that follows a committed batch of marks: summary counters, then the live feed"""
+    await apply_attendance_counters(committed)
+    if not LIVE_FEED_CHANGE_STREAM:
+        for doc, _ in committed:
+            live_feed.publish_mark(doc)
+
+attendance_batcher = (
+    InsertBatcher(
+        marks_collection(), ATTENDANCE_BATCH_SIZE, ATTENDANCE_BATCH_INTERVAL_MS, record_committed_marks,
+        write=push_sheet_marks if ATTENDANCE_STORAGE == "sheets" else insert_records
+    )
+    if ATTENDANCE_WRITE_MODE == "batched" else None
+)
+
+# ==================== LIVE FEED ====================
+
+def sse_frame(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+class LiveFeed:
+    """Fans attendance marks out to every subscriber of a session.
+    
+    Each worker has a single source per session (its own commits, or the change
+    stream) however many dashboards are watching: a mark is encoded once and the
+    same frame is queued for every subscriber. A channel keeps the set of marked
+    student ids, so the running count survives repeats and reconnects. A subscriber
+    that falls queue_size frames behind is sent "lagged" and dropped, and reconnects.
+    """
+    
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._channels = {}
+    
+    async def subscribe(self, session: dict, loader) -> tuple:
+        """Register a subscriber; returns (queue, current count)"""
+        session_id = session["id"]
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = {
+                "queues": set(), "marked": set(), "names": {}, "loaded": asyncio.ensure_future(loader(session))
+            }
+        queue = asyncio.Queue(self.queue_size)
+        channel["queues"].add(queue)
+        try:
+            marked, names = await asyncio.shield(channel["loaded"])
+        except Exception:
+            self.unsubscribe(session_id, queue)
+            raise
+        channel["marked"] |= marked
+        channel["names"] = names
+        return queue, len(channel["marked"])
+    
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        channel = self._channels.get(session_id)
+        if channel is None:
+            return
+        channel["queues"].discard(queue)
+        if not channel["queues"]:
+            del self._channels[session_id]
+    
+    def _broadcast(self, channel: dict, frame: str, final: bool = False):
+        for queue in list(channel["queues"]):
+            try:
+                queue.put_nowait((frame, final))
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait((sse_frame("lagged", {}), True))
+                channel["queues"].discard(queue)
+    
+    def publish_mark(self, record: dict):
+        channel = self._channels.get(record["session_id"])
+        if channel is None or record["student_id"] in channel["marked"]:
+            return
+        channel["marked"].add(record["student_id"])
+        self._broadcast(channel, sse_frame("mark", {
+            "count": len(channel["marked"]),
+            "record": {
+                "id": record.get("id"),
+                "student_id": record["student_id"],
+                "name": channel["names"].get(record["student_id"]),
+                "method": record.get("method"),
+                "marked_at": record.get("marked_at")
+            }
+        }))
+    
+    def publish_end(self, session_id: str):
+        channel = self._channels.pop(session_id, None)
+        if channel is not None:
+            self._broadcast(channel, sse_frame("ended", {"count": len(channel["marked"])}), final=True)
+
+live_feed = LiveFeed(LIVE_FEED_QUEUE_SIZE)
+
+async def load_live_channel(session: dict) -> tuple:
+    """Students already marked for a session, and the names of its roster"""
+    marked = await marked_student_ids(session["id"])
+    query = {"role": UserRole.STUDENT, "department_id": session["department_id"]}
+    if session.get("year"):
+        query["year"] = session["year"]
+    if session.get("section"):
+        query["section"] = session["section"]
+    names = {user["id"]: user.get("name") async for user in db.users.find(query, {"_id": 0, "id": 1, "name": 1})}
+    return marked, names
+
+def changed_marks(change: dict) -> list:
+    """Marks added by one change event on attendance_records or attendance_sheets"""
+    if ATTENDANCE_STORAGE != "sheets":
+        return [change["fullDocument"]]
+    if change["operationType"] == "insert":
+        return sheet_records(change["fullDocument"])
+    session_id = change["documentKey"]["_id"]
+    fields = change.get("updateDescription", {}).get("updatedFields", {})
+    if "students" in fields:
+        # The whole array was rewritten; LiveFeed skips students it already counted
+        return sheet_records({"_id": session_id, **fields})
+    marks = []
+    for key, student in fields.items():
+        prefix, _, position = key.partition(".")
+        if prefix == "students":
+            marks.append({
+                "session_id": session_id,
+                "student_id": unpack_student_id(student),
+                "marked_at": fields.get(f"marked_at.{position}"),
+                "method": fields.get(f"methods.{position}")
+            })
+    return marks
+
+async def watch_attendance_changes():
+    """Feed live subscribers from marks written by any worker (needs a replica set)"""
+    operations = ["insert", "update"] if ATTENDANCE_STORAGE == "sheets" else ["insert"]
+    try:
+        async with marks_collection().watch([{"$match": {"operationType": {"$in": operations}}}]) as stream:
+            async for change in stream:
+                for mark in changed_marks(change):
+                    live_feed.publish_mark(mark)
+    except PyMongoError as e:
+        logger.warning("Attendance change stream stopped, live feeds only see this worker: %s", e)
+
+# ==================== SESSION EXPIRY ====================
+
+class ExpiryScheduler:
+    """Closes sessions at their deadline from one heap per worker.
+    
+    A worker schedules the sessions it creates and, every sweep_interval, the
+    open sessions any worker created that fall due before the next sweep, so
+    several workers may hold the same deadline. expire() closes with an update
+    conditional on is_active: exactly one of them wins and finalizes the
+    session, and each evicts it from its own caches. Entries for sessions ended
+    by hand are cancelled lazily and skipped when they come up.
+    """
+    
+    def __init__(self, expire, due, sweep_interval: float):
+        self.expire = expire
+        self.due = due
+        self.sweep_interval = sweep_interval
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+    
+    def __len__(self) -> int:
+        return len(self._deadlines)
+    
+    def schedule(self, session_id: str, deadline: datetime):
+        if self._deadlines.get(session_id) == deadline:
+            return
+        self._deadlines[session_id] = deadline
+        heapq.heappush(self._heap, (deadline, session_id))
+        if self._heap[0] == (deadline, session_id):
+            self._wakeup.set()
+    
+    def cancel(self, session_id: str):
+        self._deadlines.pop(session_id, None)
+    
+    async def run(self):
+        next_sweep = time.monotonic()
+        while True:
+            if time.monotonic() >= next_sweep:
+                try:
+                    horizon = datetime.now(timezone.utc) + timedelta(seconds=self.sweep_interval)
+                    for session_id, deadline in await self.due(horizon):
+                        self.schedule(session_id, deadline)
+                except PyMongoError as e:
+                    logger.warning("Session expiry sweep failed: %s", e)
+                next_sweep = time.monotonic() + self.sweep_interval
+            
+            now = datetime.now(timezone.utc)
+            while self._heap and self._heap[0][0] <= now:
+                deadline, session_id = heapq.heappop(self._heap)
+                if self._deadlines.get(session_id) != deadline:
+                    continue
+                del self._deadlines[session_id]
+                try:
+                    await self.expire(session_id, deadline)
+                except Exception:
+                    # Still open, so the next sweep schedules it again
+                    logger.exception("Failed to expire session %s", session_id)
+            
+            delay = next_sweep - time.monotonic()
+            if self._heap:
+                delay = min(delay, (self._heap[0][0] - now).total_seconds())
+            # asyncio.wait rather than wait_for, which on 3.11 can swallow shutdown's cancel()
+            self._wakeup.clear()
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([wakeup], timeout=max(delay, 0))
+            finally:
+                wakeup.cancel()
+
+sessions_expired = metrics.registry.counter("app_sessions_expired_total", "Sessions closed by the expiry scheduler")
+
+async def sessions_due(until: datetime) -> list:
+    """(id, deadline) of open sessions whose deadline is before until"""
+    clauses = [{"expires_at": {"$lt": until}}]
+    if SESSION_DURATION_MINUTES:
+        clauses.append({"expires_at": None, "start_time": {"$lt": until - timedelta(minutes=SESSION_DURATION_MINUTES)}})
+    return [
+        (session["id"], session_deadline(session))
+        async for session in db.sessions.find(
+            {"is_active": True, "$or": clauses}, {"_id": 0, "id": 1, "start_time": 1, "expires_at": 1}
+        )
+    ]
+
+async def expire_session(session_id: str, deadline: datetime) -> bool:
+    """Close a session at its deadline; only the caller whose update lands rolls it up"""
+    result = await db.sessions.update_one(
+        {"id": session_id, "is_active": True},
+        {"$set": {"is_active": False, "end_time": deadline}}
+    )
+    session_cache.invalidate(session_id)
+    expiry_scheduler.cancel(session_id)
+    live_feed.publish_end(session_id)
+    if result.modified_count == 0:
+        return False
+    sessions_expired.inc()
+    await roll_up_closed_session(session_id)
+    return True
+
+expiry_scheduler = ExpiryScheduler(expire_session, sessions_due, SESSION_EXPIRY_SWEEP_SECONDS)
+metrics.registry.callback_gauge(
+    "app_sessions_scheduled", "Session deadlines held by this worker's expiry scheduler", (),
+    lambda: {(): len(expiry_scheduler)}
+)
 
 # ==================== AUTH ENDPOINTS ====================
 
@@ -229,41 +1884,25 @@ async def root():
 
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(request: RegisterRequest):
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": request.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create user
+    # Create user; the unique email index rejects duplicates
     user_dict = request.model_dump()
-    user_dict["password_hash"] = hash_password(request.password)
+    user_dict["password_hash"] = await hash_password_async(request.password)
     del user_dict["password"]
     
     user_obj = User(**user_dict)
     doc = user_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     
-    await db.users.insert_one(doc)
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create token
-    access_token = create_access_token(data={"sub": user_obj.id})
+    if user_obj.role == UserRole.STUDENT:
+        summary = student_summary_seed(doc)
+        summary.update({"sessions_held": 0, "sessions_attended": 0})
+        await db.attendance_summaries.update_one({"student_id": user_obj.id}, {"$setOnInsert": summary}, upsert=True)
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user={
-            "id": user_obj.id,
-            "email": user_obj.email,
-            "name": user_obj.name,
-            "role": user_obj.role,
-            "university_id": user_obj.university_id,
-            "college_id": user_obj.college_id,
-            "department_id": user_obj.department_id,
-            "year": user_obj.year,
-            "section": user_obj.section,
-            "subject": user_obj.subject
-        }
-    )
+    return token_response(doc)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(request: LoginRequest):
@@ -271,33 +1910,40 @@ async def login(request: LoginRequest):
     if not user_data:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(request.password, user_data["password_hash"]):
+    if not await verify_password_async(request.password, user_data["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user_data.get("is_active", True):
         raise HTTPException(status_code=403, detail="Account is suspended")
     
-    access_token = create_access_token(data={"sub": user_data["id"]})
+    return token_response(user_data)
+
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh(request: RefreshRequest):
+    try:
+        payload = jwt.decode(request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    if payload.get("type") != "refresh" or payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    # Refresh re-reads the user, so new claims and suspensions take effect here
+    user_data = await db.users.find_one({"id": payload["sub"]}, {"_id": 0, "password_hash": 0})
+    if user_data is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not user_data.get("is_active", True):
+        raise HTTPException(status_code=403, detail="Account is suspended")
+    if payload.get("ver", 0) < user_data.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user={
-            "id": user_data["id"],
-            "email": user_data["email"],
-            "name": user_data["name"],
-            "role": user_data["role"],
-            "university_id": user_data.get("university_id"),
-            "college_id": user_data.get("college_id"),
-            "department_id": user_data.get("department_id"),
-            "year": user_data.get("year"),
-            "section": user_data.get("section"),
-            "subject": user_data.get("subject")
-        }
-    )
+    return token_response(user_data)
 
 @api_router.get("/auth/me")
-async def get_me(current_user: dict = Depends(get_current_user)):
+async def get_me(current_user: dict = Depends(get_current_user_document)):
+    embedding = current_user.pop("face_embedding", None)
+    current_user["face_enrolled"] = (
+        isinstance(embedding, bytes) and current_user.get("face_embedding_version") == faces.EMBEDDING_VERSION
+    )
     return current_user
 
 # ==================== UNIVERSITY ADMIN ENDPOINTS ====================
@@ -309,15 +1955,14 @@ async def create_university(request: CreateUniversityRequest, current_user: dict
     
     uni_obj = University(name=request.name, address=request.address)
     doc = uni_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.universities.insert_one(doc)
+    await bump_reference_version("universities")
     return uni_obj
 
 @api_router.get("/universities")
-async def get_universities(current_user: dict = Depends(get_current_user)):
-    universities = await db.universities.find({}, {"_id": 0}).to_list(1000)
-    return universities
+async def get_universities(request: Request, current_user: dict = Depends(get_current_user)):
+    return await reference_response(request, "universities", {})
 
 @api_router.post("/colleges")
 async def create_college(request: CreateCollegeRequest, current_user: dict = Depends(get_current_user)):
@@ -326,21 +1971,20 @@ async def create_college(request: CreateCollegeRequest, current_user: dict = Dep
     
     college_obj = College(name=request.name, university_id=request.university_id, is_approved=True)
     doc = college_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.colleges.insert_one(doc)
+    await bump_reference_version("colleges")
     return college_obj
 
 @api_router.get("/colleges")
-async def get_colleges(university_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_colleges(request: Request, university_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {}
     if university_id:
         query["university_id"] = university_id
     elif current_user["role"] == UserRole.COLLEGE_ADMIN and current_user.get("college_id"):
         query["id"] = current_user["college_id"]
     
-    colleges = await db.colleges.find(query, {"_id": 0}).to_list(1000)
-    return colleges
+    return await reference_response(request, "colleges", query)
 
 @api_router.put("/colleges/{college_id}/suspend")
 async def suspend_college(college_id: str, current_user: dict = Depends(get_current_user)):
@@ -350,6 +1994,7 @@ async def suspend_college(college_id: str, current_user: dict = Depends(get_curr
     result = await db.colleges.update_one({"id": college_id}, {"$set": {"is_active": False}})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="College not found")
+    await bump_reference_version("colleges")
     return {"message": "College suspended successfully"}
 
 @api_router.put("/colleges/{college_id}/activate")
@@ -360,6 +2005,7 @@ async def activate_college(college_id: str, current_user: dict = Depends(get_cur
     result = await db.colleges.update_one({"id": college_id}, {"$set": {"is_active": True}})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="College not found")
+    await bump_reference_version("colleges")
     return {"message": "College activated successfully"}
 
 # ==================== COLLEGE ADMIN ENDPOINTS ====================
@@ -377,13 +2023,13 @@ async def create_department(request: CreateDepartmentRequest, current_user: dict
     
     dept_obj = Department(**dept_dict)
     doc = dept_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.departments.insert_one(doc)
+    await bump_reference_version("departments")
     return dept_obj
 
 @api_router.get("/departments")
-async def get_departments(college_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_departments(request: Request, college_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {}
     if college_id:
         query["college_id"] = college_id
@@ -392,8 +2038,7 @@ async def get_departments(college_id: Optional[str] = None, current_user: dict =
     elif current_user["role"] == UserRole.DEPARTMENT_ADMIN and current_user.get("department_id"):
         query["id"] = current_user["department_id"]
     
-    departments = await db.departments.find(query, {"_id": 0}).to_list(1000)
-    return departments
+    return await reference_response(request, "departments", query)
 
 # ==================== DEPARTMENT ADMIN ENDPOINTS ====================
 
@@ -402,12 +2047,12 @@ async def assign_faculty(request: AssignFacultyRequest, current_user: dict = Dep
     if current_user["role"] not in [UserRole.DEPARTMENT_ADMIN, UserRole.COLLEGE_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = await db.users.update_one(
+    faculty = await update_user_and_revoke(
         {"id": request.faculty_id, "role": UserRole.FACULTY},
         {"$set": {"department_id": request.department_id, "subject": request.subject}}
     )
     
-    if result.modified_count == 0:
+    if faculty is None:
         raise HTTPException(status_code=404, detail="Faculty not found")
     
     return {"message": "Faculty assigned successfully"}
@@ -418,6 +2063,9 @@ async def get_users(
     department_id: Optional[str] = None,
     year: Optional[str] = None,
     section: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     current_user: dict = Depends(get_current_user)
 ):
     query = {}
@@ -435,16 +2083,181 @@ async def get_users(
     elif current_user["role"] == UserRole.DEPARTMENT_ADMIN and current_user.get("department_id"):
         query["department_id"] = current_user["department_id"]
     
-    users = await db.users.find(query, {"_id": 0, "password_hash": 0}).to_list(1000)
-    return users
+    return await list_response(
+        db.users, query, {"password_hash": 0, "face_embedding": 0}, USER_SORT, limit, cursor, response_format
+    )
+
+def get_import_executor():
+    global import_executor
+    if import_executor is None and IMPORT_HASH_WORKERS > 0:
+        import_executor = ProcessPoolExecutor(
+            max_workers=IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return import_executor
+
+def parse_import_rows(text: str, import_format: str):
+    """Yield (row number, row dict or None, parse error or None) from CSV with a header row or NDJSON"""
+    if import_format == "csv":
+        for number, row in enumerate(csv.DictReader(StringIO(text)), start=2):
+            if None in row:
+                yield number, None, "Too many columns"
+            else:
+                yield number, {key.strip(): value.strip() if value else None for key, value in row.items()}, None
+        return
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, "Expected a JSON object"
+
+def import_scope(current_user: dict) -> dict:
+    """Fields every imported row must share with the importing admin"""
+    fields = ["university_id", "college_id"]
+    if current_user["role"] == UserRole.DEPARTMENT_ADMIN:
+        fields.append("department_id")
+    return {field: current_user[field] for field in fields if current_user.get(field)}
+
+def validate_import_row(row: dict, scope: dict) -> RegisterRequest:
+    values = {key: value for key, value in row.items() if value not in (None, "")}
+    for field, value in scope.items():
+        if values.setdefault(field, value) != value:
+            raise ValueError(f"{field} must be {value}")
+    request = RegisterRequest(**values)
+    if request.role not in [UserRole.STUDENT, UserRole.FACULTY]:
+        raise ValueError("Only students and faculty can be imported")
+    return request
+
+async def hash_passwords_bulk(plain: list) -> list:
+    """Hash in chunks across the import pool, falling back to the password pool when it is disabled"""
+    rounds = pwd_context.handler("bcrypt").default_rounds
+    chunks = [plain[i:i + IMPORT_HASH_CHUNK] for i in range(0, len(plain), IMPORT_HASH_CHUNK)]
+    executor = get_import_executor()
+    if executor is None:
+        results = [await run_password_task(passwords.hash_many, chunk, rounds) for chunk in chunks]
+    else:
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, passwords.hash_many, chunk, rounds) for chunk in chunks
+        ])
+    return [hashed for chunk in results for hashed in chunk]
+
+async def insert_import_batch(docs: list) -> dict:
+    """insert_many(ordered=False); returns {index in docs: error} for rows that were not inserted"""
+    failed = {}
+    try:
+        await db.users.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            failed[error["index"]] = "Email already registered"
+    
+    students = [doc for i, doc in enumerate(docs) if i not in failed and doc["role"] == UserRole.STUDENT]
+    if students:
+        await db.attendance_summaries.bulk_write([
+            UpdateOne(
+                {"student_id": doc["id"]},
+                {"$setOnInsert": {**student_summary_seed(doc), "student_id": doc["id"], "sessions_held": 0, "sessions_attended": 0}},
+                upsert=True
+            )
+            for doc in students
+        ], ordered=False)
+    return failed
+
+async def import_progress(valid: list, errors: list):
+    """NDJSON lines: rejected rows as they are found, progress after each batch, then a summary"""
+    total = len(valid) + len(errors)
+    failed = len(errors)
+    imported = 0
+    for error in errors:
+        yield json.dumps({"type": "error", **error}) + "\n"
+    
+    batches = [valid[i:i + IMPORT_BATCH_SIZE] for i in range(0, len(valid), IMPORT_BATCH_SIZE)]
+    hashing = None
+    try:
+        # Hash the next batch while the current one is written
+        if batches:
+            hashing = asyncio.ensure_future(hash_passwords_bulk([request.password for _, request in batches[0]]))
+        for index, batch in enumerate(batches):
+            hashes = await hashing
+            hashing = None
+            if index + 1 < len(batches):
+                hashing = asyncio.ensure_future(hash_passwords_bulk([request.password for _, request in batches[index + 1]]))
+            
+            docs = []
+            for (_, request), password_hash in zip(batch, hashes):
+                user_dict = request.model_dump()
+                del user_dict["password"]
+                doc = User(**user_dict, password_hash=password_hash).model_dump()
+                docs.append(doc)
+            
+            rejected = await insert_import_batch(docs)
+            for i, message in sorted(rejected.items()):
+                yield json.dumps({"type": "error", "row": batch[i][0], "email": docs[i]["email"], "error": message}) + "\n"
+            failed += len(rejected)
+            imported += len(docs) - len(rejected)
+            yield json.dumps({"type": "progress", "processed": failed + imported, "total": total, "imported": imported, "failed": failed}) + "\n"
+    finally:
+        if hashing is not None:
+            hashing.cancel()
+    
+    yield json.dumps({"type": "summary", "total": total, "imported": imported, "failed": failed}) + "\n"
+
+@api_router.post("/users/import")
+async def import_users(
+    file: UploadFile = File(...),
+    import_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Create students and faculty from a CSV or NDJSON file, streaming progress as NDJSON.
+    
+    Rows use the /auth/register fields; scope fields missing from a row are taken
+    from the importing admin, and rows naming a different scope are rejected.
+    """
+    if current_user["role"] not in [UserRole.COLLEGE_ADMIN, UserRole.DEPARTMENT_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if import_format is None:
+        import_format = "ndjson" if (file.filename or "").lower().endswith((".ndjson", ".jsonl")) else "csv"
+    try:
+        text = (await read_upload(file, IMPORT_MAX_BYTES)).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Import file must be UTF-8")
+    
+    scope = import_scope(current_user)
+    valid, errors, seen = [], [], set()
+    for number, row, error in parse_import_rows(text, import_format):
+        if error is None:
+            try:
+                request = validate_import_row(row, scope)
+                if request.email in seen:
+                    error = "Duplicate email in file"
+                else:
+                    seen.add(request.email)
+                    valid.append((number, request))
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append({"row": number, "email": (row or {}).get("email"), "error": error})
+    
+    return StreamingResponse(import_progress(valid, errors), media_type="application/x-ndjson")
 
 @api_router.put("/users/{user_id}/suspend")
 async def suspend_user(user_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in [UserRole.UNIVERSITY_ADMIN, UserRole.COLLEGE_ADMIN, UserRole.DEPARTMENT_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = await db.users.update_one({"id": user_id}, {"$set": {"is_active": False}})
-    if result.modified_count == 0:
+    user = await update_user_and_revoke({"id": user_id}, {"$set": {"is_active": False}})
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User suspended successfully"}
 
@@ -453,8 +2266,8 @@ async def activate_user(user_id: str, current_user: dict = Depends(get_current_u
     if current_user["role"] not in [UserRole.UNIVERSITY_ADMIN, UserRole.COLLEGE_ADMIN, UserRole.DEPARTMENT_ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = await db.users.update_one({"id": user_id}, {"$set": {"is_active": True}})
-    if result.modified_count == 0:
+    user = await update_user_and_revoke({"id": user_id}, {"$set": {"is_active": True}})
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User activated successfully"}
 
@@ -473,17 +2286,22 @@ async def create_session(request: CreateSessionRequest, current_user: dict = Dep
         "year": request.year,
         "section": request.section,
         "is_active": True
-    })
+    }, {"_id": 0, "id": 1, "is_active": 1, "start_time": 1, "expires_at": 1})
     
     if existing_session:
-        raise HTTPException(status_code=400, detail="Active session already exists")
+        if session_open(existing_session):
+            raise HTTPException(status_code=400, detail="Active session already exists")
+        # Past its deadline but not swept yet: close it now rather than block the new one
+        await expire_session(existing_session["id"], session_deadline(existing_session))
     
-    # Generate QR code with session token
+    # Generate session token; the QR image is rendered by GET /sessions/{id}/qr
     session_id = str(uuid.uuid4())
-    qr_token = hashlib.sha256(f"{session_id}{datetime.now(timezone.utc).isoformat()}".encode()).hexdigest()
-    qr_data = json.dumps({"session_id": session_id, "token": qr_token})
-    qr_code_img, _ = generate_qr_code(qr_data)
+    qr_token = None
+    if QR_TOKEN_MODE != "rotating":
+        qr_token = hashlib.sha256(f"{session_id}{datetime.now(timezone.utc).isoformat()}".encode()).hexdigest()
     
+    start_time = datetime.now(timezone.utc)
+    duration = request.duration_minutes or SESSION_DURATION_MINUTES
     session_obj = AttendanceSession(
         id=session_id,
         college_id=current_user.get("college_id"),
@@ -494,19 +2312,27 @@ async def create_session(request: CreateSessionRequest, current_user: dict = Dep
         section=request.section,
         session_type=request.session_type,
         session_date=request.session_date,
-        start_time=datetime.now(timezone.utc),
-        qr_code=qr_code_img,
+        start_time=start_time,
+        expires_at=start_time + timedelta(minutes=duration) if duration else None,
         qr_token=qr_token,
+        qr_mode="rotating" if QR_TOKEN_MODE == "rotating" else "static",
         is_active=True
     )
     
     doc = session_obj.model_dump()
-    doc["start_time"] = doc["start_time"].isoformat()
-    doc["created_at"] = doc["created_at"].isoformat()
-    if doc.get("end_time"):
-        doc["end_time"] = doc["end_time"].isoformat()
     
     await db.sessions.insert_one(doc)
+    if session_obj.expires_at:
+        expiry_scheduler.schedule(session_id, session_obj.expires_at)
+    if ATTENDANCE_STORAGE == "sheets":
+        # Opened up front so concurrent first marks don't race to upsert it
+        await db.attendance_sheets.insert_one({"_id": session_id, "students": [], "marked_at": [], "methods": []})
+    
+    # Every student on the roster gains one session in their denominator
+    await db.attendance_summaries.update_many(
+        roster_query(request.department_id, request.year, request.section),
+        {"$inc": {"sessions_held": 1}}
+    )
     return session_obj
 
 @api_router.get("/sessions")
@@ -514,10 +2340,17 @@ async def get_sessions(
     department_id: Optional[str] = None,
     year: Optional[str] = None,
     section: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from", description="sessions starting at or after"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="sessions starting before"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     current_user: dict = Depends(get_current_user)
 ):
     query = {}
     
+    if date_from or date_to:
+        query["start_time"] = date_range(date_from, date_to)
     if department_id:
         query["department_id"] = department_id
     if year:
@@ -536,8 +2369,41 @@ async def get_sessions(
         query["section"] = current_user.get("section")
         query["department_id"] = current_user.get("department_id")
     
-    sessions = await db.sessions.find(query, {"_id": 0}).sort("start_time", -1).to_list(1000)
-    return sessions
+    return await list_response(
+        db.sessions, query, SESSION_LIST_PROJECTION, SESSION_SORT, limit, cursor, response_format
+    )
+
+@api_router.get("/sessions/{session_id}/qr")
+async def get_session_qr(
+    session_id: str,
+    request: Request,
+    image_format: str = Query("png", alias="format", pattern="^(png|svg)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in [UserRole.FACULTY, UserRole.DEPARTMENT_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    session = await get_session_meta(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    max_age = QR_CACHE_MAX_AGE
+    if session.get("qr_mode") == "rotating":
+        # Rotating codes are only issued while the session is open; mark_attendance trusts that
+        if not session_open(session):
+            raise HTTPException(status_code=400, detail="Session has expired")
+        max_age = QR_ROTATION_SECONDS - int(time.time()) % QR_ROTATION_SECONDS
+    
+    payload = session_qr_payload(session)
+    etag = '"' + hashlib.sha256(f"{image_format}:{payload}".encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}", "X-QR-Expires-In": str(max_age)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    started = time.perf_counter()
+    content = render_qr_code(payload, image_format)
+    stage_duration.observe(time.perf_counter() - started, stage="render_qr_code")
+    return Response(content=content, media_type=QR_MEDIA_TYPES[image_format], headers=headers)
 
 @api_router.put("/sessions/{session_id}/end")
 async def end_session(session_id: str, current_user: dict = Depends(get_current_user)):
@@ -546,28 +2412,109 @@ async def end_session(session_id: str, current_user: dict = Depends(get_current_
     
     result = await db.sessions.update_one(
         {"id": session_id},
-        {"$set": {"is_active": False, "end_time": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_active": False, "end_time": datetime.now(timezone.utc)}}
     )
+    session_cache.invalidate(session_id)
+    expiry_scheduler.cancel(session_id)
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    live_feed.publish_end(session_id)
+    await roll_up_closed_session(session_id)
     return {"message": "Session ended successfully"}
 
+@api_router.get("/sessions/{session_id}/live")
+async def session_live_feed(session_id: str, current_user: dict = Depends(get_current_user)):
+    """Server-sent events for a session: a snapshot count, then each new mark with the running count"""
+    if current_user["role"] not in [UserRole.FACULTY, UserRole.DEPARTMENT_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    session = await get_session_meta(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    queue, count = await live_feed.subscribe(session, load_live_channel)
+    if not session_open(session):
+        live_feed.unsubscribe(session_id, queue)
+        queue = None
+    
+    async def events():
+        try:
+            yield sse_frame("snapshot", {"count": count, "is_active": queue is not None})
+            while queue is not None:
+                try:
+                    frame, final = await asyncio.wait_for(queue.get(), LIVE_FEED_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield frame
+                if final:
+                    break
+        finally:
+            if queue is not None:
+                live_feed.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in [UserRole.UNIVERSITY_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {"sessions": session_cache.stats()}
+
 # ==================== ATTENDANCE ENDPOINTS ====================
 
 @api_router.post("/attendance/mark")
 async def mark_attendance(request: MarkAttendanceRequest, current_user: dict = Depends(get_current_user)):
     if current_user["role"] != UserRole.STUDENT:
         raise HTTPException(status_code=403, detail="Only students can mark attendance")
+    if request.method == "face" and not FACE_MARKING_ENABLED:
+        raise HTTPException(status_code=400, detail="Face attendance is disabled; mark with the session's QR code")
     
-    # Check session exists and is active
-    session = await db.sessions.find_one({"id": request.session_id}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if not session.get("is_active", False):
-        raise HTTPException(status_code=400, detail="Session has expired")
+    qr_data = None
+    if request.method == "qr":
+        if not request.qr_token:
+            raise HTTPException(status_code=400, detail="QR token is required")
+        try:
+            qr_data = json.loads(request.qr_token)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid QR code format")
+        if not isinstance(qr_data, dict) or qr_data.get("session_id") != request.session_id:
+            raise HTTPException(status_code=400, detail="Invalid QR code")
+    
+    if qr_data is not None and "window" in qr_data:
+        # Rotating token: signature, window and scope come from the payload; whether the
+        # session is still open comes from the session cache, which end_session and expiry invalidate
+        verify_rotating_qr(qr_data)
+        meta = await get_session_meta(request.session_id)
+        if not meta:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if not session_open(meta):
+            raise HTTPException(status_code=400, detail="Session has expired")
+        session = qr_data
+        if session.get("department_id") and session["department_id"] != current_user.get("department_id"):
+            raise HTTPException(status_code=403, detail="You are not enrolled in this session's department")
+    else:
+        # Check session exists and is active
+        session = await get_session_meta(request.session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        if not session_open(session):
+            raise HTTPException(status_code=400, detail="Session has expired")
+        
+        # Verify token matches; rotating sessions store no token and only accept signed payloads
+        if qr_data is not None and (
+            session.get("qr_mode") == "rotating"
+            or not session.get("qr_token")
+            or not isinstance(qr_data.get("token"), str)
+            or not hmac.compare_digest(qr_data["token"].encode(), session["qr_token"].encode())
+        ):
+            raise HTTPException(status_code=400, detail="Invalid or expired QR token")
     
     # Verify student belongs to correct year/section
     if session.get("year") and session["year"] != current_user.get("year"):
@@ -576,28 +2523,7 @@ async def mark_attendance(request: MarkAttendanceRequest, current_user: dict = D
     if session.get("section") and session["section"] != current_user.get("section"):
         raise HTTPException(status_code=403, detail="You are not enrolled in this session's section")
     
-    # Check if already marked
-    existing_record = await db.attendance_records.find_one({
-        "session_id": request.session_id,
-        "student_id": current_user["id"]
-    })
-    
-    if existing_record:
-        raise HTTPException(status_code=400, detail="Attendance already marked")
-    
-    # Validate QR token if method is qr
-    if request.method == "qr" and request.qr_token:
-        try:
-            qr_data = json.loads(request.qr_token)
-            if qr_data.get("session_id") != request.session_id:
-                raise HTTPException(status_code=400, detail="Invalid QR code")
-            # Verify token matches
-            if qr_data.get("token") != session.get("qr_token"):
-                raise HTTPException(status_code=400, detail="Invalid or expired QR token")
-        except:
-            raise HTTPException(status_code=400, detail="Invalid QR code format")
-    
-    # Create attendance record
+    # Create attendance record; repeats are rejected by the unique (session_id, student_id) index, or the sheet's guard
     record_obj = AttendanceRecord(
         session_id=request.session_id,
         student_id=current_user["id"],
@@ -606,9 +2532,18 @@ async def mark_attendance(request: MarkAttendanceRequest, current_user: dict = D
     )
     
     doc = record_obj.model_dump()
-    doc["marked_at"] = doc["marked_at"].isoformat()
     
-    await db.attendance_records.insert_one(doc)
+    try:
+        if attendance_batcher is not None:
+            # Acknowledged once the batch commits; counters are bumped with the batch
+            await attendance_batcher.submit(doc, student_summary_seed(current_user))
+        else:
+            failures = await store_marks([doc])
+            if failures:
+                raise failures[0]
+            await record_committed_marks([(doc, student_summary_seed(current_user))])
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Attendance already marked")
     return {"message": "Attendance marked successfully", "record": record_obj}
 
 @api_router.get("/attendance/records")
@@ -618,6 +2553,11 @@ async def get_attendance_records(
     department_id: Optional[str] = None,
     year: Optional[str] = None,
     section: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from", description="marked at or after"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="marked before"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     current_user: dict = Depends(get_current_user)
 ):
     # Build session query
@@ -629,38 +2569,227 @@ async def get_attendance_records(
     if section:
         session_query["section"] = section
     
-    # Get relevant sessions
-    if session_id:
-        session_ids = [session_id]
-    else:
-        if current_user["role"] == UserRole.DEPARTMENT_ADMIN:
-            session_query["department_id"] = current_user.get("department_id")
-        elif current_user["role"] == UserRole.FACULTY:
-            session_query["faculty_id"] = current_user["id"]
-        
-        sessions = await db.sessions.find(session_query, {"_id": 0}).to_list(1000)
-        session_ids = [s["id"] for s in sessions]
+    if current_user["role"] == UserRole.DEPARTMENT_ADMIN:
+        session_query["department_id"] = current_user.get("department_id")
+    elif current_user["role"] == UserRole.FACULTY:
+        session_query["faculty_id"] = current_user["id"]
     
     # Build attendance query
     query = {}
-    if session_ids:
-        query["session_id"] = {"$in": session_ids}
+    if date_from or date_to:
+        query["marked_at"] = date_range(date_from, date_to)
+    if session_id:
+        query["session_id"] = session_id
+    elif session_query:
+        if date_to:
+            # A mark is never earlier than its session's start
+            session_query["start_time"] = {"$lt": as_utc(date_to)}
+        query["session_id"] = {"$in": await db.sessions.distinct("id", session_query)}
     
     if current_user["role"] == UserRole.STUDENT:
         query["student_id"] = current_user["id"]
     elif student_id:
         query["student_id"] = student_id
     
-    records = await db.attendance_records.find(query, {"_id": 0}).to_list(10000)
-    return records
+    if ATTENDANCE_STORAGE == "sheets":
+        return await sheet_list_response(query, limit, cursor, response_format)
+    return await list_response(
+        db.attendance_records, query, {}, RECORD_SORT, limit, cursor, response_format
+    )
 
-@api_router.get("/attendance/analytics")
-async def get_analytics(
+# ==================== EXPORT ====================
+
+async def iter_export_batches(session_query: dict, student_id: Optional[str] = None):
+    """Yield lists of joined export rows, at most EXPORT_BATCH_SIZE each.
+    
+    Sessions are read in start order and joined EXPORT_SESSION_CHUNK at a time
+    against their records through the (session_id, student_id) index; student
+    names are resolved with one $in per batch and kept in a bounded cache, so
+    memory depends on the batch size, not on the size of the term.
+    """
+    names = {}
+    
+    async def joined(chunk: list):
+        sessions = {session["id"]: session for session in chunk}
+        batch = []
+        async for record in iter_session_marks(list(sessions), student_id):
+            batch.append(record)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield await join_batch(batch, sessions)
+                batch = []
+        if batch:
+            yield await join_batch(batch, sessions)
+    
+    async def join_batch(batch: list, sessions: dict) -> list:
+        missing = list({record["student_id"] for record in batch} - names.keys())
+        if missing:
+            if len(names) + len(missing) > EXPORT_NAME_CACHE_SIZE:
+                names.clear()
+            names.update({student_id: None for student_id in missing})
+            async for user in db.users.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "name": 1}):
+                names[user["id"]] = user.get("name")
+        rows = []
+        for record in batch:
+            session = sessions[record["session_id"]]
+            rows.append((
+                record["student_id"], names.get(record["student_id"]), session.get("department_id"),
+                session.get("year"), session.get("section"), session["id"], session.get("session_date"),
+                session.get("session_type"), session.get("subject"), record.get("method"),
+                record.get("marked_at"), record.get("is_proxy", False)
+            ))
+        return rows
+    
+    chunk = []
+    async for session in db.sessions.find(session_query, EXPORT_SESSION_PROJECTION).sort([("start_time", ASCENDING), ("id", ASCENDING)]):
+        chunk.append(session)
+        if len(chunk) == EXPORT_SESSION_CHUNK:
+            async for rows in joined(chunk):
+                yield rows
+            chunk = []
+    if chunk:
+        async for rows in joined(chunk):
+            yield rows
+
+async def export_csv(batches):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    marked_at = EXPORT_COLUMNS.index("marked_at")
+    async for rows in batches:
+        writer.writerows(
+            (*row[:marked_at], row[marked_at].isoformat() if isinstance(row[marked_at], datetime) else row[marked_at], *row[marked_at + 1:])
+            for row in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+class ChunkSink:
+    """Write-only file object whose contents are drained as they are produced"""
+    
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def export_schema():
+    types = {"is_proxy": pa.bool_(), "marked_at": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(column, types.get(column, pa.string())) for column in EXPORT_COLUMNS])
+
+def write_row_group(writer, schema, rows: list):
+    columns = list(zip(*rows))
+    writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+
+async def export_parquet(batches):
+    """One row group per batch; the footer, and so the file, is complete once the stream ends"""
+    sink = ChunkSink()
+    schema = export_schema()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for rows in batches:
+            await asyncio.to_thread(write_row_group, writer, schema, rows)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+@api_router.get("/attendance/export")
+async def export_attendance(
     department_id: Optional[str] = None,
     year: Optional[str] = None,
     section: Optional[str] = None,
+    student_id: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from", description="sessions starting at or after"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="sessions starting before"),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|parquet)$"),
     current_user: dict = Depends(get_current_user)
 ):
+    """Stream attended marks joined with student names and session details as CSV or Parquet"""
+    if current_user["role"] == UserRole.STUDENT:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if export_format == "parquet" and pq is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the server")
+    
+    session_query = {}
+    if department_id:
+        session_query["department_id"] = department_id
+    if year:
+        session_query["year"] = year
+    if section:
+        session_query["section"] = section
+    if date_from or date_to:
+        session_query["start_time"] = date_range(date_from, date_to)
+    
+    if current_user["role"] == UserRole.COLLEGE_ADMIN:
+        session_query["college_id"] = current_user.get("college_id")
+    elif current_user["role"] == UserRole.DEPARTMENT_ADMIN:
+        session_query["department_id"] = current_user.get("department_id")
+    elif current_user["role"] == UserRole.FACULTY:
+        session_query["faculty_id"] = current_user["id"]
+    
+    batches = iter_export_batches(session_query, student_id)
+    filename = f"attendance-{date_from.date() if date_from else 'start'}-{date_to.date() if date_to else 'now'}"
+    if export_format == "parquet":
+        return StreamingResponse(
+            export_parquet(batches), media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.parquet"'}
+        )
+    return StreamingResponse(
+        export_csv(batches), media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+    )
+
+async def ranged_attendance(session_query: dict) -> tuple:
+    """(session count, sessions held per (department, year, section), marks per student) for matching sessions"""
+    held = {}
+    session_ids = []
+    projection = {"_id": 0, "id": 1, "department_id": 1, "year": 1, "section": 1}
+    async for session in db.sessions.find(session_query, projection):
+        session_ids.append(session["id"])
+        scope = (session.get("department_id"), session.get("year"), session.get("section"))
+        held[scope] = held.get(scope, 0) + 1
+    
+    attended = await marks_per_student(session_ids) if session_ids else {}
+    return len(session_ids), held, attended
+
+def sessions_held_for(held: dict, student: dict) -> int:
+    """Sessions a student's section was expected at; sessions without a year/section cover the whole department"""
+    return sum(
+        count for (department_id, year, section), count in held.items()
+        if department_id == student.get("department_id")
+        and (not year or year == student.get("year"))
+        and (not section or section == student.get("section"))
+    )
+
+async def attendance_analytics(
+    current_user: dict,
+    department_id: Optional[str] = None,
+    year: Optional[str] = None,
+    section: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> dict:
+    """Attendance totals, low-attendance students and insights within the caller's scope"""
     query = {}
     if department_id:
         query["department_id"] = department_id
@@ -674,49 +2803,58 @@ async def get_analytics(
     elif current_user["role"] == UserRole.COLLEGE_ADMIN:
         query["college_id"] = current_user.get("college_id")
     
-    # Get sessions
-    sessions = await db.sessions.find(query, {"_id": 0}).to_list(1000)
-    session_ids = [s["id"] for s in sessions]
-    
-    # Get attendance records
-    records = await db.attendance_records.find({"session_id": {"$in": session_ids}}, {"_id": 0}).to_list(10000)
-    
-    # Calculate stats
-    total_sessions = len(sessions)
-    total_attendance = len(records)
-    
-    # Group by student
-    student_attendance = {}
-    for record in records:
-        student_id = record["student_id"]
-        if student_id not in student_attendance:
-            student_attendance[student_id] = 0
-        student_attendance[student_id] += 1
-    
-    # Get students in department
-    student_query = {"role": UserRole.STUDENT}
+    # Per-student counters are maintained by create_session/mark_attendance
+    summary_query = {}
     if department_id:
-        student_query["department_id"] = department_id
+        summary_query["department_id"] = department_id
     if year:
-        student_query["year"] = year
+        summary_query["year"] = year
     if section:
-        student_query["section"] = section
+        summary_query["section"] = section
+    
+    if current_user["role"] == UserRole.DEPARTMENT_ADMIN:
+        summary_query["department_id"] = current_user.get("department_id")
+    elif current_user["role"] == UserRole.COLLEGE_ADMIN:
+        summary_query["college_id"] = current_user.get("college_id")
     
-    students = await db.users.find(student_query, {"_id": 0}).to_list(1000)
+    # A date range can't use the all-time counters: count that slice of sessions and marks instead
+    ranged = date_from or date_to
+    if ranged:
+        query["start_time"] = date_range(date_from, date_to)
+        total_sessions, held_by_scope, attended_by_student = await ranged_attendance(query)
+    else:
+        total_sessions = await db.sessions.count_documents(query)
     
-    # Calculate low attendance students (<75%)
+    student_attendance = {}
     low_attendance_students = []
-    for student in students:
-        attended = student_attendance.get(student["id"], 0)
-        percentage = (attended / total_sessions * 100) if total_sessions > 0 else 0
+    total_students = 0
+    projection = {
+        "_id": 0, "student_id": 1, "name": 1, "department_id": 1, "year": 1, "section": 1,
+        "sessions_held": 1, "sessions_attended": 1
+    }
+    async for summary in db.attendance_summaries.find(summary_query, projection):
+        total_students += 1
+        if ranged:
+            attended = attended_by_student.get(summary["student_id"], 0)
+            held = sessions_held_for(held_by_scope, summary)
+        else:
+            attended = summary.get("sessions_attended", 0)
+            held = summary.get("sessions_held", 0)
+        if attended:
+            student_attendance[summary["student_id"]] = attended
+        
+        percentage = (attended / held * 100) if held > 0 else 0
         if percentage < 75:
             low_attendance_students.append({
-                "student_id": student["id"],
-                "name": student["name"],
+                "student_id": summary["student_id"],
+                "name": summary.get("name"),
                 "attendance": attended,
                 "percentage": round(percentage, 2)
             })
     
+    low_attendance_students.sort(key=lambda s: (s["percentage"], s["name"] or ""))
+    total_attendance = sum(student_attendance.values())
+    
     # Mock AI insights
     insights = [
         {"type": "info", "message": f"Total sessions conducted: {total_sessions}"},
@@ -738,56 +2876,546 @@ async def get_analytics(
         "total_sessions": total_sessions,
         "total_attendance": total_attendance,
         "average_attendance_per_session": total_attendance / total_sessions if total_sessions > 0 else 0,
-        "total_students": len(students),
+        "total_students": total_students,
         "low_attendance_students": low_attendance_students,
         "insights": insights,
         "student_stats": student_attendance
     }
 
+@api_router.get("/attendance/analytics")
+async def get_analytics(
+    department_id: Optional[str] = None,
+    year: Optional[str] = None,
+    section: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from", description="sessions starting at or after"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="sessions starting before"),
+    current_user: dict = Depends(get_current_user)
+):
+    return await attendance_analytics(current_user, department_id, year, section, date_from, date_to)
+
+@api_router.get("/attendance/trends")
+async def get_trends(
+    date_from: Optional[datetime] = Query(None, alias="from", description="first day, inclusive"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="day after the last"),
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    group_by: Optional[str] = Query(None, description="comma-separated: department_id, year, section, subject"),
+    department_id: Optional[str] = None,
+    year: Optional[str] = None,
+    section: Optional[str] = None,
+    subject: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Attendance rate per period from the daily rollups of closed sessions"""
+    if current_user["role"] == UserRole.STUDENT:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    groups = [group.strip() for group in group_by.split(",") if group.strip()] if group_by else []
+    unknown = set(groups) - set(TREND_GROUPS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {', '.join(sorted(unknown))}")
+    
+    query = {}
+    if date_from or date_to:
+        query["day"] = date_range(date_from, date_to)
+    for field, value in (("department_id", department_id), ("year", year), ("section", section), ("subject", subject)):
+        if value:
+            query[field] = value
+    
+    if current_user["role"] == UserRole.COLLEGE_ADMIN:
+        query["college_id"] = current_user.get("college_id")
+    elif current_user["role"] in [UserRole.DEPARTMENT_ADMIN, UserRole.FACULTY]:
+        query["department_id"] = current_user.get("department_id")
+    
+    series = []
+    async for row in db.attendance_daily.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"period": f"${granularity}", **{group: f"${group}" for group in groups}},
+            "sessions_held": {"$sum": "$sessions_held"},
+            "expected": {"$sum": "$expected"},
+            "present": {"$sum": "$present"}
+        }}
+    ]):
+        key = row.pop("_id")
+        row["rate"] = round(row["present"] / row["expected"], 4) if row["expected"] else None
+        series.append({**key, **row})
+    series.sort(key=lambda point: (point["period"], *(str(point.get(group) or "") for group in groups)))
+    
+    return {"granularity": granularity, "group_by": groups, "series": series}
+
+# ==================== DASHBOARD ENDPOINTS ====================
+
+DASHBOARD_ROLES = {"college": UserRole.COLLEGE_ADMIN, "department": UserRole.DEPARTMENT_ADMIN, "student": UserRole.STUDENT}
+
+async def dashboard_list(collection, query: dict, projection: dict, sort: list) -> list:
+    return await collection.find(query, projection).sort(sort).limit(DASHBOARD_LIST_LIMIT).to_list(DASHBOARD_LIST_LIMIT)
+
+async def dashboard_departments(query: dict) -> list:
+    _, docs = await get_reference_data("departments")
+    return [
+        {field: doc.get(field) for field in DASHBOARD_DEPARTMENT_FIELDS}
+        for doc in docs if all(doc.get(key) == value for key, value in query.items())
+    ]
+
+async def sessions_per_faculty(session_query: dict) -> dict:
+    """faculty_id -> (sessions held, whether one is active) for matching sessions"""
+    counts = {}
+    async for row in db.sessions.aggregate([
+        {"$match": session_query},
+        {"$group": {"_id": "$faculty_id", "sessions": {"$sum": 1}, "active": {"$max": "$is_active"}}}
+    ]):
+        counts[row["_id"]] = (row["sessions"], bool(row["active"]))
+    return counts
+
+async def student_marks(student_id: str) -> list:
+    """A student's most recent marks, newest first, in either storage layout"""
+    if ATTENDANCE_STORAGE == "sheets":
+        records = [
+            {field: record[field] for field in DASHBOARD_RECORD_FIELDS}
+            async for _, _, record in iter_sheet_rows({"student_id": student_id})
+        ]
+    else:
+        records = await dashboard_list(
+            db.attendance_records, {"student_id": student_id},
+            {"_id": 0, **{field: 1 for field in DASHBOARD_RECORD_FIELDS}}, [("marked_at", DESCENDING)]
+        )
+    records.sort(key=lambda record: record["marked_at"], reverse=True)
+    return records[:DASHBOARD_LIST_LIMIT]
+
+async def face_enrolled(user_id: str) -> bool:
+    return await db.users.count_documents(
+        {"id": user_id, "face_embedding": {"$type": "binData"}, "face_embedding_version": faces.EMBEDDING_VERSION}, limit=1
+    ) > 0
+
+async def college_dashboard(current_user: dict) -> dict:
+    college_id = current_user.get("college_id")
+    faculty_query = {"role": UserRole.FACULTY, "college_id": college_id}
+    student_query = {"role": UserRole.STUDENT, "college_id": college_id}
+    departments, faculty, students, faculty_count, student_count, analytics = await asyncio.gather(
+        dashboard_departments({"college_id": college_id}),
+        dashboard_list(db.users, faculty_query, DASHBOARD_USER_PROJECTION, USER_SORT),
+        dashboard_list(db.users, student_query, DASHBOARD_USER_PROJECTION, USER_SORT),
+        db.users.count_documents(faculty_query),
+        db.users.count_documents(student_query),
+        attendance_analytics(current_user)
+    )
+    return {
+        "departments": departments,
+        "faculty": faculty,
+        "students": students,
+        "counts": {
+            "departments": len(departments),
+            "faculty": faculty_count,
+            "students": student_count,
+            "sessions": analytics["total_sessions"]
+        },
+        "analytics": analytics
+    }
+
+async def department_dashboard(current_user: dict, year: Optional[str], section: Optional[str]) -> dict:
+    department_id = current_user.get("department_id")
+    faculty_query = {"role": UserRole.FACULTY, "department_id": department_id}
+    student_query = {"role": UserRole.STUDENT, **roster_query(department_id, year, section)}
+    session_query = roster_query(department_id, year, section)
+    departments, faculty, faculty_count, students, student_count, sessions, held_by_faculty, analytics = await asyncio.gather(
+        dashboard_departments({"id": department_id}),
+        dashboard_list(db.users, faculty_query, DASHBOARD_USER_PROJECTION, USER_SORT),
+        db.users.count_documents(faculty_query),
+        dashboard_list(db.users, student_query, DASHBOARD_USER_PROJECTION, USER_SORT),
+        db.users.count_documents(student_query),
+        dashboard_list(db.sessions, session_query, DASHBOARD_SESSION_PROJECTION, SESSION_SORT),
+        sessions_per_faculty(session_query),
+        attendance_analytics(current_user, department_id, year, section)
+    )
+    for member in faculty:
+        member["session_count"], member["active_session"] = held_by_faculty.get(member["id"], (0, False))
+    return {
+        "department": departments[0] if departments else None,
+        "faculty": faculty,
+        "students": students,
+        "sessions": sessions,
+        "counts": {"faculty": faculty_count, "students": student_count, "sessions": analytics["total_sessions"]},
+        "analytics": analytics
+    }
+
+async def student_dashboard(current_user: dict) -> dict:
+    session_query = {
+        "department_id": current_user.get("department_id"),
+        "year": current_user.get("year"),
+        "section": current_user.get("section"),
+        "is_active": True
+    }
+    sessions, attendance, enrolled = await asyncio.gather(
+        dashboard_list(db.sessions, session_query, DASHBOARD_SESSION_PROJECTION, SESSION_SORT),
+        student_marks(current_user["id"]),
+        face_enrolled(current_user["id"])
+    )
+    return {
+        "sessions": [session for session in sessions if session_open(session)],
+        "attendance": attendance,
+        "face_enrolled": enrolled
+    }
+
+@api_router.get("/dashboard/{role}")
+async def get_dashboard(
+    role: str,
+    year: Optional[str] = None,
+    section: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Everything a role's dashboard renders, in one response"""
+    if role not in DASHBOARD_ROLES:
+        raise HTTPException(status_code=404, detail="Unknown dashboard")
+    if current_user["role"] != DASHBOARD_ROLES[role]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if role == "college":
+        return await college_dashboard(current_user)
+    if role == "department":
+        return await department_dashboard(current_user, year, section)
+    return await student_dashboard(current_user)
+
 # ==================== FACE RECOGNITION ENDPOINTS ====================
 
+def stored_embedding(user_data: Optional[dict]) -> Optional[np.ndarray]:
+    """The user's embedding, or None if missing or produced by an older pipeline"""
+    if not user_data or user_data.get("face_embedding_version") != faces.EMBEDDING_VERSION:
+        return None
+    embedding = user_data.get("face_embedding")
+    return faces.unpack_embedding(embedding) if isinstance(embedding, bytes) else None
+
+def get_face_executor():
+    global face_executor
+    if face_executor is None and FACE_PROCESS_WORKERS > 0:
+        # spawn, not fork: the parent holds Motor's threads and sockets
+        face_executor = ProcessPoolExecutor(
+            max_workers=FACE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return face_executor
+
+def record_face_stage(stage: str, elapsed_ms: float):
+    stats = face_stage_stats.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    stage_duration.observe(elapsed_ms / 1000, stage=f"face_{stage}")
+
+def upload_limit(path: str) -> Optional[int]:
+    """Largest file the upload route at path accepts, or None for routes that take no files"""
+    if path.startswith("/api/face/") or path.endswith("/face-attendance"):
+        return FACE_UPLOAD_MAX_BYTES
+    if path == "/api/users/import":
+        return IMPORT_MAX_BYTES
+    return None
+
+class UploadLimitMiddleware:
+    """Rejects oversized uploads before UploadFile spools them.
+    
+    A declared Content-Length over the limit is answered with 413 without reading
+    the body; a body without one is counted as it streams and cut off at the limit.
+    The limit allows UPLOAD_CHUNK_BYTES for the multipart envelope; read_upload
+    still holds the file itself to the exact size.
+    """
+    
+    def __init__(self, app, limit_for):
+        self.app = app
+        self.limit_for = limit_for
+    
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        
+        limit += UPLOAD_CHUNK_BYTES
+        detail = {"detail": f"Upload exceeds {limit - UPLOAD_CHUNK_BYTES} bytes"}
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            return await JSONResponse(detail, status_code=413)(scope, receive, send)
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail["detail"])
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload in chunks, rejecting it with 413 as soon as it passes max_bytes"""
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+    chunks, total = [], 0
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def release_face_slot():
+    global face_pending
+    face_pending -= 1
+
+async def extract_faces(file: UploadFile, largest_only: bool = False) -> list:
+    """Read an upload and run faces.analyze_image on the face pool, recording per-stage timings"""
+    global face_pending
+    started = time.perf_counter()
+    data = await read_upload(file, FACE_UPLOAD_MAX_BYTES)
+    record_face_stage("upload", (time.perf_counter() - started) * 1000)
+    
+    executor = get_face_executor()
+    started = time.perf_counter()
+    if executor is None:
+        results, timings = faces.analyze_image(data, largest_only)
+    else:
+        if face_pending >= FACE_MAX_PENDING:
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "2"})
+        # The slot is held until the pool finishes the image, not until this request gives up on it:
+        # a timed-out task keeps its worker busy, so releasing on timeout would overcommit the pool
+        loop = asyncio.get_running_loop()
+        face_pending += 1
+        try:
+            future = executor.submit(faces.analyze_image, data, largest_only)
+        except BaseException:
+            face_pending -= 1
+            raise
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(release_face_slot))
+        try:
+            results, timings = await asyncio.wait_for(asyncio.wrap_future(future), FACE_TASK_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Face processing timed out")
+    
+    elapsed = (time.perf_counter() - started) * 1000
+    for stage, stage_ms in timings.items():
+        record_face_stage(stage, stage_ms)
+    record_face_stage("queue", max(0.0, elapsed - sum(timings.values())))
+    record_face_stage("total", elapsed)
+    if largest_only and not results:
+        raise faces.FaceError("No face detected")
+    return results
+
+async def load_roster_index(department_id: str, year: Optional[str], section: Optional[str]) -> dict:
+    """Embedding matrix of the enrolled students a session is held for"""
+    query = {
+        "role": UserRole.STUDENT,
+        "department_id": department_id,
+        "face_embedding_version": faces.EMBEDDING_VERSION
+    }
+    if year:
+        query["year"] = year
+    if section:
+        query["section"] = section
+    
+    students, vectors = [], []
+    projection = {"_id": 0, "id": 1, "name": 1, "college_id": 1, "department_id": 1, "year": 1, "section": 1, "face_embedding": 1}
+    async for student in db.users.find(query, projection):
+        vectors.append(faces.unpack_embedding(student.pop("face_embedding")))
+        students.append(student)
+    
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, faces.EMBEDDING_SIZE), dtype=np.float32)
+    return {"students": students, "matrix": matrix}
+
+async def get_roster_index(department_id: str, year: Optional[str], section: Optional[str]) -> dict:
+    return await roster_cache.get(
+        (department_id, year, section), lambda: load_roster_index(department_id, year, section)
+    )
+
 @api_router.post("/face/enroll")
 async def enroll_face(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
     try:
-        contents = await file.read()
-        face_hash = hashlib.sha256(contents).hexdigest()
+        [(_, embedding)] = await extract_faces(file, largest_only=True)
         
         await db.users.update_one(
             {"id": current_user["id"]},
-            {"$set": {"face_embedding": face_hash}}
+            {"$set": {
+                "face_embedding": Binary(faces.pack_embedding(embedding)),
+                "face_embedding_version": faces.EMBEDDING_VERSION
+            }}
         )
+        if current_user["role"] == UserRole.STUDENT:
+            roster_cache.invalidate_where(lambda key: key[0] == current_user.get("department_id"))
         
         return {"message": "Face enrolled successfully"}
-    except Exception as e:
+    except faces.FaceError as e:
         raise HTTPException(status_code=400, detail=f"Face enrollment failed: {str(e)}")
 
 @api_router.post("/face/verify")
 async def verify_face(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    user_data = await db.users.find_one(
+        {"id": current_user["id"]}, {"_id": 0, "face_embedding": 1, "face_embedding_version": 1}
+    )
+    enrolled = stored_embedding(user_data)
+    if enrolled is None:
+        raise HTTPException(status_code=400, detail="No face enrolled")
+    
     try:
-        user_data = await db.users.find_one({"id": current_user["id"]}, {"_id": 0})
-        if not user_data.get("face_embedding"):
-            raise HTTPException(status_code=400, detail="No face enrolled")
-        
-        contents = await file.read()
-        face_hash = hashlib.sha256(contents).hexdigest()
-        
-        # Mock verification - in production use actual face recognition
-        is_match = True
-        
-        return {"verified": is_match, "confidence": 0.95}
-    except Exception as e:
+        [(_, embedding)] = await extract_faces(file, largest_only=True)
+    except faces.FaceError as e:
         raise HTTPException(status_code=400, detail=f"Face verification failed: {str(e)}")
+    
+    confidence = float(faces.cosine_scores(enrolled[None, :], embedding)[0])
+    return {"verified": confidence >= FACE_MATCH_THRESHOLD, "confidence": round(confidence, 4)}
+
+@api_router.get("/face/stats")
+async def get_face_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in [UserRole.UNIVERSITY_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {
+        "workers": FACE_PROCESS_WORKERS,
+        "pending": face_pending,
+        "stages": {
+            stage: {**stats, "avg_ms": round(stats["total_ms"] / stats["count"], 2)}
+            for stage, stats in face_stage_stats.items()
+        }
+    }
+
+async def store_face_marks(session_id: str, students: list) -> set:
+    """Write face marks for students of one session, returning the indexes already marked"""
+    docs = [
+        AttendanceRecord(session_id=session_id, student_id=student["id"], method="face").model_dump()
+        for student in students
+    ]
+    duplicates = set()
+    for i, error in (await store_marks(docs)).items():
+        if not isinstance(error, DuplicateKeyError):
+            raise error
+        duplicates.add(i)
+    
+    committed = [
+        (doc, student_summary_seed(students[i]))
+        for i, doc in enumerate(docs) if i not in duplicates
+    ]
+    if committed:
+        await record_committed_marks(committed)
+    return duplicates
+
+@api_router.post("/sessions/{session_id}/face-attendance")
+async def mark_class_attendance(session_id: str, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    """Match the students in one classroom photo, marking them when FACE_CLASS_AUTO_MARK is on"""
+    if current_user["role"] not in [UserRole.FACULTY, UserRole.DEPARTMENT_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    session = await get_session_meta(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session_open(session):
+        raise HTTPException(status_code=400, detail="Session has expired")
+    
+    try:
+        detected = await extract_faces(file)
+    except faces.FaceError as e:
+        raise HTTPException(status_code=400, detail=f"Face detection failed: {str(e)}")
+    
+    roster = await get_roster_index(session["department_id"], session.get("year"), session.get("section"))
+    report = [
+        {"box": list(box), "student_id": None, "name": None, "confidence": None, "margin": None, "status": "unmatched"}
+        for box, _ in detected
+    ]
+    assignment = {}
+    if detected and len(roster["students"]):
+        scores = roster["matrix"] @ np.vstack([vector for _, vector in detected]).T
+        assignment = faces.assign_faces(scores, FACE_MATCH_THRESHOLD, FACE_MATCH_MARGIN)
+        margins = faces.best_margins(scores)
+        for face, entry in enumerate(report):
+            entry["confidence"] = round(float(scores[:, face].max()), 4)
+            entry["margin"] = round(float(margins[face]), 4) if np.isfinite(margins[face]) else None
+    
+    matched = sorted(assignment.items())
+    for face, row in matched:
+        student = roster["students"][row]
+        # Without auto-marking the matches are suggestions for faculty to confirm; nothing is written
+        report[face].update({
+            "student_id": student["id"], "name": student.get("name"), "status": "marked" if FACE_CLASS_AUTO_MARK else "suggested"
+        })
+    
+    marking = [roster["students"][row] for _, row in matched] if FACE_CLASS_AUTO_MARK else []
+    duplicates = await store_face_marks(session_id, marking) if marking else set()
+    for i in duplicates:
+        report[matched[i][0]]["status"] = "already_marked"
+    
+    return {
+        "session_id": session_id,
+        "faces_detected": len(detected),
+        "roster_enrolled": len(roster["students"]),
+        "auto_mark": FACE_CLASS_AUTO_MARK,
+        "marked": len(marking) - len(duplicates),
+        "already_marked": len(duplicates),
+        "suggested": 0 if FACE_CLASS_AUTO_MARK else len(matched),
+        "unmatched": len(detected) - len(matched),
+        "faces": report
+    }
+
+@api_router.post("/sessions/{session_id}/face-attendance/confirm")
+async def confirm_class_attendance(
+    session_id: str, request: ConfirmFaceAttendanceRequest, current_user: dict = Depends(get_current_user)
+):
+    """Mark the classroom-photo suggestions faculty accepted"""
+    if current_user["role"] not in [UserRole.FACULTY, UserRole.DEPARTMENT_ADMIN, UserRole.COLLEGE_ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    session = await get_session_meta(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session_open(session):
+        raise HTTPException(status_code=400, detail="Session has expired")
+    
+    # Only students the session is held for can be marked, the same scope a student's own mark is held to
+    student_ids = list(dict.fromkeys(request.student_ids))
+    query = {
+        "role": UserRole.STUDENT,
+        "id": {"$in": student_ids},
+        **roster_query(session["department_id"], session.get("year"), session.get("section"))
+    }
+    projection = {"_id": 0, "id": 1, "name": 1, "college_id": 1, "department_id": 1, "year": 1, "section": 1}
+    found = {student["id"]: student async for student in db.users.find(query, projection)}
+    outside = [student_id for student_id in student_ids if student_id not in found]
+    if outside:
+        raise HTTPException(status_code=400, detail=f"Students not enrolled in this session: {', '.join(outside)}")
+    
+    students = [found[student_id] for student_id in student_ids]
+    duplicates = await store_face_marks(session_id, students)
+    return {
+        "session_id": session_id,
+        "marked": len(students) - len(duplicates),
+        "already_marked": len(duplicates),
+        "students": [
+            {"student_id": student["id"], "status": "already_marked" if i in duplicates else "marked"}
+            for i, student in enumerate(students)
+        ]
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 # Include the router
 app.include_router(api_router)
 
+app.add_middleware(UploadLimitMiddleware, limit_for=upload_limit)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-QR-Expires-In"],
+)
+app.add_middleware(
+    profiling.ProfilingMiddleware,
+    authorize=profiling_allowed,
+    profile_dir=PROFILE_DIR,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    interval_ms=PROFILE_INTERVAL_MS,
+    slow_ms=SLOW_REQUEST_MS,
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -795,6 +3423,69 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks = []
+
+@app.on_event("startup")
+async def create_indexes():
+    # One index at a time, so a unique index over existing duplicates doesn't hold back the others
+    failed = set()
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                failed.add(collection)
+                logger.error(
+                    "Could not build index %s on %s: %s; run dedupe_unique_keys.py --check to list the duplicates",
+                    index.document["name"], collection, e
+                )
+    logger.info("Ensured indexes on %d collections", len(INDEXES) - len(failed))
+
+@app.on_event("startup")
+async def seed_attendance_summaries():
+    """Build attendance_summaries on a database that predates them.
+    
+    Without a summary, a student's first mark upserts one with sessions_held 0,
+    so percentages count marks against sessions the summary never saw. Once the
+    collection holds anything, keeping it in step is rebuild_summaries.py's job.
+    """
+    if await db.attendance_summaries.estimated_document_count():
+        return
+    if not await db.users.find_one({"role": UserRole.STUDENT}, {"_id": 1}):
+        return
+    try:
+        report = await rebuild_attendance_summaries()
+    except PyMongoError:
+        logger.exception("Seeding attendance summaries failed; run rebuild_summaries.py")
+        return
+    logger.info("Seeded attendance summaries for %d students", report["students"])
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if SESSION_CACHE_CHANGE_STREAM:
+        background_tasks.append(asyncio.create_task(watch_session_changes()))
+    if attendance_batcher is not None:
+        attendance_batcher.start()
+    if LIVE_FEED_CHANGE_STREAM:
+        background_tasks.append(asyncio.create_task(watch_attendance_changes()))
+    # Access tokens issued before this worker started may have been revoked since
+    started = datetime.now(timezone.utc)
+    await load_token_versions(started - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    background_tasks.append(asyncio.create_task(sync_token_versions(started)))
+    background_tasks.append(asyncio.create_task(expiry_scheduler.run()))
+    background_tasks.append(asyncio.create_task(metrics.monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL)))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if attendance_batcher is not None:
+        await attendance_batcher.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     client.close()
+    if password_executor is not None:
+        password_executor.shutdown(wait=False, cancel_futures=True)
+    if face_executor is not None:
+        face_executor.shutdown(wait=False, cancel_futures=True)
+    if import_executor is not None:
+        import_executor.shutdown(wait=False, cancel_futures=True)
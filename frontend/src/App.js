@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import { BrowserRouter, Routes, Route, Navigate } from 'react-router-dom';
 import Login from './pages/Login';
 import UniversityDashboard from './pages/UniversityDashboard';
@@ -14,6 +15,54 @@ const API = `${BACKEND_URL}/api`;
 
 export { API };
 
+// Access tokens are short-lived: on a 401, trade the refresh token for a new
+// pair once and replay the request with the new access token. Concurrent
+// callers share one refresh; a failed refresh signs the user out.
+let refreshing = null;
+
+export const refreshAccessToken = () => {
+  refreshing = refreshing || axios
+    .post(`${API}/auth/refresh`, { refresh_token: localStorage.getItem('refresh_token') })
+    .then((response) => {
+      localStorage.setItem('token', response.data.access_token);
+      localStorage.setItem('refresh_token', response.data.refresh_token);
+      localStorage.setItem('user', JSON.stringify(response.data.user));
+      return response.data.access_token;
+    })
+    .catch((refreshError) => {
+      localStorage.removeItem('token');
+      localStorage.removeItem('refresh_token');
+      localStorage.removeItem('user');
+      window.location.assign('/login');
+      throw refreshError;
+    })
+    .finally(() => {
+      refreshing = null;
+    });
+  return refreshing;
+};
+
+axios.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    if (
+      error.response?.status !== 401 ||
+      !localStorage.getItem('refresh_token') ||
+      !original ||
+      original._retried ||
+      original.url?.startsWith(`${API}/auth/`)
+    ) {
+      return Promise.reject(error);
+    }
+
+    original._retried = true;
+    const accessToken = await refreshAccessToken();
+    original.headers = { ...original.headers, Authorization: `Bearer ${accessToken}` };
+    return axios(original);
+  }
+);
+
 function App() {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -27,15 +76,17 @@ function App() {
     setLoading(false);
   }, []);
 
-  const handleLogin = (userData, token) => {
+  const handleLogin = (userData, token, refreshToken) => {
     setUser(userData);
     localStorage.setItem('token', token);
+    if (refreshToken) localStorage.setItem('refresh_token', refreshToken);
     localStorage.setItem('user', JSON.stringify(userData));
   };
 
   const handleLogout = () => {
     setUser(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     localStorage.removeItem('user');
   };
 
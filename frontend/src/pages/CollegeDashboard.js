@@ -14,7 +14,7 @@ function CollegeDashboard({ user, onLogout }) {
   const [departments, setDepartments] = useState([]);
   const [faculty, setFaculty] = useState([]);
   const [students, setStudents] = useState([]);
-  const [sessions, setSessions] = useState([]);
+  const [counts, setCounts] = useState({ departments: 0, faculty: 0, students: 0, sessions: 0 });
   const [analytics, setAnalytics] = useState(null);
   const [newDepartment, setNewDepartment] = useState({ name: '', college_id: user.college_id });
   const [isDeptDialogOpen, setIsDeptDialogOpen] = useState(false);
@@ -28,18 +28,12 @@ function CollegeDashboard({ user, onLogout }) {
 
   const fetchData = async () => {
     try {
-      const [deptRes, facultyRes, studentRes, sessionRes, analyticsRes] = await Promise.all([
-        axios.get(`${API}/departments?college_id=${user.college_id}`, config),
-        axios.get(`${API}/users?role=faculty`, config),
-        axios.get(`${API}/users?role=student`, config),
-        axios.get(`${API}/sessions`, config),
-        axios.get(`${API}/attendance/analytics`, config)
-      ]);
-      setDepartments(deptRes.data);
-      setFaculty(facultyRes.data);
-      setStudents(studentRes.data);
-      setSessions(sessionRes.data);
-      setAnalytics(analyticsRes.data);
+      const { data } = await axios.get(`${API}/dashboard/college`, config);
+      setDepartments(data.departments);
+      setFaculty(data.faculty);
+      setStudents(data.students);
+      setCounts(data.counts);
+      setAnalytics(data.analytics);
     } catch (error) {
       toast.error('Failed to fetch data');
     }
@@ -101,7 +95,7 @@ function CollegeDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-blue-600" data-testid="departments-count">{departments.length}</p>
+              <p className="text-2xl font-bold text-blue-600" data-testid="departments-count">{counts.departments}</p>
             </CardContent>
           </Card>
 
@@ -113,7 +107,7 @@ function CollegeDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-purple-600" data-testid="faculty-count">{faculty.length}</p>
+              <p className="text-2xl font-bold text-purple-600" data-testid="faculty-count">{counts.faculty}</p>
             </CardContent>
           </Card>
 
@@ -125,7 +119,7 @@ function CollegeDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-green-600" data-testid="students-count">{students.length}</p>
+              <p className="text-2xl font-bold text-green-600" data-testid="students-count">{counts.students}</p>
             </CardContent>
           </Card>
 
@@ -137,7 +131,7 @@ function CollegeDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-orange-600" data-testid="sessions-count">{sessions.length}</p>
+              <p className="text-2xl font-bold text-orange-600" data-testid="sessions-count">{counts.sessions}</p>
             </CardContent>
           </Card>
         </div>
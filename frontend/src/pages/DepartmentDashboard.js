@@ -16,7 +16,8 @@ function DepartmentDashboard({ user, onLogout }) {
   const [students, setStudents] = useState([]);
   const [sessions, setSessions] = useState([]);
   const [analytics, setAnalytics] = useState(null);
-  const [departments, setDepartments] = useState([]);
+  const [department, setDepartment] = useState(null);
+  const [counts, setCounts] = useState({ faculty: 0, students: 0, sessions: 0 });
   const [selectedYear, setSelectedYear] = useState('all');
   const [selectedSection, setSelectedSection] = useState('all');
 
@@ -29,22 +30,17 @@ function DepartmentDashboard({ user, onLogout }) {
 
   const fetchData = async () => {
     try {
-      const yearParam = selectedYear !== 'all' ? `&year=${selectedYear}` : '';
-      const sectionParam = selectedSection !== 'all' ? `&section=${selectedSection}` : '';
+      const params = {};
+      if (selectedYear !== 'all') params.year = selectedYear;
+      if (selectedSection !== 'all') params.section = selectedSection;
       
-      const [deptRes, facultyRes, studentRes, sessionRes, analyticsRes] = await Promise.all([
-        axios.get(`${API}/departments`, config),
-        axios.get(`${API}/users?role=faculty&department_id=${user.department_id}`, config),
-        axios.get(`${API}/users?role=student&department_id=${user.department_id}${yearParam}${sectionParam}`, config),
-        axios.get(`${API}/sessions?department_id=${user.department_id}${yearParam}${sectionParam}`, config),
-        axios.get(`${API}/attendance/analytics?department_id=${user.department_id}${yearParam}${sectionParam}`, config)
-      ]);
-      
-      setDepartments(deptRes.data);
-      setFaculty(facultyRes.data);
-      setStudents(studentRes.data);
-      setSessions(sessionRes.data);
-      setAnalytics(analyticsRes.data);
+      const { data } = await axios.get(`${API}/dashboard/department`, { ...config, params });
+      setDepartment(data.department);
+      setFaculty(data.faculty);
+      setStudents(data.students);
+      setSessions(data.sessions);
+      setCounts(data.counts);
+      setAnalytics(data.analytics);
     } catch (error) {
       toast.error('Failed to fetch data');
     }
@@ -70,19 +66,8 @@ function DepartmentDashboard({ user, onLogout }) {
     }
   };
 
-  const currentDept = departments.find(d => d.id === user.department_id);
-  const availableYears = currentDept?.years || ['1st', '2nd', '3rd', '4th'];
-  const availableSections = currentDept?.sections || ['A', 'B', 'C'];
-
-  // Calculate faculty performance
-  const facultyPerformance = faculty.map(f => {
-    const facultySessions = sessions.filter(s => s.faculty_id === f.id);
-    return {
-      ...f,
-      sessionCount: facultySessions.length,
-      activeSession: facultySessions.find(s => s.is_active)
-    };
-  });
+  const availableYears = department?.years || ['1st', '2nd', '3rd', '4th'];
+  const availableSections = department?.sections || ['A', 'B', 'C'];
 
   return (
     <div className="min-h-screen p-6">
@@ -91,7 +76,7 @@ function DepartmentDashboard({ user, onLogout }) {
           <div>
             <h1 className="text-4xl font-bold gradient-text" data-testid="department-dashboard-title">Department Admin Dashboard</h1>
             <p className="text-gray-600 mt-2">Welcome, {user.name}</p>
-            {currentDept && <p className="text-sm text-gray-500">Department: {currentDept.name}</p>}
+            {department && <p className="text-sm text-gray-500">Department: {department.name}</p>}
           </div>
           <Button onClick={onLogout} variant="outline" data-testid="logout-btn">
             <LogOut className="w-4 h-4 mr-2" />
@@ -146,7 +131,7 @@ function DepartmentDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-blue-600" data-testid="faculty-count">{faculty.length}</p>
+              <p className="text-2xl font-bold text-blue-600" data-testid="faculty-count">{counts.faculty}</p>
             </CardContent>
           </Card>
 
@@ -158,7 +143,7 @@ function DepartmentDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-green-600" data-testid="students-count">{students.length}</p>
+              <p className="text-2xl font-bold text-green-600" data-testid="students-count">{counts.students}</p>
             </CardContent>
           </Card>
 
@@ -170,7 +155,7 @@ function DepartmentDashboard({ user, onLogout }) {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <p className="text-2xl font-bold text-purple-600" data-testid="sessions-count">{sessions.length}</p>
+              <p className="text-2xl font-bold text-purple-600" data-testid="sessions-count">{counts.sessions}</p>
             </CardContent>
           </Card>
 
@@ -204,7 +189,7 @@ function DepartmentDashboard({ user, onLogout }) {
               </CardHeader>
               <CardContent>
                 <div className="space-y-3">
-                  {facultyPerformance.map((f) => (
+                  {faculty.map((f) => (
                     <div key={f.id} className="p-4 bg-gray-50 rounded-lg" data-testid={`faculty-item-${f.id}`}>
                       <div className="flex justify-between items-center">
                         <div className="flex-1">
@@ -213,9 +198,9 @@ function DepartmentDashboard({ user, onLogout }) {
                           {f.subject && <p className="text-sm text-blue-600">Subject: {f.subject}</p>}
                           <div className="flex gap-4 mt-2">
                             <span className="text-xs px-3 py-1 bg-blue-100 text-blue-800 rounded-full">
-                              Sessions: {f.sessionCount}
+                              Sessions: {f.session_count}
                             </span>
-                            {f.activeSession && (
+                            {f.active_session && (
                               <span className="text-xs px-3 py-1 bg-green-100 text-green-800 rounded-full">
                                 Active Session
                               </span>
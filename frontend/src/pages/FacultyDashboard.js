@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
-import { API } from '../App';
+import { API, refreshAccessToken } from '../App';
 import { toast } from 'sonner';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
@@ -14,6 +14,10 @@ function FacultyDashboard({ user, onLogout }) {
   const [sessions, setSessions] = useState([]);
   const [departments, setDepartments] = useState([]);
   const [activeSession, setActiveSession] = useState(null);
+  const [qrImage, setQrImage] = useState(null);
+  const [qrRefresh, setQrRefresh] = useState(0);
+  const [liveCount, setLiveCount] = useState(null);
+  const [recentMarks, setRecentMarks] = useState([]);
   const [newSession, setNewSession] = useState({
     department_id: '',
     session_type: 'morning',
@@ -31,6 +35,83 @@ function FacultyDashboard({ user, onLogout }) {
     checkFaceEnrollment();
   }, []);
 
+  useEffect(() => {
+    if (!activeSession) {
+      setQrImage(null);
+      return;
+    }
+    let objectUrl;
+    let refreshTimer;
+    axios.get(`${API}/sessions/${activeSession.id}/qr`, { ...config, responseType: 'blob' })
+      .then((response) => {
+        objectUrl = URL.createObjectURL(response.data);
+        setQrImage(objectUrl);
+        // Rotating QR codes expire; fetch the next one when this one does
+        const expiresIn = parseInt(response.headers['x-qr-expires-in'], 10);
+        if (activeSession.qr_mode === 'rotating' && expiresIn > 0) {
+          refreshTimer = setTimeout(() => setQrRefresh((n) => n + 1), expiresIn * 1000);
+        }
+      })
+      .catch(() => toast.error('Failed to load QR code'));
+    return () => {
+      clearTimeout(refreshTimer);
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
+  }, [activeSession?.id, qrRefresh]);
+
+  // Live marks over server-sent events; fetch rather than EventSource so the bearer token can be sent
+  useEffect(() => {
+    setLiveCount(null);
+    setRecentMarks([]);
+    if (!activeSession) return;
+    const controller = new AbortController();
+
+    const handleFrame = (frame) => {
+      const event = frame.match(/^event: (.*)$/m);
+      const data = frame.match(/^data: (.*)$/m);
+      if (!event || !data) return null;
+      const payload = JSON.parse(data[1]);
+      if (payload.count !== undefined) setLiveCount(payload.count);
+      if (event[1] === 'mark') setRecentMarks((marks) => [payload.record, ...marks].slice(0, 10));
+      return event[1];
+    };
+
+    const listen = async () => {
+      while (!controller.signal.aborted) {
+        const response = await fetch(`${API}/sessions/${activeSession.id}/live`, {
+          headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+          signal: controller.signal
+        });
+        if (response.status === 401) {
+          // fetch bypasses the axios interceptor: refresh the access token the same way, then reconnect
+          await refreshAccessToken();
+          continue;
+        }
+        if (!response.ok) return;
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let lastEvent = null;
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const frames = buffer.split('\n\n');
+          buffer = frames.pop();
+          frames.forEach((frame) => { lastEvent = handleFrame(frame) || lastEvent; });
+        }
+        if (lastEvent === 'ended') return;
+        // Dropped for lagging or disconnected: reconnect for a fresh snapshot
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+      }
+    };
+
+    listen().catch((error) => {
+      if (error.name !== 'AbortError') console.error('Live feed stopped', error);
+    });
+    return () => controller.abort();
+  }, [activeSession?.id]);
+
   const fetchData = async () => {
     try {
       const [sessionRes, deptRes] = await Promise.all([
@@ -50,7 +131,7 @@ function FacultyDashboard({ user, onLogout }) {
   const checkFaceEnrollment = async () => {
     try {
       const response = await axios.get(`${API}/auth/me`, config);
-      setIsFaceEnrolled(!!response.data.face_embedding);
+      setIsFaceEnrolled(!!response.data.face_enrolled);
     } catch (error) {
       console.error('Failed to check face enrollment');
     }
@@ -157,7 +238,17 @@ function FacultyDashboard({ user, onLogout }) {
                     <p><span className="font-semibold">Session Type:</span> <span className="session-badge badge-morning">{activeSession.session_type}</span></p>
                     <p><span className="font-semibold">Date:</span> {activeSession.session_date}</p>
                     <p><span className="font-semibold">Started:</span> {new Date(activeSession.start_time).toLocaleTimeString()}</p>
+                    {liveCount !== null && (
+                      <p data-testid="live-attendance-count"><span className="font-semibold">Marked:</span> {liveCount}</p>
+                    )}
                   </div>
+                  {recentMarks.length > 0 && (
+                    <ul className="mt-2 text-sm text-gray-600" data-testid="live-attendance-list">
+                      {recentMarks.map((mark) => (
+                        <li key={mark.id}>{mark.name || mark.student_id} · {new Date(mark.marked_at).toLocaleTimeString()}</li>
+                      ))}
+                    </ul>
+                  )}
                   <Button 
                     onClick={() => handleEndSession(activeSession.id)} 
                     variant="destructive" 
@@ -168,10 +259,10 @@ function FacultyDashboard({ user, onLogout }) {
                     End Session
                   </Button>
                 </div>
-                {activeSession.qr_code && (
+                {qrImage && (
                   <div className="qr-container">
                     <p className="font-semibold">Scan QR to Mark Attendance</p>
-                    <img src={activeSession.qr_code} alt="QR Code" className="w-64 h-64" data-testid="session-qr-code" />
+                    <img src={qrImage} alt="QR Code" className="w-64 h-64" data-testid="session-qr-code" />
                   </div>
                 )}
               </div>
@@ -38,7 +38,7 @@ function Login({ onLogin }) {
       
       const response = await axios.post(`${API}${endpoint}`, payload);
       toast.success(isLogin ? 'Login successful!' : 'Registration successful!');
-      onLogin(response.data.user, response.data.access_token);
+      onLogin(response.data.user, response.data.access_token, response.data.refresh_token);
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Authentication failed');
     }
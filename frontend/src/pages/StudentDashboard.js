@@ -22,34 +22,19 @@ function StudentDashboard({ user, onLogout }) {
 
   useEffect(() => {
     fetchData();
-    checkFaceEnrollment();
   }, []);
 
   const fetchData = async () => {
     try {
-      const [sessionRes, attendanceRes] = await Promise.all([
-        axios.get(`${API}/sessions`, config),
-        axios.get(`${API}/attendance/records`, config)
-      ]);
-      
-      // Only show active sessions
-      const activeSessions = sessionRes.data.filter(s => s.is_active);
-      setSessions(activeSessions);
-      setMyAttendance(attendanceRes.data);
+      const { data } = await axios.get(`${API}/dashboard/student`, config);
+      setSessions(data.sessions);
+      setMyAttendance(data.attendance);
+      setIsFaceEnrolled(data.face_enrolled);
     } catch (error) {
       toast.error('Failed to fetch data');
     }
   };
 
-  const checkFaceEnrollment = async () => {
-    try {
-      const response = await axios.get(`${API}/auth/me`, config);
-      setIsFaceEnrolled(!!response.data.face_embedding);
-    } catch (error) {
-      console.error('Failed to check face enrollment');
-    }
-  };
-
   const handleEnrollFace = async () => {
     if (!faceFile) {
       toast.error('Please select a face image');
@@ -0,0 +1,55 @@
+"""The API against an in-memory mongomock-motor database, as in `loadtest.py --db memory`."""
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["attendance_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "token_versions", {})
+    monkeypatch.setattr(server, "attendance_batcher", None)
+    monkeypatch.setattr(server, "ATTENDANCE_STORAGE", "records")
+    server.session_cache.invalidate()
+    for collection in ("users", "sessions", "attendance_records", "attendance_summaries"):
+        await database[collection].create_indexes(server.INDEXES[collection])
+    yield database
+    server.session_cache.invalidate()
+
+
+@pytest.fixture
+async def client(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http
+
+
+@pytest.fixture
+def make_user(db):
+    """Insert a user and return (user, Authorization headers for a fresh access token)"""
+    async def make(role: str, **fields):
+        user = {
+            "id": str(uuid.uuid4()), "email": f"{uuid.uuid4().hex[:8]}@test.edu", "name": role.title(),
+            "role": role, "is_active": True, "college_id": "college", **fields
+        }
+        await db.users.insert_one(dict(user))
+        token = server.token_response(user).access_token
+        return user, {"Authorization": f"Bearer {token}"}
+    return make
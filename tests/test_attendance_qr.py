@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+SCOPE = {"department_id": "cs", "year": "1st", "section": "A"}
+
+
+async def open_session(db, **fields) -> dict:
+    now = datetime.now(timezone.utc)
+    session = {
+        "id": fields.pop("id", "session-1"), "college_id": "college", "faculty_id": "faculty", **SCOPE,
+        "session_type": "morning", "session_date": now.date().isoformat(), "is_active": True,
+        "start_time": now, "expires_at": now + timedelta(hours=1), **fields
+    }
+    await db.sessions.insert_one(dict(session))
+    return session
+
+
+async def mark(client, headers, session_id: str, **body):
+    return await client.post(
+        "/api/attendance/mark", json={"session_id": session_id, "method": "qr", **body}, headers=headers
+    )
+
+
+@pytest.fixture
+async def student(make_user):
+    return await make_user(server.UserRole.STUDENT, **SCOPE)
+
+
+async def test_rotating_session_accepts_signed_payload(db, client, student):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    response = await mark(client, student[1], session["id"], qr_token=server.session_qr_payload(session))
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("qr_token", [None, json.dumps({"session_id": "session-1", "token": None})])
+async def test_rotating_session_rejects_missing_token(db, client, student, qr_token):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    response = await mark(client, student[1], session["id"], qr_token=qr_token)
+    assert response.status_code == 400
+    assert await db.attendance_records.count_documents({}) == 0
+
+
+async def test_rotating_session_rejects_forged_signature(db, client, student):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    payload = json.loads(server.session_qr_payload(session))
+    payload["token"] = "0" * 64
+    response = await mark(client, student[1], session["id"], qr_token=json.dumps(payload))
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("field, value", [
+    ("department_id", ["cs"]), ("year", {"$ne": None}), ("section", 1), ("expires", "never"), ("token", "é" * 64)
+])
+async def test_malformed_rotating_payload_is_a_bad_request(db, client, student, field, value):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    payload = json.loads(server.session_qr_payload(session))
+    payload[field] = value
+    response = await mark(client, student[1], session["id"], qr_token=json.dumps(payload))
+    assert response.status_code == 400
+
+
+async def test_static_session_checks_stored_token(db, client, student):
+    session = await open_session(db, qr_mode="static", qr_token="secret")
+    wrong = await mark(client, student[1], session["id"], qr_token=json.dumps({"session_id": session["id"], "token": "guess"}))
+    assert wrong.status_code == 400
+    right = await mark(client, student[1], session["id"], qr_token=server.session_qr_payload(session))
+    assert right.status_code == 200
+
+
+async def test_session_without_stored_token_rejects_null_token(db, client, student):
+    session = await open_session(db, qr_token=None)
+    response = await mark(client, student[1], session["id"], qr_token=json.dumps({"session_id": session["id"], "token": None}))
+    assert response.status_code == 400
+
+
+async def test_rotating_session_rejects_marks_after_it_ends(db, client, student, make_user):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    payload = server.session_qr_payload(session)
+    # Warm the session cache the way earlier marks would
+    await server.get_session_meta(session["id"])
+    _, faculty = await make_user(server.UserRole.FACULTY, **SCOPE)
+    assert (await client.put(f"/api/sessions/{session['id']}/end", headers=faculty)).status_code == 200
+    
+    response = await mark(client, student[1], session["id"], qr_token=payload)
+    assert response.status_code == 400
+    assert await db.attendance_records.count_documents({}) == 0
+
+
+async def test_rotating_session_rejects_marks_after_it_expires(db, client, student):
+    session = await open_session(db, qr_mode="rotating", qr_token=None)
+    payload = server.session_qr_payload(session)
+    await server.expire_session(session["id"], datetime.now(timezone.utc))
+    response = await mark(client, student[1], session["id"], qr_token=payload)
+    assert response.status_code == 400
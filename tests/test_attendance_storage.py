@@ -0,0 +1,124 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+STUDENT = str(uuid.uuid4())
+START = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+
+
+def record(session_id: str, student_id: str, minute: int = 0, **fields) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "session_id": session_id, "student_id": student_id,
+        "marked_at": START + timedelta(minutes=minute), "method": "qr", "ip_address": None,
+        "location": None, "is_proxy": False, **fields
+    }
+
+
+def without_ids(records: list) -> list:
+    return [{k: v for k, v in r.items() if k not in ("id", "_id")} for r in records]
+
+
+@pytest.fixture
+def sheets(db, monkeypatch):
+    monkeypatch.setattr(server, "ATTENDANCE_STORAGE", "sheets")
+    return db
+
+
+@pytest.mark.parametrize("student_id", [STUDENT, "legacy-student-7", STUDENT.upper()])
+def test_student_ids_round_trip_through_packing(student_id):
+    assert server.unpack_student_id(server.pack_student_id(student_id)) == student_id
+
+
+def test_only_canonical_uuids_are_packed():
+    assert isinstance(server.pack_student_id(STUDENT), Binary)
+    assert server.pack_student_id(STUDENT.upper()) == STUDENT.upper()
+    assert server.pack_student_id("legacy-student-7") == "legacy-student-7"
+
+
+async def test_repeat_mark_on_a_sheet_is_a_duplicate_key(sheets):
+    assert await server.store_marks([record("s1", STUDENT), record("s1", "legacy-student-7", 1)]) == {}
+    failures = await server.store_marks([record("s1", STUDENT, 2)])
+    assert isinstance(failures[0], DuplicateKeyError)
+    sheet = await sheets.attendance_sheets.find_one({"_id": "s1"})
+    assert len(sheet["students"]) == len(sheet["marked_at"]) == len(sheet["methods"]) == 2
+
+
+async def test_sheet_records_keep_details_and_mark_order(sheets):
+    await server.store_marks([
+        record("s1", "legacy-student-7", 0),
+        record("s1", STUDENT, 1, ip_address="10.0.0.1", is_proxy=True),
+    ])
+    sheet = await sheets.attendance_sheets.find_one({"_id": "s1"})
+    records = server.sheet_records(sheet)
+    assert [r["student_id"] for r in records] == ["legacy-student-7", STUDENT]
+    assert records[1]["ip_address"] == "10.0.0.1" and records[1]["is_proxy"] is True
+    assert records[0]["ip_address"] is None and records[0]["is_proxy"] is False
+    assert records[1]["id"] == f"s1:{STUDENT}"
+
+
+async def test_read_adapters_agree_across_storages(db, monkeypatch):
+    marks = [record("s1", STUDENT, 0), record("s1", "legacy-student-7", 1), record("s2", STUDENT, 2)]
+    results = {}
+    for storage in ("records", "sheets"):
+        monkeypatch.setattr(server, "ATTENDANCE_STORAGE", storage)
+        assert await server.store_marks([dict(mark) for mark in marks]) == {}
+        results[storage] = {
+            "marked": await server.marked_student_ids("s1"),
+            "per_session": await server.marks_per_session(["s1", "s2"]),
+            "per_student": await server.marks_per_student(),
+            "per_student_s2": await server.marks_per_student(["s2"]),
+            "session_marks": [
+                (r["session_id"], r["student_id"]) async for r in server.iter_session_marks(["s1", "s2"])
+            ],
+            "student_marks": [
+                r["session_id"] async for r in server.iter_session_marks(["s1", "s2"], STUDENT)
+            ],
+        }
+    assert results["records"] == results["sheets"]
+    assert results["sheets"]["marked"] == {STUDENT, "legacy-student-7"}
+    assert results["sheets"]["per_student"] == {STUDENT: 2, "legacy-student-7": 1}
+    assert results["sheets"]["student_marks"] == ["s1", "s2"]
+
+
+async def test_sheet_pages_follow_mark_order_and_filters(sheets):
+    await server.store_marks([record("s1", f"student-{i}", i) for i in range(5)] + [record("s2", STUDENT, 9)])
+    
+    page = await server.sheet_list_response({}, 2, None, "json")
+    seen = [r["student_id"] for r in page["items"]]
+    while page["next"]:
+        page = await server.sheet_list_response({}, 2, page["next"], "json")
+        seen += [r["student_id"] for r in page["items"]]
+    assert seen == [f"student-{i}" for i in range(5)] + [STUDENT]
+    
+    window = {"marked_at": {"$gte": START + timedelta(minutes=1), "$lt": START + timedelta(minutes=3)}}
+    page = await server.sheet_list_response({"session_id": "s1", **window}, 10, None, "json")
+    assert [r["student_id"] for r in page["items"]] == ["student-1", "student-2"]
+    page = await server.sheet_list_response({"student_id": STUDENT}, 10, None, "json")
+    assert [r["session_id"] for r in page["items"]] == ["s2"]
+
+
+async def test_migration_copies_both_ways_and_can_be_rerun(db):
+    marks = [record("s1", STUDENT, 0, location={"lat": 1.0}), record("s1", "legacy-student-7", 1), record("s2", STUDENT, 2)]
+    await db.attendance_records.insert_many([dict(mark) for mark in marks])
+    
+    check = await server.migrate_attendance_storage("sheets", apply=False)
+    assert check == {"source_marks": 3, "target_marks_before": 0, "copied": 0}
+    assert await db.attendance_sheets.count_documents({}) == 0
+    
+    report = await server.migrate_attendance_storage("sheets", batch_size=2)
+    assert report["copied"] == 3 and report["target_marks_after"] == 3
+    assert (await server.migrate_attendance_storage("sheets"))["copied"] == 0
+    
+    await db.attendance_records.delete_many({})
+    report = await server.migrate_attendance_storage("records")
+    assert report["copied"] == 3 and report["target_marks_after"] == 3
+    restored = await db.attendance_records.find({}).sort([("session_id", 1), ("marked_at", 1)]).to_list(None)
+    assert without_ids(restored) == without_ids(marks)
+    assert {r["id"] for r in restored} == {f"{m['session_id']}:{m['student_id']}" for m in marks}
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def gated_loader(gate: asyncio.Event, value, calls: list):
+    async def load():
+        calls.append(value)
+        await gate.wait()
+        return value
+    return load
+
+
+async def test_waiters_released_when_key_invalidated_mid_load():
+    cache = server.AsyncTTLCache(maxsize=10, ttl=60)
+    gate = asyncio.Event()
+    calls = []
+    first = asyncio.create_task(cache.get("k", gated_loader(gate, "v1", calls)))
+    second = asyncio.create_task(cache.get("k", gated_loader(gate, "v2", calls)))
+    await asyncio.sleep(0)
+    cache.invalidate("k")
+    gate.set()
+    assert await asyncio.wait_for(asyncio.gather(first, second), timeout=1) == ["v1", "v1"]
+    assert calls == ["v1"]
+    # The stale value was not stored
+    assert await cache.get("k", gated_loader(gate, "v3", calls)) == "v3"
+
+
+async def test_waiters_released_when_everything_invalidated_mid_load():
+    cache = server.AsyncTTLCache(maxsize=10, ttl=60)
+    gate = asyncio.Event()
+    waiters = [asyncio.create_task(cache.get("k", gated_loader(gate, "v", []))) for _ in range(3)]
+    await asyncio.sleep(0)
+    cache.invalidate()
+    gate.set()
+    assert await asyncio.wait_for(asyncio.gather(*waiters), timeout=1) == ["v", "v", "v"]
+
+
+async def test_loader_error_reaches_waiters():
+    cache = server.AsyncTTLCache(maxsize=10, ttl=60)
+    gate = asyncio.Event()
+    
+    async def failing():
+        await gate.wait()
+        raise ValueError("boom")
+    
+    first = asyncio.create_task(cache.get("k", failing))
+    second = asyncio.create_task(cache.get("k", failing))
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.wait_for(asyncio.gather(first, second, return_exceptions=True), timeout=1)
+    assert [type(result) for result in results] == [ValueError, ValueError]
+
+
+async def test_cancelled_loader_does_not_cancel_waiters():
+    cache = server.AsyncTTLCache(maxsize=10, ttl=60)
+    gate = asyncio.Event()
+    calls = []
+    first = asyncio.create_task(cache.get("k", gated_loader(gate, "v1", calls)))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(cache.get("k", gated_loader(gate, "v2", calls)))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    gate.set()
+    assert await asyncio.wait_for(second, timeout=1) == "v2"
+    assert first.cancelled()
+    assert calls == ["v1", "v2"]
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+SCOPE = {"department_id": "cs", "year": "1st", "section": "A"}
+
+
+@pytest.fixture
+async def session(db):
+    now = datetime.now(timezone.utc)
+    session = {
+        "id": "session-1", "college_id": "college", "faculty_id": "faculty", **SCOPE,
+        "session_type": "morning", "session_date": now.date().isoformat(), "is_active": True,
+        "start_time": now, "expires_at": now + timedelta(hours=1)
+    }
+    await db.sessions.insert_one(dict(session))
+    return session
+
+
+async def confirm(client, headers, student_ids: list):
+    return await client.post(
+        "/api/sessions/session-1/face-attendance/confirm", json={"student_ids": student_ids}, headers=headers
+    )
+
+
+async def test_confirm_marks_accepted_suggestions(db, client, session, make_user):
+    first, _ = await make_user(server.UserRole.STUDENT, **SCOPE)
+    second, _ = await make_user(server.UserRole.STUDENT, **SCOPE)
+    _, faculty = await make_user(server.UserRole.FACULTY, **SCOPE)
+    
+    response = await confirm(client, faculty, [first["id"], second["id"], first["id"]])
+    assert response.status_code == 200
+    assert response.json()["marked"] == 2
+    records = await db.attendance_records.find({}, {"_id": 0, "student_id": 1, "method": 1}).to_list(None)
+    assert sorted(r["student_id"] for r in records) == sorted([first["id"], second["id"]])
+    assert {r["method"] for r in records} == {"face"}
+    summary = await db.attendance_summaries.find_one({"student_id": first["id"]})
+    assert summary["sessions_attended"] == 1
+
+
+async def test_confirm_reports_students_already_marked(db, client, session, make_user):
+    student, _ = await make_user(server.UserRole.STUDENT, **SCOPE)
+    _, faculty = await make_user(server.UserRole.FACULTY, **SCOPE)
+    assert (await confirm(client, faculty, [student["id"]])).json()["marked"] == 1
+    
+    body = (await confirm(client, faculty, [student["id"]])).json()
+    assert body["marked"] == 0
+    assert body["students"] == [{"student_id": student["id"], "status": "already_marked"}]
+    assert await db.attendance_records.count_documents({}) == 1
+
+
+async def test_confirm_rejects_students_outside_the_session(db, client, session, make_user):
+    inside, _ = await make_user(server.UserRole.STUDENT, **SCOPE)
+    outside, _ = await make_user(server.UserRole.STUDENT, **{**SCOPE, "section": "B"})
+    _, faculty = await make_user(server.UserRole.FACULTY, **SCOPE)
+    
+    response = await confirm(client, faculty, [inside["id"], outside["id"]])
+    assert response.status_code == 400
+    assert outside["id"] in response.json()["detail"]
+    assert await db.attendance_records.count_documents({}) == 0
+
+
+async def test_students_cannot_confirm(db, client, session, make_user):
+    student, headers = await make_user(server.UserRole.STUDENT, **SCOPE)
+    response = await confirm(client, headers, [student["id"]])
+    assert response.status_code == 403
+
+
+async def test_students_cannot_mark_by_face_while_face_marking_is_off(db, client, session, make_user):
+    _, headers = await make_user(server.UserRole.STUDENT, **SCOPE)
+    response = await client.post(
+        "/api/attendance/mark", json={"session_id": session["id"], "method": "face"}, headers=headers
+    )
+    assert response.status_code == 400
+    assert await db.attendance_records.count_documents({}) == 0
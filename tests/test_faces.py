@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+faces = pytest.importorskip("faces")
+
+
+def test_assign_faces_skips_low_margin_matches():
+    # rows are students, columns faces
+    scores = np.array([
+        [0.990, 0.980],
+        [0.988, 0.950],
+    ])
+    assert faces.assign_faces(scores, threshold=0.975, margin=0.005) == {1: 0}
+
+
+def test_assign_faces_never_falls_back_to_runner_up():
+    scores = np.array([
+        [0.99, 0.98],
+        [0.90, 0.97],
+    ])
+    # Face 1's best student is taken by face 0; it is not handed student 1 instead
+    assert faces.assign_faces(scores, threshold=0.95, margin=0.0) == {0: 0}
+
+
+def test_assign_faces_respects_threshold_with_single_student():
+    scores = np.array([[0.97, 0.98]])
+    assert faces.assign_faces(scores, threshold=0.975, margin=0.01) == {1: 0}
+    assert np.isinf(faces.best_margins(scores)).all()
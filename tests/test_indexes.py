@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def bare_db(monkeypatch):
+    """A database with no indexes, as an older deployment would have"""
+    database = AsyncMongoMockClient(tz_aware=True)["attendance_legacy"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+async def index_names(collection) -> set:
+    return set((await collection.index_information()).keys())
+
+
+async def add_duplicate_marks(db):
+    marked = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    await db.attendance_records.insert_many([
+        {"id": "late", "session_id": "s1", "student_id": "u1", "marked_at": marked + timedelta(minutes=5)},
+        {"id": "early", "session_id": "s1", "student_id": "u1", "marked_at": marked},
+        {"id": "other", "session_id": "s1", "student_id": "u2", "marked_at": marked},
+    ])
+
+
+async def test_startup_builds_what_it_can_over_duplicates(bare_db):
+    await add_duplicate_marks(bare_db)
+    await bare_db.users.insert_many([{"id": "a", "email": "x@test.edu"}, {"id": "b", "email": "x@test.edu"}])
+    
+    await server.create_indexes()
+    records = await index_names(bare_db.attendance_records)
+    assert "session_id_1_student_id_1" not in records
+    assert "student_id_1_marked_at_-1" in records
+    assert "id_1" in await index_names(bare_db.users)
+    assert "email_1" not in await index_names(bare_db.users)
+
+
+async def test_dedupe_keeps_the_earliest_mark_and_only_reports_users(bare_db):
+    await add_duplicate_marks(bare_db)
+    await bare_db.users.insert_many([{"id": "a", "email": "x@test.edu"}, {"id": "b", "email": "x@test.edu"}])
+    
+    check = await server.dedupe_unique_keys(apply=False)
+    assert check["attendance_records.session_id+student_id"]["duplicated_keys"] == 1
+    assert check["attendance_records.session_id+student_id"]["deleted"] == 0
+    assert await bare_db.attendance_records.count_documents({}) == 3
+    
+    report = await server.dedupe_unique_keys()
+    assert report["attendance_records.session_id+student_id"]["deleted"] == 1
+    assert report["users.email"]["deleted"] == 0
+    assert sorted(await bare_db.attendance_records.distinct("id")) == ["early", "other"]
+    assert await bare_db.users.count_documents({}) == 2
+    
+    await bare_db.users.delete_one({"id": "b"})
+    await server.create_indexes()
+    assert "session_id_1_student_id_1" in await index_names(bare_db.attendance_records)
+    assert "email_1" in await index_names(bare_db.users)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingWrite:
+    """A write() that records each batch and rejects the documents it is told to"""
+    
+    def __init__(self, reject=(), error=None):
+        self.batches = []
+        self.reject = set(reject)
+        self.error = error
+    
+    async def __call__(self, collection, docs):
+        self.batches.append([doc["n"] for doc in docs])
+        if self.error is not None:
+            raise self.error
+        return {i: DuplicateKeyError("duplicate key", 11000) for i, doc in enumerate(docs) if doc["n"] in self.reject}
+
+
+@pytest.fixture
+async def batcher_for():
+    batchers = []
+    
+    def make(max_batch: int, interval_ms: float, **kwargs):
+        batcher = server.InsertBatcher(None, max_batch, interval_ms, **kwargs)
+        batcher.start()
+        batchers.append(batcher)
+        return batcher
+    
+    yield make
+    for batcher in batchers:
+        await batcher.stop()
+
+
+async def test_full_batch_flushes_without_waiting_for_the_interval(batcher_for):
+    write = RecordingWrite()
+    batcher = batcher_for(3, 60_000, write=write)
+    started = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(batcher.submit({"n": n}) for n in range(3))), 5)
+    assert time.perf_counter() - started < 5
+    assert write.batches == [[0, 1, 2]]
+
+
+async def test_oversized_burst_is_split_into_max_batch_writes(batcher_for):
+    write = RecordingWrite()
+    batcher = batcher_for(2, 60_000, write=write)
+    await asyncio.wait_for(asyncio.gather(*(batcher.submit({"n": n}) for n in range(4))), 5)
+    assert write.batches == [[0, 1], [2, 3]]
+    assert (batcher.batches, batcher.inserted) == (2, 4)
+
+
+async def test_partial_batch_flushes_after_the_interval(batcher_for):
+    write = RecordingWrite()
+    batcher = batcher_for(100, 20, write=write)
+    started = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(batcher.submit({"n": 0}), batcher.submit({"n": 1})), 5)
+    assert time.perf_counter() - started >= 0.015
+    assert write.batches == [[0, 1]]
+
+
+async def test_rejected_documents_fail_only_their_own_caller(batcher_for):
+    committed = []
+    
+    async def after_commit(pairs):
+        committed.extend(pairs)
+    
+    batcher = batcher_for(3, 60_000, write=RecordingWrite(reject={1}), after_commit=after_commit)
+    results = await asyncio.gather(*(batcher.submit({"n": n}, f"ctx-{n}") for n in range(3)), return_exceptions=True)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], DuplicateKeyError)
+    assert committed == [({"n": 0}, "ctx-0"), ({"n": 2}, "ctx-2")]
+
+
+async def test_failed_write_reaches_every_caller_in_the_batch(batcher_for):
+    batcher = batcher_for(2, 60_000, write=RecordingWrite(error=PyMongoError("primary stepped down")))
+    results = await asyncio.gather(*(batcher.submit({"n": n}) for n in range(2)), return_exceptions=True)
+    assert all(isinstance(result, PyMongoError) for result in results)
+    assert batcher.inserted == 0
+
+
+async def test_after_commit_failure_does_not_fail_committed_callers(batcher_for):
+    async def after_commit(pairs):
+        raise RuntimeError("summary update failed")
+    
+    batcher = batcher_for(1, 60_000, write=RecordingWrite(), after_commit=after_commit)
+    assert await asyncio.wait_for(batcher.submit({"n": 0}), 5) is None
+
+
+async def test_stop_flushes_queued_marks_and_refuses_new_ones():
+    write = RecordingWrite()
+    batcher = server.InsertBatcher(None, 100, 60_000, write=write)
+    batcher.start()
+    pending = asyncio.ensure_future(batcher.submit({"n": 0}))
+    await asyncio.sleep(0)
+    await batcher.stop()
+    assert await pending is None
+    assert write.batches == [[0]]
+    with pytest.raises(HTTPException) as raised:
+        await batcher.submit({"n": 1})
+    assert raised.value.status_code == 503
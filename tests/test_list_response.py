@@ -0,0 +1,78 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def items(db):
+    # Equal scores force the tie-break onto the second sort key
+    await db.items.insert_many([{"n": n, "score": n // 3} for n in range(10)])
+    return db.items
+
+
+async def body_of(response) -> bytes:
+    return b"".join([chunk if isinstance(chunk, bytes) else chunk.encode() async for chunk in response.body_iterator])
+
+
+async def collect_pages(collection, sort: list, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        page = await server.list_response(collection, {}, {}, sort, limit, cursor, "json")
+        pages.append([doc["n"] for doc in page["items"]])
+        cursor = page["next"]
+        if cursor is None:
+            return pages
+
+
+async def test_keyset_pages_cover_every_row_once(items):
+    assert await collect_pages(items, server.RECORD_SORT, 4) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+async def test_keyset_pages_break_ties_on_later_keys(items):
+    sort = [("score", DESCENDING), ("n", ASCENDING)]
+    pages = await collect_pages(items, sort, 3)
+    assert sum(pages, []) == [9, 6, 7, 8, 3, 4, 5, 0, 1, 2]
+
+
+async def test_last_full_page_has_no_next(items):
+    page = await server.list_response(items, {}, {}, server.RECORD_SORT, 10, None, "json")
+    assert len(page["items"]) == 10 and page["next"] is None
+    assert all("_id" not in doc for doc in page["items"])
+
+
+async def test_query_and_projection_apply_to_pages(items):
+    page = await server.list_response(items, {"score": 1}, {"_id": 0, "n": 1}, server.RECORD_SORT, 2, None, "json")
+    assert page["items"] == [{"n": 3}, {"n": 4}]
+    page = await server.list_response(items, {"score": 1}, {"_id": 0, "n": 1}, server.RECORD_SORT, 2, page["next"], "json")
+    assert page == {"items": [{"n": 5}], "next": None}
+
+
+async def test_ndjson_page_carries_the_cursor_in_a_header(items):
+    response = await server.list_response(items, {}, {}, server.RECORD_SORT, 4, None, "ndjson")
+    lines = (await body_of(response)).decode().splitlines()
+    assert [json.loads(line)["n"] for line in lines] == [0, 1, 2, 3]
+    
+    following = await server.list_response(items, {}, {}, server.RECORD_SORT, 4, response.headers["x-next-cursor"], "ndjson")
+    assert [json.loads(line)["n"] for line in (await body_of(following)).decode().splitlines()] == [4, 5, 6, 7]
+
+
+@pytest.mark.parametrize("response_format", ["json", "ndjson"])
+async def test_unpaged_lists_stream_every_row(items, response_format):
+    response = await server.list_response(items, {}, {}, server.RECORD_SORT, None, None, response_format)
+    body = (await body_of(response)).decode()
+    rows = json.loads(body) if response_format == "json" else [json.loads(line) for line in body.splitlines()]
+    assert [row["n"] for row in rows] == list(range(10))
+    assert all("_id" not in row for row in rows)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", server.encode_cursor([1, 2])])
+async def test_bad_cursor_is_a_400(items, cursor):
+    with pytest.raises(HTTPException) as raised:
+        await server.list_response(items, {}, {}, server.RECORD_SORT, 4, cursor, "json")
+    assert raised.value.status_code == 400
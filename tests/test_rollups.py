@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+DAY = datetime(2025, 3, 3, tzinfo=timezone.utc)
+
+
+async def add_session(db, session_id: str, hour: int, section: str = "A", marks: int = 1, **fields) -> dict:
+    session = {
+        "id": session_id, "college_id": "college", "department_id": "cs", "year": "1st", "section": section,
+        "subject": "Maths", "is_active": False, "start_time": DAY + timedelta(hours=hour), **fields
+    }
+    await db.sessions.insert_one(dict(session))
+    if marks:
+        await db.attendance_records.insert_many([
+            {"id": f"{session_id}-{i}", "session_id": session_id, "student_id": f"student-{i}",
+             "method": "qr", "marked_at": session["start_time"], "is_proxy": False}
+            for i in range(marks)
+        ])
+    return session
+
+
+async def bucket_totals(db) -> dict:
+    return {
+        bucket["section"]: (bucket["sessions_held"], bucket["present"])
+        async for bucket in db.attendance_daily.find({}, {"_id": 0})
+    }
+
+
+@pytest.fixture
+async def rollup_db(db):
+    await db.attendance_daily.create_indexes(server.INDEXES["attendance_daily"])
+    return db
+
+
+async def test_backfill_matches_session_rollups(rollup_db):
+    db = rollup_db
+    await add_session(db, "s1", 9, marks=2)
+    await add_session(db, "s2", 11, marks=1)
+    assert await server.roll_up_session("s1")
+    report = await server.backfill_daily_rollups()
+    assert report["buckets"] == 1
+    assert await bucket_totals(db) == {"A": (2, 3)}
+    # Re-running changes nothing
+    await server.backfill_daily_rollups()
+    assert await bucket_totals(db) == {"A": (2, 3)}
+
+
+async def test_rollups_landing_during_backfill_are_kept(rollup_db, monkeypatch):
+    db = rollup_db
+    await add_session(db, "s1", 9, marks=2)
+    # Closes while the backfill runs: one into a bucket the backfill rebuilds, one into a new bucket
+    await add_session(db, "late-a", 10, marks=1, is_active=True)
+    await add_session(db, "late-b", 10, section="B", marks=4, is_active=True)
+    
+    count_marks = server.marks_per_session
+    closed = False
+    
+    async def close_during_backfill(session_ids):
+        nonlocal closed
+        counts = await count_marks(session_ids)
+        if not closed:
+            closed = True
+            for session_id in ("late-a", "late-b"):
+                await db.sessions.update_one({"id": session_id}, {"$set": {"is_active": False}})
+                assert await server.roll_up_session(session_id)
+        return counts
+    
+    monkeypatch.setattr(server, "marks_per_session", close_during_backfill)
+    report = await server.backfill_daily_rollups()
+    
+    assert await bucket_totals(db) == {"A": (2, 3), "B": (1, 4)}
+    assert report["retried"] == 1 and report["unsettled"] == 0
+    # Neither late session is counted twice by a later backfill or rollup
+    monkeypatch.setattr(server, "marks_per_session", count_marks)
+    assert not await server.roll_up_session("late-a")
+    await server.backfill_daily_rollups()
+    assert await bucket_totals(db) == {"A": (2, 3), "B": (1, 4)}
+
+
+async def test_backfill_removes_buckets_without_sessions(rollup_db):
+    db = rollup_db
+    await add_session(db, "s1", 9)
+    assert await server.roll_up_session("s1")
+    await db.sessions.delete_one({"id": "s1"})
+    report = await server.backfill_daily_rollups()
+    assert report["removed"] == 1
+    assert await bucket_totals(db) == {}
+
+
+async def test_failed_rollup_releases_its_claim(rollup_db, monkeypatch):
+    db = rollup_db
+    await add_session(db, "s1", 9, marks=2)
+    await add_session(db, "s2", 11, marks=1)
+    count_marks = server.marks_per_session
+    
+    async def failing(session_ids):
+        raise server.PyMongoError("connection reset")
+    
+    monkeypatch.setattr(server, "marks_per_session", failing)
+    with pytest.raises(server.PyMongoError):
+        await server.roll_up_session("s1")
+    session = await db.sessions.find_one({"id": "s1"})
+    assert "rolled_up_at" not in session and "rolled_up_by" not in session
+    
+    monkeypatch.setattr(server, "marks_per_session", count_marks)
+    await server.backfill_daily_rollups()
+    assert await bucket_totals(db) == {"A": (2, 3)}
+
+
+async def test_backfill_recounts_abandoned_session_claims(rollup_db):
+    db = rollup_db
+    await add_session(db, "s1", 9, marks=2)
+    # A worker claimed the session and died before its bucket write
+    abandoned = datetime.now(timezone.utc) - server.ROLLUP_CLAIM_TIMEOUT - timedelta(minutes=1)
+    await db.sessions.update_one({"id": "s1"}, {"$set": {"rolled_up_at": abandoned, "rolled_up_by": server.ROLLED_UP_BY_SESSION}})
+    await server.backfill_daily_rollups()
+    assert await bucket_totals(db) == {"A": (1, 2)}
+
+
+async def test_legacy_string_start_time_is_left_for_the_backfill(rollup_db):
+    db = rollup_db
+    await add_session(db, "s1", 9, start_time="2025-03-03T09:00:00")
+    assert not await server.roll_up_session("s1")
+    assert "rolled_up_at" not in await db.sessions.find_one({"id": "s1"})
+
+
+async def test_ending_a_session_succeeds_when_its_rollup_fails(rollup_db, client, make_user, monkeypatch):
+    db = rollup_db
+    _, faculty = await make_user(server.UserRole.FACULTY, department_id="cs")
+    await add_session(db, "s1", 9, is_active=True)
+    
+    async def failing(session_id):
+        raise server.PyMongoError("connection reset")
+    
+    monkeypatch.setattr(server, "roll_up_session", failing)
+    response = await client.put("/api/sessions/s1/end", headers=faculty)
+    assert response.status_code == 200
+    assert (await db.sessions.find_one({"id": "s1"}))["is_active"] is False
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+SCOPE = {"department_id": "cs", "year": "1st", "section": "A"}
+
+
+async def add_history(db, make_user):
+    """Two sessions and one mark from before summaries were kept"""
+    student, _ = await make_user(server.UserRole.STUDENT, **SCOPE)
+    await make_user(server.UserRole.STUDENT, **{**SCOPE, "section": "B"})
+    start = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+    await db.sessions.insert_many([
+        {"id": "s1", **SCOPE, "is_active": False, "start_time": start},
+        {"id": "s2", "department_id": "cs", "year": "1st", "section": None, "is_active": False, "start_time": start},
+    ])
+    await db.attendance_records.insert_one({"id": "r1", "session_id": "s1", "student_id": student["id"], "marked_at": start})
+    return student
+
+
+async def test_startup_seeds_missing_summaries_from_history(db, make_user):
+    student = await add_history(db, make_user)
+    await server.seed_attendance_summaries()
+    
+    summary = await db.attendance_summaries.find_one({"student_id": student["id"]})
+    assert (summary["sessions_held"], summary["sessions_attended"]) == (2, 1)
+    assert await db.attendance_summaries.count_documents({}) == 2
+
+
+async def test_startup_leaves_existing_summaries_alone(db, make_user):
+    student = await add_history(db, make_user)
+    await db.attendance_summaries.insert_one({"student_id": student["id"], "sessions_held": 7, "sessions_attended": 3})
+    await server.seed_attendance_summaries()
+    
+    summary = await db.attendance_summaries.find_one({"student_id": student["id"]})
+    assert (summary["sessions_held"], summary["sessions_attended"]) == (7, 3)
+    assert await db.attendance_summaries.count_documents({}) == 1
+
+
+async def test_first_mark_after_seeding_stays_within_sessions_held(db, make_user):
+    student = await add_history(db, make_user)
+    await server.seed_attendance_summaries()
+    await server.record_committed_marks([
+        ({"session_id": "s2", "student_id": student["id"]}, server.student_summary_seed(student))
+    ])
+    summary = await db.attendance_summaries.find_one({"student_id": student["id"]})
+    assert summary["sessions_attended"] <= summary["sessions_held"]
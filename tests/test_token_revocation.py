@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_revocation_applies_on_the_worker_that_suspends(db, client, make_user):
+    _, admin = await make_user(server.UserRole.COLLEGE_ADMIN)
+    student, headers = await make_user(server.UserRole.STUDENT)
+    assert (await client.get("/api/sessions?limit=1", headers=headers)).status_code == 200
+    assert (await client.put(f"/api/users/{student['id']}/suspend", headers=admin)).status_code == 200
+    assert (await client.get("/api/sessions?limit=1", headers=headers)).status_code == 401
+
+
+async def test_freshly_started_worker_enforces_earlier_revocation(db, client, make_user, monkeypatch):
+    monkeypatch.setattr(server, "background_tasks", [])
+    student, headers = await make_user(server.UserRole.STUDENT)
+    # Suspended through another worker before this one started
+    await server.update_user_and_revoke({"id": student["id"]}, {"$set": {"is_active": False}})
+    monkeypatch.setattr(server, "token_versions", {})
+    
+    await server.app.router.startup()
+    try:
+        response = await client.get("/api/sessions?limit=1", headers=headers)
+    finally:
+        await server.app.router.shutdown()
+    assert response.status_code == 401
+
+
+async def test_revocations_older_than_token_lifetime_are_not_loaded(db, monkeypatch):
+    stale = datetime.now(timezone.utc) - timedelta(minutes=server.ACCESS_TOKEN_EXPIRE_MINUTES + 5)
+    await db.users.insert_one({"id": "old", "token_version": 3, "token_version_updated_at": stale})
+    await server.load_token_versions(datetime.now(timezone.utc) - timedelta(minutes=server.ACCESS_TOKEN_EXPIRE_MINUTES))
+    assert "old" not in server.token_versions
@@ -0,0 +1,71 @@
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import UploadFile
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def reject_read(*args):
+    raise AssertionError("the route should not have been reached")
+
+
+async def test_declared_oversized_upload_is_rejected_before_the_body_is_read(db, client, make_user, monkeypatch):
+    monkeypatch.setattr(server, "FACE_UPLOAD_MAX_BYTES", 1024)
+    monkeypatch.setattr(server, "read_upload", reject_read)
+    _, headers = await make_user(server.UserRole.STUDENT)
+    body = b"x" * (1024 + server.UPLOAD_CHUNK_BYTES + 1)
+    response = await client.post(
+        "/api/face/verify", content=body, headers={**headers, "Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+
+
+async def test_streamed_oversized_upload_is_cut_off(db, client, make_user, monkeypatch):
+    monkeypatch.setattr(server, "FACE_UPLOAD_MAX_BYTES", 1024)
+    monkeypatch.setattr(server, "read_upload", reject_read)
+    _, headers = await make_user(server.UserRole.STUDENT)
+    
+    async def chunks():
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="face.jpg"\r\n\r\n'
+        for _ in range(4):
+            yield b"x" * server.UPLOAD_CHUNK_BYTES
+    
+    response = await client.post(
+        "/api/face/verify", content=chunks(), headers={**headers, "Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+
+
+async def test_timed_out_face_task_keeps_its_slot_until_the_worker_finishes(monkeypatch):
+    release = threading.Event()
+    
+    def slow_analyze(data, largest_only):
+        release.wait(5)
+        return [], {}
+    
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(server, "get_face_executor", lambda: executor)
+    monkeypatch.setattr(server.faces, "analyze_image", slow_analyze)
+    monkeypatch.setattr(server, "FACE_TASK_TIMEOUT", 0.05)
+    monkeypatch.setattr(server, "face_pending", 0)
+    try:
+        with pytest.raises(server.HTTPException) as raised:
+            await server.extract_faces(UploadFile(file=io.BytesIO(b"image")))
+        assert raised.value.status_code == 504
+        assert server.face_pending == 1
+        
+        release.set()
+        for _ in range(100):
+            if server.face_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert server.face_pending == 0
+    finally:
+        release.set()
+        executor.shutdown(wait=True)